@@ -0,0 +1,98 @@
+"""
+Recall@k and QPS of the ivf vector store per nprobe, against the exact top-k of the
+same vectors. Runs on a synthetic clustered corpus or, with --index, on the vectors
+of a numpy/ivf index under NUMPY_VECTOR_STORE_PATH (queries are stored vectors with
+noise). Nothing is written to the indexes.
+"""
+import os
+import tempfile
+from time import perf_counter
+
+import click
+import numpy as np
+from llama_index.schema import TextNode
+from llama_index.vector_stores.types import NodeWithEmbedding, VectorStoreQuery
+
+from expert_gpts.embeddings.vector_stores import NUMPY_VECTOR_STORE_PATH
+from expert_gpts.embeddings.vector_stores.ivf_store import IvfVectorStore
+from expert_gpts.embeddings.vector_stores.numpy_store import normalize, top_k
+
+
+def clustered_vectors(rng, centers: np.ndarray, size: int, spread: float):
+    vectors = centers[rng.integers(len(centers), size=size)]
+    return vectors + spread * rng.standard_normal(vectors.shape)
+
+
+def add_vectors(store: IvfVectorStore, vectors: np.ndarray, batch_size: int = 1000):
+    for start in range(0, len(vectors), batch_size):
+        end = start + batch_size
+        store.add(
+            [
+                NodeWithEmbedding(
+                    node=TextNode(text="", id_=f"node-{start + i}"),
+                    embedding=vector.tolist(),
+                )
+                for i, vector in enumerate(vectors[start:end])
+            ]
+        )
+
+
+@click.command()
+@click.option("--index", default=None, help="index name, synthetic corpus if not set")
+@click.option("--size", default=100000, help="synthetic corpus vectors")
+@click.option("--dim", default=256, help="synthetic corpus dimensions")
+@click.option("--clusters", default=1000, help="synthetic corpus topics")
+@click.option("--spread", default=1.0, help="synthetic corpus noise around a topic")
+@click.option("--queries", default=200)
+@click.option("--top-k", "k", default=10)
+@click.option("--nlist", default=256)
+@click.option("--nprobe", "nprobes", default="1,2,4,8,16,32", help="comma separated")
+def bench_ann(index, size, dim, clusters, spread, queries, k, nlist, nprobes):
+    rng = np.random.default_rng(0)
+    started_at = perf_counter()
+    with tempfile.TemporaryDirectory() as path:
+        if index:
+            # loads and trains in memory, only persist() writes
+            store = IvfVectorStore(os.path.join(NUMPY_VECTOR_STORE_PATH, index), nlist)
+            vectors = store._matrix[: store.size]
+            rows = rng.integers(store.size, size=queries)
+            noise = 0.1 / np.sqrt(store.dim)
+            query_vectors = vectors[rows] + noise * rng.standard_normal(
+                (queries, store.dim)
+            )
+        else:
+            centers = rng.standard_normal((clusters, dim))
+            store = IvfVectorStore(path, nlist)
+            add_vectors(store, clustered_vectors(rng, centers, size, spread))
+            query_vectors = clustered_vectors(rng, centers, queries, spread)
+        if not store.trained:
+            store.train()
+        click.echo(
+            f"{store.size} vectors, {nlist} lists, built in {perf_counter() - started_at:.1f}s"
+        )
+
+        matrix = store._matrix[: store.size]
+        exact = [
+            {store._ids[row] for row in top_k(matrix @ vector, k)}
+            for vector in normalize(query_vectors)
+        ]
+        for nprobe in [int(nprobe) for nprobe in nprobes.split(",")] + [nlist]:
+            store.nprobe = nprobe
+            hits, started_at = 0, perf_counter()
+            for vector, expected in zip(query_vectors, exact):
+                result = store.query(
+                    VectorStoreQuery(
+                        query_embedding=vector.tolist(), similarity_top_k=k
+                    )
+                )
+                hits += len(expected.intersection(result.ids))
+            elapsed = perf_counter() - started_at
+            label = "exact" if nprobe >= nlist else f"nprobe {nprobe}"
+            click.echo(
+                f"{label:>10}: recall@{k} {hits / (queries * k):.3f} | "
+                f"{queries / elapsed:.0f} QPS"
+            )
+
+
+if __name__ == "__main__":
+    bench_ann()
@@ -0,0 +1,353 @@
+"""
+Benchmarks for the chat history storage, run against a throwaway SQLite database
+"""
+import os
+import statistics
+import tempfile
+import uuid
+from datetime import datetime
+from time import perf_counter
+
+import click
+
+
+def setup_database(database_url):
+    if not database_url:
+        database_url = f"sqlite:///{tempfile.mkdtemp()}/bench_chat_history.sqlite"
+    # the engine is created on import so the url must be set before
+    os.environ["DATABASE_URL"] = database_url
+    click.echo(f"Database: {database_url}")
+
+
+def report(name, latencies, total_time, messages):
+    latencies = sorted(latencies)
+    click.echo(
+        f"{name:>14}: {messages / total_time:10.1f} op/s | "
+        f"p50 {statistics.median(latencies) * 1000:.3f} ms | "
+        f"p95 {latencies[int(len(latencies) * 0.95)] * 1000:.3f} ms | "
+        f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.3f} ms"
+    )
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command("write-behind")
+@click.option("--database-url", default=None, help="defaults to a temp sqlite file")
+@click.option("--messages", default=2000, help="messages to add per mode")
+@click.option("--sessions", default=10, help="sessions to spread messages over")
+@click.option("--batch-size", default=100)
+@click.option("--flush-interval", default=0.5)
+def write_behind(database_url, messages, sessions, batch_size, flush_interval):
+    """Compare add_message latency/throughput synchronous vs write-behind"""
+    setup_database(database_url)
+    from langchain.schema.messages import HumanMessage
+
+    from expert_gpts.chat_history.mysql import MysqlChatMessageHistory, persist_messages
+    from expert_gpts.chat_history.write_behind import WriteBehindWriter
+
+    writer = WriteBehindWriter(
+        persist_messages, batch_size=batch_size, flush_interval=flush_interval
+    )
+    for name, mode_writer in (("synchronous", None), ("write-behind", writer)):
+        histories = [
+            MysqlChatMessageHistory(
+                str(uuid.uuid4()), f"bench_{name}", None, writer=mode_writer
+            )
+            for _ in range(sessions)
+        ]
+        latencies = []
+        started_at = perf_counter()
+        for i in range(messages):
+            message = HumanMessage(content=f"benchmark message number {i}")
+            call_started_at = perf_counter()
+            histories[i % sessions].add_message(message)
+            latencies.append(perf_counter() - call_started_at)
+        for history in histories:
+            history.flush()
+        report(name, latencies, perf_counter() - started_at, messages)
+        stored = sum(len(history.messages) for history in histories)
+        assert stored == messages, f"{name}: stored {stored} of {messages}"
+
+    writer.close()
+    click.echo(f"Write-behind stats: {writer.stats()}")
+
+
+@cli.command("windowed-reads")
+@click.option("--database-url", default=None, help="defaults to a temp sqlite file")
+@click.option("--sizes", default="100,1000,5000", help="session sizes to measure")
+@click.option("--window", default=20)
+@click.option("--reads", default=50, help="reads per measure")
+def windowed_reads(database_url, sizes, window, reads):
+    """Compare full-session reads with tail-windowed reads as a session grows"""
+    setup_database(database_url)
+    from expert_gpts.chat_history.mysql import MysqlChatMessageHistory, persist_messages
+
+    for size in [int(x) for x in sizes.split(",")]:
+        history = MysqlChatMessageHistory(str(uuid.uuid4()), "bench_reads", None)
+        persist_messages(fake_rows(history, numbered_texts(size)))
+        for name, read in (
+            ("full", lambda: history.messages),
+            (f"last {window}", lambda: history.get_last_messages(window)),
+        ):
+            latencies = []
+            for _ in range(reads):
+                started_at = perf_counter()
+                read()
+                latencies.append(perf_counter() - started_at)
+            report(f"{size} {name}", latencies, sum(latencies), reads)
+
+
+@cli.command("cache")
+@click.option("--database-url", default=None, help="defaults to a temp sqlite file")
+@click.option("--size", default=200, help="messages in the session")
+@click.option("--turns", default=100, help="turns to simulate")
+@click.option("--reads-per-turn", default=3)
+@click.option("--window", default=20)
+def cache(database_url, size, turns, reads_per_turn, window):
+    """Simulate agent turns (add + several reads) with and without the message cache"""
+    setup_database(database_url)
+    from langchain.schema.messages import HumanMessage
+
+    from expert_gpts.chat_history.cache import MessageCache
+    from expert_gpts.chat_history.mysql import MysqlChatMessageHistory, persist_messages
+
+    for name, message_cache in (("no cache", None), ("cache", MessageCache())):
+        history = MysqlChatMessageHistory(
+            str(uuid.uuid4()), "bench_cache", None, window=window, cache=message_cache
+        )
+        persist_messages(fake_rows(history, numbered_texts(size)))
+        latencies = []
+        started_at = perf_counter()
+        for i in range(turns):
+            turn_started_at = perf_counter()
+            history.add_message(HumanMessage(content=f"turn {i}"))
+            for _ in range(reads_per_turn):
+                assert history.messages[-1].content == f"turn {i}"
+            latencies.append(perf_counter() - turn_started_at)
+        report(name, latencies, perf_counter() - started_at, turns)
+        if message_cache is not None:
+            click.echo(f"Cache stats: {message_cache.stats()}")
+
+
+@cli.command("fuzzy-search")
+@click.option("--database-url", default=None, help="defaults to a temp sqlite file")
+@click.option("--messages", default=100000, help="messages in the searched session")
+@click.option("--searches", default=5)
+@click.option("--distance", default=3)
+def fuzzy_search(database_url, messages, searches, distance):
+    """
+    Compare the trigram index with per-row scans of the session, done in Python as
+    the levenshtein stored function runs in MariaDB only. The trigram search matches
+    the messages containing the search within distance edits: the substring scan has
+    the same semantics and compares the latency, the levenshtein scan keeps the
+    whole-message distance of CHAT_HISTORY_SEARCH=levenshtein, so short searches
+    rarely match full messages there.
+    """
+    setup_database(database_url)
+    import random
+
+    from expert_gpts.chat_history.mysql import MysqlChatMessageHistory, persist_messages
+    from expert_gpts.chat_history.search import normalize_text, substring_distance
+    from expert_gpts.chat_history.storage import record_content
+    from expert_gpts.database import get_db_session
+    from expert_gpts.database.chat_message import ChatMessage
+
+    words = [
+        "".join(random.choices("abcdefghijklmnopqrstuvwxyz", k=random.randint(3, 9)))
+        for _ in range(5000)
+    ]
+    history = MysqlChatMessageHistory(str(uuid.uuid4()), "bench_search", None)
+    texts = [" ".join(random.choices(words, k=12)) for _ in range(messages)]
+    started_at = perf_counter()
+    for start in range(0, messages, 5000):
+        end = start + 5000
+        persist_messages(fake_rows(history, texts[start:end]))
+    click.echo(
+        f"Stored and indexed {messages} messages in {perf_counter() - started_at:.1f}s"
+    )
+
+    queries = [" ".join(random.choice(texts).split()[2:5]) for _ in range(searches)]
+
+    def scan(query, matches):
+        with get_db_session() as session:
+            records = session.query(ChatMessage.message, ChatMessage.content).where(
+                ChatMessage.session_id == history.session_id,
+                ChatMessage.ai_key == history.ai_key,
+            )
+            return [record for record in records if matches(query, record)][:5]
+
+    def whole_message(query, record):
+        return levenshtein(query, record_content(record)) <= distance
+
+    def substring(query, record):
+        content = normalize_text(record_content(record))
+        return substring_distance(normalize_text(query), content, distance) is not None
+
+    for name, search in (
+        ("levenshtein", lambda q: scan(q, whole_message)),
+        ("substring scan", lambda q: scan(q, substring)),
+        ("trigram", lambda q: history.fuzzy_search(q, distance=distance)),
+    ):
+        latencies, found = [], 0
+        for query in queries:
+            started_at = perf_counter()
+            found += bool(search(query))
+            latencies.append(perf_counter() - started_at)
+        report(name, latencies, sum(latencies), len(queries))
+        click.echo(f"{name:>14}: {found}/{len(queries)} searches with results")
+
+
+@cli.command("sessions-listing")
+@click.option("--database-url", default=None, help="defaults to a temp sqlite file")
+@click.option("--sessions", default=500)
+@click.option("--messages-per-session", default=40)
+@click.option("--listings", default=20)
+def sessions_listing(database_url, sessions, messages_per_session, listings):
+    """Compare the sidebar listing from the chat_session catalog with a full scan"""
+    setup_database(database_url)
+    from expert_gpts.chat_history.mysql import (
+        CHAT_SESSIONS_PAGE_SIZE,
+        MysqlChatMessageHistory,
+        persist_messages,
+    )
+    from expert_gpts.database import get_db_session
+    from expert_gpts.database.chat_message import ChatMessage
+
+    for _ in range(sessions):
+        history = MysqlChatMessageHistory(str(uuid.uuid4()), "bench_sessions", None)
+        persist_messages(fake_rows(history, numbered_texts(messages_per_session)))
+
+    def scan():
+        with get_db_session() as session:
+            result = (
+                session.query(ChatMessage)
+                .filter(ChatMessage.ai_key == history.ai_key)
+                .order_by(ChatMessage.created_at.desc())
+            )
+            return {record.session_id: record.created_at for record in result}
+
+    for name, listing in (
+        ("full scan", scan),
+        ("catalog", history.get_chats_sessions),
+        ("catalog page", lambda: history.get_chats_sessions(CHAT_SESSIONS_PAGE_SIZE)),
+    ):
+        latencies = []
+        for _ in range(listings):
+            started_at = perf_counter()
+            listing()
+            latencies.append(perf_counter() - started_at)
+        report(name, latencies, sum(latencies), listings)
+
+
+@cli.command("storage-format")
+@click.option("--database-url", default=None, help="defaults to a temp sqlite file")
+@click.option("--messages", default=10000, help="messages stored per format")
+@click.option("--scans", default=3, help="content scans of the session per format")
+def storage_format(database_url, messages, scans):
+    """Compare table size, decode time and content scan speed of the storage formats"""
+    setup_database(database_url)
+    import random
+
+    from sqlalchemy import func, select
+
+    from expert_gpts.chat_history.mysql import (
+        MysqlChatMessageHistory,
+        decode_messages,
+        persist_messages,
+        select_messages,
+    )
+    from expert_gpts.chat_history.storage import STORAGE_FORMATS, record_content
+    from expert_gpts.database import get_db_session
+    from expert_gpts.database.chat_message import ChatMessage
+
+    words = [
+        "".join(random.choices("abcdefghijklmnopqrstuvwxyz", k=random.randint(3, 9)))
+        for _ in range(5000)
+    ]
+    texts = [" ".join(random.choices(words, k=40)) for _ in range(messages)]
+    query = " ".join(texts[0].split()[:3])
+    for storage in STORAGE_FORMATS:
+        history = MysqlChatMessageHistory(str(uuid.uuid4()), f"bench_{storage}", None)
+        for start in range(0, messages, 5000):
+            end = start + 5000
+            persist_messages(fake_rows(history, texts[start:end], storage))
+
+        size = func.coalesce(func.length(ChatMessage.message), 0) + func.coalesce(
+            func.length(ChatMessage.content), 0
+        )
+        size = size + func.coalesce(func.length(ChatMessage.type), 0)
+        size = size + func.coalesce(func.length(ChatMessage.payload), 0)
+        with get_db_session() as session:
+            stored = session.scalar(
+                select(func.sum(size)).where(ChatMessage.ai_key == history.ai_key)
+            )
+            stmt, newest_first = select_messages(history.session_id, history.ai_key)
+            records = session.execute(stmt).all()
+        click.echo(
+            f"{storage:>14}: {stored / 1024 / 1024:.2f} MB stored, "
+            f"{stored / messages:.0f} bytes/row"
+        )
+
+        started_at = perf_counter()
+        decode_messages(records, newest_first)
+        decode_time = perf_counter() - started_at
+        click.echo(
+            f"{storage:>14}: decode {decode_time / messages * 1000000:.2f} us/row"
+        )
+
+        latencies = []
+        for _ in range(scans):
+            started_at = perf_counter()
+            with get_db_session() as session:
+                for record in session.execute(
+                    select(ChatMessage.message, ChatMessage.content).where(
+                        ChatMessage.session_id == history.session_id,
+                        ChatMessage.ai_key == history.ai_key,
+                    )
+                ):
+                    levenshtein(query, record_content(record)[: len(query) + 3])
+            latencies.append(perf_counter() - started_at)
+        report(f"{storage} scan", latencies, sum(latencies), scans)
+
+
+def levenshtein(s1, s2):
+    previous = list(range(len(s2) + 1))
+    for i, c1 in enumerate(s1, 1):
+        current = [i]
+        for j, c2 in enumerate(s2, 1):
+            current.append(
+                min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (c1 != c2))
+            )
+        previous = current
+    return previous[-1]
+
+
+def numbered_texts(size):
+    return [f"benchmark message number {i}" for i in range(size)]
+
+
+def fake_rows(history, texts, storage_format=None):
+    from langchain.schema.messages import AIMessage, HumanMessage
+
+    from expert_gpts.chat_history.storage import STORAGE_FORMAT, encode_message
+
+    return [
+        dict(
+            session_id=history.session_id,
+            ai_key=history.ai_key,
+            quality=0,
+            created_at=datetime.now(),
+            **encode_message(
+                (HumanMessage if i % 2 else AIMessage)(content=text),
+                storage_format or STORAGE_FORMAT,
+            ),
+        )
+        for i, text in enumerate(texts)
+    ]
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,207 @@
+"""
+Retrieval quality and cost of a grid of chunk sizes, overlaps and top-k on a fixed
+corpus with labelled questions, to pick the `chunking` of an expert with data:
+recall@k (questions whose answer is in one of the k nodes), MRR@k, tokens of the k
+nodes (the context of the expert prompt) and query latency (embedding and search of
+the largest k). The default corpus is generated from --seed, documents of service
+facts buried in filler text with one question per fact; --corpus and --questions
+run it on your own documents, the questions file being a yaml list of
+{question, answer} where answer is a text the relevant nodes contain. The local
+embeddings provider needs no network, --dim sets its dimensions: hash collisions of
+the filler words blur the nodes under a few thousands. The stores live in a temp dir.
+
+    python -m bin.bench_chunking
+    python -m bin.bench_chunking --chunk-sizes 256,512,1024 --overlaps 0,64 --top-k 1,2,4
+    python -m bin.bench_chunking --corpus ./documents --questions questions.yaml --provider openai
+"""
+import statistics
+import tempfile
+from time import perf_counter
+from typing import Dict, List, Tuple
+
+import click
+import numpy as np
+import tiktoken
+import yaml
+from llama_index import (
+    Document,
+    ServiceContext,
+    SimpleDirectoryReader,
+    StorageContext,
+    VectorStoreIndex,
+)
+from llama_index.llms import MockLLM
+
+from expert_gpts.embeddings.chunking import get_node_parser
+from expert_gpts.embeddings.providers import build_embedding_provider
+from expert_gpts.embeddings.providers.local import LocalEmbedding
+from expert_gpts.embeddings.vector_stores.numpy_store import NumpyVectorStore
+
+FACTS = {
+    "port": (
+        "listens on port {value}",
+        "Which port does the {name} service listen on?",
+    ),
+    "owner": ("is owned by the {value} team", "Which team owns the {name} service?"),
+    "database": (
+        "stores its records in the {value} database",
+        "In which database does the {name} service store its records?",
+    ),
+    "timeout": (
+        "gives up on requests after {value} seconds",
+        "After how many seconds does the {name} service give up on requests?",
+    ),
+    "region": (
+        "is deployed in the {value} region",
+        "In which region is the {name} service deployed?",
+    ),
+    "queue": (
+        "publishes its events to the {value} queue",
+        "To which queue does the {name} service publish its events?",
+    ),
+}
+NUMERIC_FACTS = ("port", "timeout")
+
+
+def random_words(rng: np.random.Generator, count: int, length: Tuple[int, int]):
+    letters = list("abcdefghijklmnopqrstuvwxyz")
+    words = set()
+    while len(words) < count:
+        words.add("".join(rng.choice(letters, rng.integers(*length))))
+    return sorted(words)
+
+
+def generate_corpus(
+    documents: int, sentences: int, seed: int
+) -> Tuple[List[Document], List[Dict[str, str]]]:
+    """Documents of one service each, a paragraph of filler per fact with the fact
+    sentence at a random place, and the question of each fact"""
+    rng = np.random.default_rng(seed)
+    words = random_words(rng, 3000 + documents * (len(FACTS) + 1), (3, 10))
+    rng.shuffle(words)
+    filler, names = words[:3000], iter(words[3000:])
+    numbers = iter(rng.permutation(np.arange(1000, 100000))[: documents * len(FACTS)])
+    corpus, questions = [], []
+    for i in range(documents):
+        name = next(names).capitalize()
+        paragraphs = [f"# The {name} service"]
+        for fact in rng.permutation(list(FACTS)):
+            template, question = FACTS[fact]
+            value = str(next(numbers)) if fact in NUMERIC_FACTS else next(names)
+            paragraph = [
+                " ".join(rng.choice(filler, rng.integers(8, 20))).capitalize() + "."
+                for _ in range(sentences)
+            ]
+            position = int(rng.integers(sentences + 1))
+            paragraph.insert(
+                position, f"The {name} service {template.format(value=value)}."
+            )
+            paragraphs.append(" ".join(paragraph))
+            questions.append(dict(question=question.format(name=name), answer=value))
+        corpus.append(Document(text="\n\n".join(paragraphs), id_=f"service-{i}"))
+    return corpus, questions
+
+
+def load_corpus(corpus: str, questions: str):
+    documents = SimpleDirectoryReader(
+        corpus, recursive=True, filename_as_id=True
+    ).load_data()
+    with open(questions) as file:
+        return documents, yaml.safe_load(file)
+
+
+def answer_rank(texts: List[str], answer: str) -> int:
+    """Position of the first text with the answer, len(texts) if none"""
+    answer = answer.lower()
+    for rank, text in enumerate(texts):
+        if answer in text.lower():
+            return rank
+    return len(texts)
+
+
+@click.command()
+@click.option("--chunk-sizes", default="128,256,512,1024", help="tokens per node")
+@click.option("--overlaps", default="0,20,64", help="tokens shared by nodes")
+@click.option("--top-k", "top_ks", default="1,2,4,8", help="nodes per search")
+@click.option("--provider", default="local", help="embeddings provider")
+@click.option("--dim", default=4096, help="dimensions of the local provider")
+@click.option(
+    "--corpus", default=None, help="folder of documents, generated if not set"
+)
+@click.option("--questions", default=None, help="yaml of {question, answer}")
+@click.option("--documents", default=60, help="generated documents")
+@click.option("--sentences", default=6, help="filler sentences per generated fact")
+@click.option("--seed", default=0)
+def bench_chunking(
+    chunk_sizes,
+    overlaps,
+    top_ks,
+    provider,
+    dim,
+    corpus,
+    questions,
+    documents,
+    sentences,
+    seed,
+):
+    if corpus:
+        if not questions:
+            raise click.UsageError("--corpus needs --questions")
+        corpus, questions = load_corpus(corpus, questions)
+    else:
+        corpus, questions = generate_corpus(documents, sentences, seed)
+    top_ks = sorted(int(k) for k in top_ks.split(","))
+    encoding = tiktoken.get_encoding("cl100k_base")
+    embed_model = (
+        LocalEmbedding(dim=dim)
+        if provider == "local"
+        else build_embedding_provider(provider)
+    )
+    click.echo(
+        f"{len(corpus)} documents, {len(questions)} questions, {provider} embeddings"
+    )
+    click.echo(
+        f"{'chunk':>6} {'overlap':>7} {'nodes':>6} {'k':>3} {'recall':>7} {'MRR':>6} "
+        f"{'ctx tokens':>10} {'p50 ms':>7} {'p95 ms':>7}"
+    )
+
+    for chunk_size in (int(size) for size in chunk_sizes.split(",")):
+        for overlap in (int(overlap) for overlap in overlaps.split(",")):
+            if overlap >= chunk_size:
+                continue
+            node_parser = get_node_parser(chunk_size, overlap)
+            nodes = node_parser.get_nodes_from_documents(corpus)
+            with tempfile.TemporaryDirectory() as path:
+                vector_store = NumpyVectorStore(path)
+                index = VectorStoreIndex(
+                    nodes,
+                    storage_context=StorageContext.from_defaults(
+                        vector_store=vector_store
+                    ),
+                    service_context=ServiceContext.from_defaults(
+                        llm=MockLLM(), embed_model=embed_model, node_parser=node_parser
+                    ),
+                )
+                retriever = index.as_retriever(similarity_top_k=top_ks[-1])
+                ranks, tokens, latencies = [], [], []
+                for question in questions:
+                    started_at = perf_counter()
+                    retrieved = retriever.retrieve(question["question"])
+                    latencies.append(perf_counter() - started_at)
+                    texts = [node.node.get_content() for node in retrieved]
+                    ranks.append(answer_rank(texts, str(question["answer"])))
+                    tokens.append([len(encoding.encode(text)) for text in texts])
+            latencies.sort()
+            for k in top_ks:
+                click.echo(
+                    f"{chunk_size:>6} {overlap:>7} {len(nodes):>6} {k:>3} "
+                    f"{statistics.mean(rank < k for rank in ranks):>7.3f} "
+                    f"{statistics.mean(1 / (rank + 1) if rank < k else 0 for rank in ranks):>6.3f} "
+                    f"{statistics.mean(sum(counts[:k]) for counts in tokens):>10.0f} "
+                    f"{statistics.median(latencies) * 1000:>7.2f} "
+                    f"{latencies[int(0.95 * (len(latencies) - 1))] * 1000:>7.2f}"
+                )
+
+
+if __name__ == "__main__":
+    bench_chunking()
@@ -0,0 +1,70 @@
+"""
+Micro-batching of the embedding requests: --threads threads embed single queries
+through a BatchingEmbedding, without batching (max wait 0) and with it, against the
+local provider with --latency seconds added per call to stand for the network round
+trip of a remote provider. Reports the provider calls, queries/s and latency. No
+network involved.
+
+    python -m bin.bench_embeddings --threads 32 --latency 0.1
+"""
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+from typing import List
+
+import click
+
+from expert_gpts.embeddings.providers.batching import BatchingEmbedding
+from expert_gpts.embeddings.providers.local import LocalEmbedding
+
+
+class SlowLocalEmbedding(LocalEmbedding):
+    """The local provider with a fixed latency per call"""
+
+    latency: float = 0.1
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        time.sleep(self.latency)
+        return super()._get_text_embeddings(texts)
+
+
+@click.command()
+@click.option("--threads", default=32, help="concurrent callers")
+@click.option("--queries", default=512, help="queries in total")
+@click.option("--latency", default=0.1, help="seconds per provider call")
+@click.option("--batch-size", default=64)
+@click.option("--max-wait", default=0.005, help="seconds of the batched run")
+@click.option("--max-concurrency", default=4, help="provider calls at once")
+def bench_embeddings(threads, queries, latency, batch_size, max_wait, max_concurrency):
+    texts = [f"question {i} about the topic {i % 17}" for i in range(queries)]
+    for wait in (0.0, max_wait):
+        embed_model = BatchingEmbedding(
+            SlowLocalEmbedding(latency=latency),
+            batch_size=batch_size,
+            max_wait=wait,
+            max_concurrency=max_concurrency,
+        )
+        latencies = []
+
+        def embed(text: str):
+            started_at = perf_counter()
+            embed_model.get_query_embedding(text)
+            latencies.append(perf_counter() - started_at)
+
+        started_at = perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            list(executor.map(embed, texts))
+        elapsed = perf_counter() - started_at
+        latencies.sort()
+        stats = embed_model.stats()["queries"]
+        click.echo(
+            f"max wait {wait * 1000:>4.0f} ms: {stats['calls']} calls for "
+            f"{stats['texts']} queries | {queries / elapsed:.0f} queries/s "
+            f"| p50 {statistics.median(latencies) * 1000:.0f} ms "
+            f"| p95 {latencies[int(0.95 * (len(latencies) - 1))] * 1000:.0f} ms"
+        )
+
+
+if __name__ == "__main__":
+    bench_embeddings()
@@ -0,0 +1,67 @@
+"""
+Construction cost of the embeddings handlers of a config: building a handler per
+request (vector store, service context, node parser and index every time) vs the
+EmbeddingsHandlerFactory registry, at startup (first request per index) and per
+request. Builds handlers only, no embedding or LLM call is made.
+"""
+import statistics
+from time import perf_counter
+
+import click
+
+from expert_gpts.embeddings.factory import EmbeddingsHandlerFactory
+from expert_gpts.embeddings.llamaindex import LlamaIndexEmbeddingsHandler
+from expert_gpts.llms.providers.openai import OpenAIApiManager
+from shared.config import load_config
+
+
+def timed(func) -> float:
+    started_at = perf_counter()
+    func()
+    return perf_counter() - started_at
+
+
+@click.command()
+@click.option("--config", default="configs/mygpt.yaml", help="config file to use")
+@click.option("--requests", default=20, help="requests, each one gets every expert")
+@click.option("--vector-store", default=None, help="override the config stores")
+def bench_embeddings_handlers(config, requests, vector_store):
+    config = load_config(config)
+    llm_manager = OpenAIApiManager()
+    experts = {
+        key: vector_store or expert.vector_store
+        for key, expert in config.experts.__root__.items()
+    }
+
+    def build_per_request():
+        for key, store in experts.items():
+            LlamaIndexEmbeddingsHandler(
+                llm_manager,
+                embeddings=None,
+                index_name=f"{key}_memory",
+                index_prefix=f"{key}_memory_",
+                vector_store=store,
+            )
+
+    factory = EmbeddingsHandlerFactory()
+    factory.clear()
+
+    def get_from_registry():
+        for key, store in experts.items():
+            factory.get_expert_embeddings(llm_manager, key, vector_store=store)
+
+    per_request = [timed(build_per_request) for _ in range(requests)]
+    startup = timed(get_from_registry)
+    registry = [timed(get_from_registry) for _ in range(requests)]
+
+    click.echo(f"{len(experts)} experts, {requests} requests")
+    click.echo(
+        f"  per request build: {statistics.mean(per_request) * 1000:.1f} ms/request"
+    )
+    click.echo(f"  registry startup: {startup * 1000:.1f} ms")
+    click.echo(f"  registry: {statistics.mean(registry) * 1000:.3f} ms/request")
+    click.echo(f"  {factory.stats()}")
+
+
+if __name__ == "__main__":
+    bench_embeddings_handlers()
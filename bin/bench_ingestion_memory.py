@@ -0,0 +1,176 @@
+"""
+Peak memory of the ingestion of a large folder: the streaming pipeline (sources
+scanned lazily, large text files read in segments, nodes embedded and written in
+fixed-size batches) vs loading every document in a list first. Each mode runs in its
+own process and reports its peak RSS. A synthetic tree of --size bytes is generated
+under --path if missing, the embeddings come from the local provider and the nodes
+are discarded after the write, so no API or vector store is involved.
+
+    python -m bin.bench_ingestion_memory --size 10G
+    python -m bin.bench_ingestion_memory --size 1G --mode list  # baseline, holds the corpus
+"""
+import multiprocessing
+import os
+import resource
+from time import perf_counter
+from typing import Any, List
+
+import click
+import numpy as np
+from llama_index import ServiceContext, VectorStoreIndex
+from llama_index.langchain_helpers.text_splitter import TokenTextSplitter
+from llama_index.llms import MockLLM
+from llama_index.node_parser import SimpleNodeParser
+from llama_index.vector_stores.types import (
+    NodeWithEmbedding,
+    VectorStoreQuery,
+    VectorStoreQueryResult,
+)
+
+from expert_gpts.database import get_db_session
+from expert_gpts.database.ingestion_manifest import IngestionManifest
+from expert_gpts.embeddings.ingestion import load_source, plan_ingestion
+from expert_gpts.embeddings.pipeline import IngestionPipeline
+from expert_gpts.embeddings.providers.local import LocalEmbedding
+from shared.config import EmbeddingItem
+
+INDEX_NAME = "bench_ingestion_memory"
+UNITS = {"K": 1024, "M": 1024**2, "G": 1024**3}
+
+
+def parse_size(size: str) -> int:
+    size = size.strip().upper()
+    if size[-1] in UNITS:
+        return int(float(size[:-1]) * UNITS[size[-1]])
+    return int(size)
+
+
+class DiscardVectorStore:
+    """Counts the written nodes and keeps none of them"""
+
+    stores_text = True
+    is_embedding_query = True
+
+    def __init__(self):
+        self.written = 0
+
+    @property
+    def client(self) -> Any:
+        return None
+
+    def add(self, embedding_results: List[NodeWithEmbedding]) -> List[str]:
+        self.written += len(embedding_results)
+        return [result.id for result in embedding_results]
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        pass
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        return VectorStoreQueryResult(nodes=[], similarities=[], ids=[])
+
+
+def generate_tree(path: str, size: int, file_size: int, large_file_size: int):
+    """Text files of random words, plus one large file per 10 regular ones' worth"""
+    rng = np.random.default_rng(0)
+    words = [
+        "".join(rng.choice(list("abcdefghijklmnopqrstuvwxyz"), 6)) for _ in range(5000)
+    ]
+    lines = [" ".join(rng.choice(words, 12)) + "\n" for _ in range(20000)]
+    block = "".join(lines).encode("utf-8")
+    written, count = 0, 0
+    while written < size:
+        large = large_file_size and count % 10 == 9
+        target = min(large_file_size if large else file_size, size - written)
+        folder = os.path.join(path, f"dir-{count // 1000:05d}")
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, f"doc-{count:07d}.txt"), "wb") as file:
+            remaining = target
+            while remaining > 0:
+                offset = int(rng.integers(len(block) // 2))
+                end = offset + min(remaining, len(block) // 2)
+                chunk = block[offset:end]
+                file.write(chunk)
+                remaining -= len(chunk)
+        written += target
+        count += 1
+    click.echo(f"generated {count} files, {written / UNITS['M']:.0f} MB under {path}")
+
+
+def build_index(vector_store: DiscardVectorStore, chunk_size: int) -> VectorStoreIndex:
+    service_context = ServiceContext.from_defaults(
+        llm=MockLLM(),
+        embed_model=LocalEmbedding(),
+        node_parser=SimpleNodeParser(
+            text_splitter=TokenTextSplitter(chunk_size=chunk_size, chunk_overlap=20)
+        ),
+    )
+    return VectorStoreIndex.from_vector_store(
+        vector_store=vector_store, service_context=service_context
+    )
+
+
+def run_mode(mode: str, path: str, chunk_size: int, results):
+    embeddings = {"bench": EmbeddingItem(folder_path=path)}
+    vector_store = DiscardVectorStore()
+    index = build_index(vector_store, chunk_size)
+    started_at = perf_counter()
+    plan = plan_ingestion(INDEX_NAME, embeddings, rebuild=True)
+    if mode == "streaming":
+        # parses inline, the RSS of a process pool would not be counted
+        IngestionPipeline(index).run(plan)
+    else:
+        # what the handlers did before the pipeline: every document in one list
+        documents = [doc for source in plan.added for doc in load_source(source)]
+        node_parser = index.service_context.node_parser
+        for start in range(0, len(documents), 16):
+            end = start + 16
+            index.insert_nodes(
+                node_parser.get_nodes_from_documents(documents[start:end])
+            )
+    results.put(
+        dict(
+            mode=mode,
+            sources=len(plan.added),
+            nodes=vector_store.written,
+            seconds=perf_counter() - started_at,
+            # kilobytes on linux
+            peak_rss_mb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        )
+    )
+
+
+@click.command()
+@click.option("--path", default="var/bench_ingestion_tree", help="generated if missing")
+@click.option("--size", default="10G", help="synthetic tree size, e.g. 500M, 10G")
+@click.option("--file-size", default="2M", help="size of the regular files")
+@click.option("--large-file-size", default="256M", help="every 10th file, 0 for none")
+@click.option("--chunk-size", default=1024)
+@click.option("--mode", "modes", default="streaming", help="streaming,list")
+def bench_ingestion_memory(path, size, file_size, large_file_size, chunk_size, modes):
+    if not os.path.isdir(path):
+        generate_tree(
+            path, parse_size(size), parse_size(file_size), parse_size(large_file_size)
+        )
+    context = multiprocessing.get_context("spawn")
+    for mode in modes.split(","):
+        results = context.Queue()
+        process = context.Process(
+            target=run_mode, args=(mode, path, chunk_size, results)
+        )
+        process.start()
+        process.join()
+        if process.exitcode != 0:
+            click.echo(f"{mode:>9}: failed with exit code {process.exitcode}")
+            continue
+        result = results.get()
+        click.echo(
+            f"{mode:>9}: {result['sources']} files, {result['nodes']} nodes in "
+            f"{result['seconds']:.0f}s | peak RSS {result['peak_rss_mb']:.0f} MB"
+        )
+    with get_db_session() as session:
+        IngestionManifest.delete_index(session, INDEX_NAME)
+        session.commit()
+
+
+if __name__ == "__main__":
+    bench_ingestion_memory()
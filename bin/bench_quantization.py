@@ -0,0 +1,130 @@
+"""
+Quantized numpy/ivf vector stores against the float32 one on a synthetic clustered
+corpus: memory of the scanned matrix per million vectors, query latency and
+recall@k against the exact float32 top-k, with and without the float32 re-rank
+(rerank 1 keeps the top-k of the quantized scores), and the anonymous memory (RSS
+without the mapped files, Linux only) taken by adding one vector to a quantized
+store, which must not copy its mapped float32 matrix. The stores live in a temp dir.
+"""
+import statistics
+import tempfile
+from time import perf_counter
+
+import click
+import numpy as np
+from llama_index.schema import TextNode
+from llama_index.vector_stores.types import NodeWithEmbedding, VectorStoreQuery
+
+from expert_gpts.embeddings.vector_stores.ivf_store import IvfVectorStore
+from expert_gpts.embeddings.vector_stores.numpy_store import NumpyVectorStore
+
+
+def add_vectors(store: NumpyVectorStore, vectors: np.ndarray, batch_size: int = 5000):
+    for start in range(0, len(vectors), batch_size):
+        end = start + batch_size
+        store.add(
+            [
+                NodeWithEmbedding(
+                    node=TextNode(text="", id_=f"node-{start + i}"),
+                    embedding=vector.tolist(),
+                )
+                for i, vector in enumerate(vectors[start:end])
+            ]
+        )
+    store.persist()
+
+
+def anonymous_rss() -> int:
+    """Resident bytes of the process not backed by a file, 0 off Linux"""
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("RssAnon:"):
+                    return int(line.split()[1]) * 1024
+    except FileNotFoundError:
+        pass
+    return 0
+
+
+def run_queries(store: NumpyVectorStore, queries: np.ndarray, k: int):
+    results, latencies = [], []
+    for vector in queries:
+        query = VectorStoreQuery(query_embedding=vector.tolist(), similarity_top_k=k)
+        started_at = perf_counter()
+        results.append(set(store.query(query).ids))
+        latencies.append(perf_counter() - started_at)
+    latencies.sort()
+    return results, latencies
+
+
+@click.command()
+@click.option("--size", default=200000, help="vectors")
+@click.option("--dim", default=1536, help="1536 for the ada embeddings")
+@click.option("--clusters", default=1000, help="topics of the synthetic corpus")
+@click.option("--queries", default=100)
+@click.option("--top-k", "k", default=10)
+@click.option("--rerank", default=4, help="candidates re-ranked per result")
+@click.option("--store", type=click.Choice(["numpy", "ivf"]), default="numpy")
+@click.option("--nlist", default=256, help="ivf lists")
+@click.option("--nprobe", default=16, help="ivf lists scanned per query")
+def bench_quantization(size, dim, clusters, queries, k, rerank, store, nlist, nprobe):
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    vectors = centers[rng.integers(clusters, size=size)]
+    vectors += rng.standard_normal(vectors.shape, dtype=np.float32)
+    query_vectors = centers[rng.integers(clusters, size=queries)]
+    query_vectors += rng.standard_normal(query_vectors.shape, dtype=np.float32)
+
+    def build(path, **kwargs):
+        if store == "ivf":
+            return IvfVectorStore(path, nlist=nlist, nprobe=nprobe, **kwargs)
+        return NumpyVectorStore(path, **kwargs)
+
+    with tempfile.TemporaryDirectory() as path:
+        baseline = build(f"{path}/float32")
+        add_vectors(baseline, vectors)
+        # recall is measured against the exact top-k, not the ivf one
+        exact = NumpyVectorStore(f"{path}/float32")
+        expected, _ = run_queries(exact, query_vectors, k)
+        click.echo(f"{size} x {dim} vectors, {store} store, recall@{k}:")
+
+        configurations = [("float32", None, 1)] + [
+            (f"{quantization} rerank {factor}", quantization, factor)
+            for quantization in ("float16", "int8")
+            for factor in (1, rerank)
+        ]
+        for name, quantization, factor in configurations:
+            if quantization is None:
+                quantized = baseline
+            else:
+                # same vectors, the codes are built from the float32 generation
+                quantized = build(
+                    f"{path}/float32", quantization=quantization, rerank=factor
+                )
+            results, latencies = run_queries(quantized, query_vectors, k)
+            recall = statistics.mean(
+                len(result & truth) / k for result, truth in zip(results, expected)
+            )
+            added = ""
+            if quantization is not None:
+                # not persisted, the next stores load the same generation
+                rss = anonymous_rss()
+                quantized.add(
+                    [
+                        NodeWithEmbedding(
+                            node=TextNode(text="", id_="added"),
+                            embedding=query_vectors[0].tolist(),
+                        )
+                    ]
+                )
+                added = f" | add +{(anonymous_rss() - rss) / 2**20:.1f} MiB RSS"
+            click.echo(
+                f"{name:>20}: {quantized.nbytes / quantized.size * 1e6 / 2**30:.2f} GiB"
+                f"/M vectors | p50 {statistics.median(latencies) * 1000:.2f} ms"
+                f" | p95 {latencies[int(0.95 * (len(latencies) - 1))] * 1000:.2f} ms"
+                f" | recall {recall:.3f}{added}"
+            )
+
+
+if __name__ == "__main__":
+    bench_quantization()
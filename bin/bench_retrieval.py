@@ -0,0 +1,96 @@
+"""
+Compare the embeddings search modes of an expert (or the chain) index: synthesize
+(retrieval + LLM answer) vs retrieve (retrieval only), latency and tokens per question,
+with the vector or the hybrid (vector + BM25) retrieval.
+The retrieval cache is cleared before each run unless --cache.
+Needs the OpenAI key and the vector store of the config, run bin/load_docs.py first.
+"""
+import statistics
+from time import perf_counter
+
+import click
+import tiktoken
+from llama_index.callbacks import TokenCountingHandler
+
+from expert_gpts.embeddings.factory import EmbeddingsHandlerFactory
+from expert_gpts.embeddings.retrieval_cache import get_retrieval_cache
+from expert_gpts.llms.providers.openai import OpenAIApiManager
+from shared.config import load_config
+
+
+@click.command()
+@click.option("--config", default="configs/mygpt.yaml", help="config file to use")
+@click.option("--expert", default=None, help="expert key, the chain index if not set")
+@click.option("--question", "questions", multiple=True, required=True)
+@click.option("--repeat", default=3, help="runs per question and mode")
+@click.option(
+    "--cache/--no-cache", default=False, help="keep the retrieval cache between runs"
+)
+@click.option("--retrieval", default="vector", type=click.Choice(["vector", "hybrid"]))
+def bench_retrieval(config, expert, questions, repeat, cache, retrieval):
+    config = load_config(config)
+    llm_manager = OpenAIApiManager()
+    factory = EmbeddingsHandlerFactory()
+    if expert:
+        handler = factory.get_expert_embeddings(
+            llm_manager,
+            expert,
+            vector_store=config.experts.__root__[expert].vector_store,
+            vector_store_options=config.experts.__root__[expert].vector_store_options,
+            embeddings_provider=config.experts.__root__[expert].embeddings_provider,
+            chunking=config.experts.__root__[expert].chunking,
+        )
+    else:
+        handler = factory.get_chain_embeddings(
+            llm_manager,
+            index_name=config.chain.chain_key,
+            index_prefix=f"{config.chain.chain_key}_",
+            vector_store=config.chain.vector_store,
+            vector_store_options=config.chain.vector_store_options,
+            embeddings_provider=config.chain.embeddings_provider,
+            chunking=config.chain.chunking,
+        )
+    counter = TokenCountingHandler()
+    handler.index.service_context.callback_manager.add_handler(counter)
+    # the context is sent in the prompt of the expert answer
+    encoding = tiktoken.get_encoding("cl100k_base")
+    retrieval_cache = get_retrieval_cache()
+
+    results = {}
+    for mode in ("synthesize", "retrieve"):
+        latencies, llm_tokens, context_tokens = [], [], []
+        for question in questions:
+            for _ in range(repeat):
+                counter.reset_counts()
+                if retrieval_cache is not None and not cache:
+                    retrieval_cache.clear()
+                started_at = perf_counter()
+                context = handler.get_context(question, mode, retrieval)
+                latencies.append(perf_counter() - started_at)
+                llm_tokens.append(counter.total_llm_token_count)
+                context_tokens.append(len(encoding.encode(context)))
+        results[mode] = dict(
+            latency=statistics.mean(latencies),
+            llm_tokens=statistics.mean(llm_tokens),
+            context_tokens=statistics.mean(context_tokens),
+        )
+        click.echo(
+            f"{mode:>10}: {results[mode]['latency'] * 1000:.0f} ms/question | "
+            f"{results[mode]['llm_tokens']:.0f} LLM tokens | "
+            f"{results[mode]['context_tokens']:.0f} context tokens"
+        )
+
+    synthesize, retrieve = results["synthesize"], results["retrieve"]
+    click.echo(
+        f"retrieve saves {(synthesize['latency'] - retrieve['latency']) * 1000:.0f} ms "
+        f"and {synthesize['llm_tokens']:.0f} synthesis tokens per question, "
+        f"the answer prompt changes by "
+        f"{retrieve['context_tokens'] - synthesize['context_tokens']:+.0f} tokens"
+    )
+
+    if retrieval_cache is not None and cache:
+        click.echo(f"retrieval cache: {retrieval_cache.stats()}")
+
+
+if __name__ == "__main__":
+    bench_retrieval()
@@ -0,0 +1,100 @@
+"""
+Compare the numpy vector store with Redis on random embeddings: insert rate, query
+latency, persist/load time and matrix memory per size. Redis is skipped without
+--redis-url (REDIS_URL), the bench indexes are dropped at the end.
+"""
+import os
+import statistics
+import tempfile
+from time import perf_counter
+
+import click
+import numpy as np
+from llama_index.schema import TextNode
+from llama_index.vector_stores import RedisVectorStore
+from llama_index.vector_stores.types import NodeWithEmbedding, VectorStoreQuery
+
+from expert_gpts.embeddings.vector_stores.numpy_store import NumpyVectorStore
+
+
+def embedding_batches(size: int, dim: int, batch_size: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    for start in range(0, size, batch_size):
+        vectors = rng.standard_normal((min(batch_size, size - start), dim))
+        yield [
+            NodeWithEmbedding(
+                node=TextNode(text=f"node {start + i}", id_=f"node-{start + i}"),
+                embedding=vector.tolist(),
+            )
+            for i, vector in enumerate(vectors)
+        ]
+
+
+def bench_store(store, size, dim, batch_size, queries, top_k):
+    started_at = perf_counter()
+    for batch in embedding_batches(size, dim, batch_size):
+        store.add(batch)
+    insert_time = perf_counter() - started_at
+
+    rng = np.random.default_rng(1)
+    latencies = []
+    for vector in rng.standard_normal((queries, dim)):
+        query = VectorStoreQuery(
+            query_embedding=vector.tolist(), similarity_top_k=top_k
+        )
+        started_at = perf_counter()
+        store.query(query)
+        latencies.append(perf_counter() - started_at)
+    latencies.sort()
+    return dict(
+        inserts_per_second=size / insert_time,
+        p50_ms=statistics.median(latencies) * 1000,
+        p95_ms=latencies[int(0.95 * (len(latencies) - 1))] * 1000,
+    )
+
+
+def echo_result(name, size, result):
+    extra = " | ".join(f"{key} {value:.2f}" for key, value in result.items())
+    click.echo(f"{name:>6} {size:>8}: {extra}")
+
+
+@click.command()
+@click.option("--sizes", default="10000,100000,1000000", help="comma separated")
+@click.option("--dim", default=1536, help="embedding dimensions (ada-002: 1536)")
+@click.option("--queries", default=100)
+@click.option("--top-k", default=2)
+@click.option("--batch-size", default=1000, help="nodes per add")
+@click.option("--mmap/--no-mmap", default=False, help="reload the matrix mapped")
+@click.option("--redis-url", default=os.getenv("REDIS_URL"))
+def bench_vector_store(sizes, dim, queries, top_k, batch_size, mmap, redis_url):
+    for size in [int(size) for size in sizes.split(",")]:
+        with tempfile.TemporaryDirectory() as path:
+            store = NumpyVectorStore(path)
+            result = bench_store(store, size, dim, batch_size, queries, top_k)
+            started_at = perf_counter()
+            store.persist()
+            result["persist_s"] = perf_counter() - started_at
+            started_at = perf_counter()
+            NumpyVectorStore(path, mmap=mmap)
+            result["load_s"] = perf_counter() - started_at
+            result["matrix_mb"] = store.nbytes / 2**20
+            echo_result("numpy", size, result)
+            del store
+
+        if redis_url:
+            store = RedisVectorStore(
+                index_name=f"bench_vector_store_{size}",
+                index_prefix=f"bench_vector_store_{size}_",
+                redis_url=redis_url,
+                index_args=dict(dims=dim),
+                overwrite=True,
+            )
+            try:
+                result = bench_store(store, size, dim, batch_size, queries, top_k)
+                echo_result("redis", size, result)
+            finally:
+                store.delete_index()
+
+
+if __name__ == "__main__":
+    bench_vector_store()
@@ -0,0 +1,98 @@
+"""
+Maintenance commands for the chat history tables
+"""
+from datetime import datetime
+
+import click
+
+from expert_gpts.chat_history.archive import (
+    ARCHIVE_FORMATS,
+    archive_sessions,
+    export_messages,
+    import_messages,
+    select_export,
+)
+from expert_gpts.chat_history.search import TrigramHistorySearch
+from expert_gpts.chat_history.storage import compact_messages
+from expert_gpts.database import get_db_session
+from expert_gpts.database.chat_session import ChatSession
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command("reindex-search")
+@click.option("--batch-size", default=1000)
+def reindex_search(batch_size):
+    """Rebuild the trigram search index from all the stored messages"""
+    with get_db_session() as session:
+        indexed = TrigramHistorySearch().reindex(session, batch_size=batch_size)
+        session.commit()
+    click.echo(f"Indexed {indexed} messages")
+
+
+@cli.command("rebuild-sessions")
+def rebuild_sessions():
+    """Rebuild the chat_session catalog from all the stored messages"""
+    with get_db_session() as session:
+        sessions = ChatSession.rebuild(session)
+        session.commit()
+    click.echo(f"Cataloged {sessions} sessions")
+
+
+@cli.command("compact-storage")
+@click.option("--batch-size", default=1000)
+def compact_storage(batch_size):
+    """Convert the messages stored as json to the compact storage format"""
+    with get_db_session() as session:
+        converted = compact_messages(session, batch_size=batch_size)
+    click.echo(f"Converted {converted} messages")
+
+
+@cli.command("export")
+@click.argument("path")
+@click.option("--ai-key", default=None, help="only the messages of this ai_key")
+@click.option("--session-id", default=None, help="only the messages of this session")
+@click.option("--before", default=None, help="only the messages before this ISO date")
+@click.option("--batch-size", default=1000)
+def export(path, ai_key, session_id, before, batch_size):
+    """Stream messages to a .jsonl or .parquet file"""
+    before = datetime.fromisoformat(before) if before else None
+    result = export_messages(
+        path, select_export(ai_key, session_id, before), batch_size=batch_size
+    )
+    click.echo(f"Exported {result['exported']} messages to {path}")
+
+
+@cli.command("import")
+@click.argument("path")
+@click.option("--batch-size", default=1000)
+def import_(path, batch_size):
+    """Bulk insert the messages of a .jsonl or .parquet export"""
+    imported = import_messages(path, batch_size=batch_size)
+    click.echo(f"Imported {imported} messages from {path}")
+
+
+@cli.command("archive")
+@click.option("--days", required=True, type=int, help="archive sessions idle longer")
+@click.option("--archive-dir", default="var/archive")
+@click.option(
+    "--format", "archive_type", default="jsonl", type=click.Choice(ARCHIVE_FORMATS)
+)
+@click.option("--batch-size", default=1000, help="messages per delete transaction")
+def archive(days, archive_dir, archive_type, batch_size):
+    """Archive sessions without activity in the last N days and delete them"""
+    result = archive_sessions(archive_dir, days, archive_type, batch_size)
+    if not result["exported"]:
+        click.echo("No sessions to archive")
+        return
+    click.echo(
+        f"Archived {result['exported']} messages to {result['path']}, "
+        f"deleted {result['deleted']}"
+    )
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,203 @@
+"""
+Conformance checks of the chat history backends: the same scenario runs against
+MysqlChatMessageHistory and AsyncChatMessageHistory and both must behave the same.
+Runs against a throwaway SQLite database unless --database-url is given.
+"""
+import asyncio
+import os
+import tempfile
+import uuid
+
+import click
+
+
+def setup_database(database_url):
+    if not database_url:
+        database_url = f"sqlite:///{tempfile.mkdtemp()}/check_chat_history.sqlite"
+    # the engines are created on import so the url must be set before
+    os.environ["DATABASE_URL"] = database_url
+    click.echo(f"Database: {database_url}")
+
+
+class SyncBackend:
+    """Awaitable facade over MysqlChatMessageHistory so one scenario drives both"""
+
+    name = "sync"
+
+    def __init__(self, session_id, ai_key, window=None):
+        from expert_gpts.chat_history.mysql import MysqlChatMessageHistory
+        from expert_gpts.database import get_session
+
+        self.history = MysqlChatMessageHistory(
+            session_id, ai_key, get_session(), window=window
+        )
+
+    async def get_messages(self):
+        return self.history.messages
+
+    async def get_last_messages(self, limit):
+        return self.history.get_last_messages(limit)
+
+    async def get_messages_after(self, message_id, limit=None):
+        return self.history.get_messages_after(message_id, limit)
+
+    async def get_last_message_id(self):
+        return self.history.get_last_message_id()
+
+    async def add_message(self, message):
+        self.history.add_message(message)
+
+    async def clear(self):
+        self.history.clear()
+
+    async def fuzzy_search(self, search, distance=5, limit=5):
+        return self.history.fuzzy_search(search, distance, limit)
+
+    async def get_chats_sessions(self, limit=None, offset=0):
+        return self.history.get_chats_sessions(limit, offset)
+
+    async def delete_chat_session(self, session_id):
+        return self.history.delete_chat_session(session_id)
+
+
+class AsyncBackend:
+    name = "async"
+
+    def __new__(cls, session_id, ai_key, window=None):
+        from expert_gpts.chat_history.async_history import AsyncChatMessageHistory
+
+        return AsyncChatMessageHistory(session_id, ai_key, window=window)
+
+
+def check(condition, message):
+    if not condition:
+        raise AssertionError(message)
+
+
+def contents(messages):
+    return [message.content for message in messages]
+
+
+async def scenario(backend):
+    from langchain.schema.messages import AIMessage, HumanMessage
+
+    ai_key = f"conformance-{backend.name}-{uuid.uuid4()}"
+    session_id = str(uuid.uuid4())
+    other_session_id = str(uuid.uuid4())
+    history = backend(session_id, ai_key)
+    texts = [f"message number {i} about the database pool" for i in range(10)]
+
+    check(await history.get_messages() == [], "new session must be empty")
+    check(await history.get_last_message_id() is None, "no last id when empty")
+    for i, text in enumerate(texts):
+        message = HumanMessage(content=text) if i % 2 == 0 else AIMessage(content=text)
+        await history.add_message(message)
+
+    messages = await history.get_messages()
+    check(contents(messages) == texts, "messages must come back in insertion order")
+    check(
+        [message.type for message in messages] == ["human", "ai"] * 5,
+        "message types must round trip",
+    )
+    check(contents(await history.get_last_messages(3)) == texts[-3:], "tail read")
+    check(
+        contents(await backend(session_id, ai_key, window=4).get_messages())
+        == texts[-4:],
+        "windowed read",
+    )
+    last_id = await history.get_last_message_id()
+    check(last_id is not None, "last id once messages are stored")
+    await history.add_message(HumanMessage(content="after the last id"))
+    check(
+        contents(await history.get_messages_after(last_id)) == ["after the last id"],
+        "read after an id",
+    )
+
+    results = await history.fuzzy_search("message number 7 about", distance=2)
+    check(results and "message number 7 about" in results[0], "fuzzy search")
+    results = await history.fuzzy_search("mesage number 7", distance=1)
+    check(
+        len(results) == 1 and "message number 7 about" in results[0],
+        "fuzzy search within the distance only",
+    )
+
+    await backend(other_session_id, ai_key).add_message(HumanMessage(content="other"))
+    sessions = await history.get_chats_sessions()
+    check(list(sessions) == [other_session_id, session_id], "sessions by activity")
+    check(
+        list(await history.get_chats_sessions(limit=1, offset=1)) == [session_id],
+        "sessions paging",
+    )
+
+    neighbour = backend(other_session_id, f"{ai_key}-neighbour")
+    await neighbour.add_message(HumanMessage(content="neighbour message"))
+    check(await history.delete_chat_session(other_session_id) == 1, "delete session")
+    check(
+        await neighbour.fuzzy_search("neighbour message") != [],
+        "delete session keeps the other ai_keys",
+    )
+    check(list(await history.get_chats_sessions()) == [session_id], "session deleted")
+    await history.clear()
+    check(await history.get_messages() == [], "cleared session must be empty")
+    check(await history.fuzzy_search("message number 7") == [], "search after clear")
+    check(await history.get_chats_sessions() == {}, "catalog after clear")
+
+
+async def concurrency_scenario(sessions, messages):
+    """Concurrent writers and readers on the async backend, no message may be lost"""
+    from langchain.schema.messages import HumanMessage
+
+    from expert_gpts.chat_history.async_history import AsyncChatMessageHistory
+
+    ai_key = f"conformance-concurrency-{uuid.uuid4()}"
+    histories = [
+        AsyncChatMessageHistory(str(uuid.uuid4()), ai_key) for _ in range(sessions)
+    ]
+
+    async def write(history):
+        for i in range(messages):
+            await history.add_message(HumanMessage(content=f"{history.session_id} {i}"))
+
+    async def read(history):
+        for _ in range(messages):
+            await history.get_last_messages(5)
+
+    await asyncio.gather(
+        *[write(history) for history in histories],
+        *[read(history) for history in histories],
+    )
+    for history in histories:
+        stored = contents(await history.get_messages())
+        expected = [f"{history.session_id} {i}" for i in range(messages)]
+        check(stored == expected, f"lost or reordered messages in {history.session_id}")
+    check(
+        len(await histories[0].get_chats_sessions(limit=sessions + 1)) == sessions,
+        "one catalog row per concurrent session",
+    )
+
+
+@click.command()
+@click.option("--database-url", default=None, help="defaults to a temp sqlite file")
+@click.option("--sessions", default=5, help="concurrent sessions")
+@click.option("--messages", default=20, help="messages per concurrent session")
+def main(database_url, sessions, messages):
+    """Run the conformance scenario against the sync and async chat histories"""
+    setup_database(database_url)
+    import expert_gpts  # noqa: F401 creates the tables
+    from expert_gpts.database.async_session import get_async_engine
+
+    async def run():
+        try:
+            for backend in (SyncBackend, AsyncBackend):
+                await scenario(backend)
+                click.echo(f"{backend.name}: ok")
+            await concurrency_scenario(sessions, messages)
+            click.echo("async concurrency: ok")
+        finally:
+            await get_async_engine().dispose()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Import-time budget of the package: each module is imported in a fresh interpreter
+with `python -X importtime` and must stay under two budgets, the self time of our
+own modules (what the code of this repo runs on import) and the total time
+(including langchain, llama_index...). The imports must also have no side effects:
+no prompts file read, no embed model built, no torch import and no langchain.debug.
+Exits with 1 when a check fails. Runs against a throwaway SQLite database.
+
+    python -m bin.check_import_time
+    python -m bin.check_import_time --module expert_gpts.main --total-budget 4000
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from typing import Dict, List, Tuple
+
+import click
+
+MODULES = [
+    "shared.config",
+    "shared.llms.system_prompts",
+    "expert_gpts.llms.providers.openai",
+    "expert_gpts.embeddings.llamaindex",
+    "expert_gpts.main",
+]
+OWN_PACKAGES = ("expert_gpts", "shared", "ui", "bin")
+
+PROBE = """
+import json, sys
+import {module}
+checks = {{"torch imported": "torch" in sys.modules}}
+if "langchain" in sys.modules:
+    checks["langchain.debug set"] = bool(sys.modules["langchain"].debug)
+prompts = sys.modules.get("shared.llms.system_prompts")
+if prompts is not None:
+    checks["prompts file read"] = prompts.get_config_prompts.cache_info().currsize > 0
+providers = sys.modules.get("expert_gpts.embeddings.providers")
+if providers is not None:
+    checks["embed model built"] = providers.get_embed_model.cache_info().currsize > 0
+print(json.dumps(checks))
+"""
+
+
+def parse_importtime(stderr: str) -> List[Tuple[str, int, int]]:
+    """(module, self us, cumulative us) of the `-X importtime` lines"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line.removeprefix("import time:").split("|")
+        rows.append((name.strip(), int(self_us), int(cumulative_us)))
+    return rows
+
+
+def is_own(module: str) -> bool:
+    return module.split(".")[0] in OWN_PACKAGES
+
+
+def measure(module: str, env: Dict[str, str]) -> Tuple[float, float, Dict, str]:
+    """Total and own import ms, side effect checks and slowest own module"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", PROBE.format(module=module)],
+        capture_output=True,
+        text=True,
+        env=env,
+    )
+    if result.returncode != 0:
+        raise click.ClickException(f"importing {module} failed:\n{result.stderr}")
+    rows = parse_importtime(result.stderr)
+    total = max(cumulative for name, _, cumulative in rows if name == module)
+    own = [(self_us, name) for name, self_us, _ in rows if is_own(name)]
+    slowest = max(own)[1] if own else "-"
+    checks = json.loads(result.stdout.strip().splitlines()[-1])
+    return total / 1000, sum(self_us for self_us, _ in own) / 1000, checks, slowest
+
+
+@click.command()
+@click.option("--module", "modules", multiple=True, help="defaults to the entrypoints")
+@click.option("--runs", default=3, help="imports per module, the fastest one counts")
+@click.option("--own-budget", default=250.0, help="ms of self time of our modules")
+@click.option("--total-budget", default=6000.0, help="ms of the whole import")
+def main(modules, runs, own_budget, total_budget):
+    env = {
+        **os.environ,
+        "DATABASE_URL": f"sqlite:///{tempfile.mkdtemp()}/check_import_time.sqlite",
+        "OPENAI_API_KEY": os.getenv("OPENAI_API_KEY", "sk-check-import-time"),
+    }
+    failures = []
+    for module in modules or MODULES:
+        measures = [measure(module, env) for _ in range(runs)]
+        total = min(m[0] for m in measures)
+        own = min(m[1] for m in measures)
+        _, _, checks, slowest = measures[-1]
+        side_effects = [check for check, happened in checks.items() if happened]
+        click.echo(
+            f"{module:<36} total {total:>7.0f} ms | own {own:>5.0f} ms "
+            f"(slowest {slowest})"
+        )
+        if total > total_budget:
+            failures.append(f"{module}: {total:.0f} ms > {total_budget:.0f} ms total")
+        if own > own_budget:
+            failures.append(f"{module}: {own:.0f} ms > {own_budget:.0f} ms own")
+        failures.extend(f"{module}: {effect} on import" for effect in side_effects)
+    for failure in failures:
+        click.echo(f"FAIL {failure}", err=True)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,16 +4,32 @@ This file is used to load the documents to vector db
 
 import click
 
+from expert_gpts.embeddings.cache import get_embedding_cache
 from expert_gpts.main import LLMConfigBuilder
 from shared.config import load_config
 
 
 @click.command()
 @click.option("--config", default="configs/mygpt.yaml", help="config file to use")
-def load_docs(config):
+@click.option("--dry-run", is_flag=True, help="only report the planned work")
+@click.option("--rebuild", is_flag=True, help="drop the indexes and ingest everything")
+def load_docs(config, dry_run, rebuild):
     config = load_config(config)
     builder = LLMConfigBuilder(config)
-    builder.load_docs()
+    plans = builder.load_docs(dry_run=dry_run, rebuild=rebuild)
+    for index_name, plan in plans.items():
+        click.echo(f"{index_name}: {plan.summary()}")
+        if dry_run:
+            for line in plan.describe():
+                click.echo(f"  {line}")
+        for stage, stats in plan.stages.items():
+            click.echo(
+                f"  {stage:>6}: {stats['items']} items, "
+                f"{stats['items_per_second']:.1f} items/s, busy {stats['busy_time']:.1f}s"
+            )
+    cache = get_embedding_cache()
+    if cache is not None:
+        click.echo(f"Embedding cache: {cache.stats()}")
 
 
 if __name__ == "__main__":
@@ -1,6 +1,14 @@
 from expert_gpts.database import engine
 from expert_gpts.database.chat_message import ChatMessage
+from expert_gpts.database.chat_session import ChatSession
 from expert_gpts.database.expert_agents import ExpertAgentToolPrompt
+from expert_gpts.database.ingestion_manifest import IngestionManifest
+from expert_gpts.database.message_trigram import MessageTrigram
 
 ExpertAgentToolPrompt.metadata.create_all(engine)
 ChatMessage.metadata.create_all(engine)
+MessageTrigram.metadata.create_all(engine)
+ChatSession.metadata.create_all(engine)
+IngestionManifest.metadata.create_all(engine)
+ChatMessage.create_columns(engine)
+ChatMessage.create_indexes(engine)
@@ -0,0 +1,287 @@
+"""
+Bulk export/import of message_store and retention archival.
+
+Messages are streamed with server side cursors (yield_per) so memory stays constant
+whatever the table size. Each exported record is storage format independent:
+
+    {"session_id": ..., "ai_key": ..., "created_at": iso date, "quality": ...,
+     "message": LangChain message dict}
+"""
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from sqlalchemy import Select, and_, delete, select
+from sqlalchemy.orm import Session
+
+from expert_gpts.chat_history.mysql import persist_messages
+from expert_gpts.chat_history.storage import decode_record, encode_message_dict
+from expert_gpts.database import get_db_session
+from expert_gpts.database.chat_message import ChatMessage
+from expert_gpts.database.chat_session import ChatSession
+from expert_gpts.database.message_trigram import MessageTrigram
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_FORMATS = ("jsonl", "parquet")
+
+
+def select_export(
+    ai_key: Optional[str] = None,
+    session_id: Optional[str] = None,
+    before: Optional[datetime] = None,
+) -> Select:
+    stmt = select(
+        ChatMessage.id,
+        ChatMessage.session_id,
+        ChatMessage.ai_key,
+        ChatMessage.created_at,
+        ChatMessage.quality,
+        ChatMessage.message,
+        ChatMessage.content,
+        ChatMessage.type,
+        ChatMessage.payload,
+    )
+    if ai_key is not None:
+        stmt = stmt.where(ChatMessage.ai_key == ai_key)
+    if session_id is not None:
+        stmt = stmt.where(ChatMessage.session_id == session_id)
+    if before is not None:
+        stmt = stmt.where(ChatMessage.created_at < before)
+    return stmt.order_by(ChatMessage.id)
+
+
+def select_stale(cutoff: datetime) -> Select:
+    """Messages of the sessions without activity since cutoff"""
+    return (
+        select_export()
+        .join(
+            ChatSession,
+            and_(
+                ChatSession.session_id == ChatMessage.session_id,
+                ChatSession.ai_key == ChatMessage.ai_key,
+            ),
+        )
+        .where(ChatSession.last_activity_at < cutoff)
+    )
+
+
+def stream_records(
+    session: Session, stmt: Select, batch_size: int = 1000
+) -> Iterator[List[Dict]]:
+    """Batches of export records, read through a server side cursor"""
+    result = session.execute(stmt.execution_options(yield_per=batch_size))
+    for partition in result.partitions():
+        yield [
+            dict(
+                id=row.id,
+                session_id=row.session_id,
+                ai_key=row.ai_key,
+                created_at=row.created_at.isoformat(),
+                quality=row.quality,
+                message=decode_record(row),
+            )
+            for row in partition
+        ]
+
+
+class JsonlArchiveWriter:
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "w", encoding="utf-8")
+
+    def write(self, records: List[Dict]):
+        for record in records:
+            self._file.write(json.dumps(record) + "\n")
+
+    def close(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+
+
+class ParquetArchiveWriter:
+    """Parquet row group per batch, the message dict is kept as a JSON string"""
+
+    def __init__(self, path: str):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError(
+                "pyarrow is required to archive to parquet, pip install pyarrow"
+            )
+        self.path = path
+        self._pa = pa
+        self._schema = pa.schema(
+            [
+                ("id", pa.int64()),
+                ("session_id", pa.string()),
+                ("ai_key", pa.string()),
+                ("created_at", pa.string()),
+                ("quality", pa.int64()),
+                ("message", pa.string()),
+            ]
+        )
+        self._writer = pq.ParquetWriter(path, self._schema, compression="zstd")
+
+    def write(self, records: List[Dict]):
+        columns = {name: [] for name in self._schema.names}
+        for record in records:
+            for name in columns:
+                value = record[name]
+                columns[name].append(json.dumps(value) if name == "message" else value)
+        self._writer.write_table(
+            self._pa.Table.from_pydict(columns, schema=self._schema)
+        )
+
+    def close(self):
+        self._writer.close()
+
+
+ARCHIVE_WRITERS = {
+    "jsonl": JsonlArchiveWriter,
+    "parquet": ParquetArchiveWriter,
+}
+
+
+def archive_format(path: str) -> str:
+    archive_type = os.path.splitext(path)[1].lstrip(".")
+    if archive_type not in ARCHIVE_FORMATS:
+        raise ValueError(f"Unknown archive format {archive_type} of {path}")
+    return archive_type
+
+
+def read_archive(path: str, batch_size: int = 1000) -> Iterator[List[Dict]]:
+    """Batches of records of a jsonl or parquet archive"""
+    if archive_format(path) == "parquet":
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size):
+            records = batch.to_pylist()
+            for record in records:
+                record["message"] = json.loads(record["message"])
+            yield records
+        return
+
+    with open(path, encoding="utf-8") as file:
+        records = []
+        for line in file:
+            if line.strip():
+                records.append(json.loads(line))
+            if len(records) >= batch_size:
+                yield records
+                records = []
+        if records:
+            yield records
+
+
+def export_messages(
+    path: str,
+    stmt: Optional[Select] = None,
+    batch_size: int = 1000,
+) -> Dict[str, int]:
+    """Stream the selected messages (all by default) to a jsonl or parquet file"""
+    writer = ARCHIVE_WRITERS[archive_format(path)](path)
+    exported, last_id = 0, 0
+    try:
+        with get_db_session() as session:
+            for records in stream_records(
+                session, stmt if stmt is not None else select_export(), batch_size
+            ):
+                writer.write(records)
+                exported += len(records)
+                last_id = records[-1]["id"]
+    finally:
+        writer.close()
+    return dict(exported=exported, last_id=last_id)
+
+
+def to_rows(records: Iterable[Dict]) -> List[Dict]:
+    return [
+        dict(
+            session_id=record["session_id"],
+            ai_key=record["ai_key"],
+            created_at=datetime.fromisoformat(record["created_at"]),
+            quality=record.get("quality"),
+            **encode_message_dict(record["message"]),
+        )
+        for record in records
+    ]
+
+
+def import_messages(path: str, batch_size: int = 1000) -> int:
+    """Insert the messages of an archive in batches, indexed and cataloged"""
+    imported = 0
+    for records in read_archive(path, batch_size):
+        persist_messages(to_rows(records))
+        imported += len(records)
+        logger.info(f"Imported {imported} messages from {path}")
+    return imported
+
+
+def delete_stale(
+    session: Session, cutoff: datetime, last_id: int, batch_size: int = 1000
+) -> int:
+    """
+    Delete the messages of the sessions stale at cutoff up to the last archived id,
+    one transaction per batch so locks stay short and the binlog small.
+    """
+    deleted = 0
+    while True:
+        ids = session.scalars(
+            select(ChatMessage.id)
+            .select_from(ChatMessage)
+            .join(
+                ChatSession,
+                and_(
+                    ChatSession.session_id == ChatMessage.session_id,
+                    ChatSession.ai_key == ChatMessage.ai_key,
+                ),
+            )
+            .where(ChatSession.last_activity_at < cutoff, ChatMessage.id <= last_id)
+            .order_by(ChatMessage.id)
+            .limit(batch_size)
+        ).all()
+        if not ids:
+            break
+        session.execute(
+            delete(MessageTrigram).where(MessageTrigram.message_id.in_(ids))
+        )
+        session.execute(delete(ChatMessage).where(ChatMessage.id.in_(ids)))
+        session.commit()
+        deleted += len(ids)
+        logger.info(f"Deleted {deleted} archived messages")
+
+    # sessions written to after the export keep their catalog row
+    session.execute(delete(ChatSession).where(ChatSession.last_activity_at < cutoff))
+    session.commit()
+    return deleted
+
+
+def archive_sessions(
+    archive_dir: str,
+    days: int,
+    archive_type: str = "jsonl",
+    batch_size: int = 1000,
+) -> Dict:
+    """
+    Archive the sessions without activity in the last `days` days to a cold file in
+    archive_dir, then delete them from the hot tables in bounded batches. Nothing is
+    deleted unless the archive was fully written.
+    """
+    cutoff = datetime.now() - timedelta(days=days)
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(
+        archive_dir,
+        f"message_store-{cutoff:%Y%m%d}-{datetime.now():%Y%m%d%H%M%S}.{archive_type}",
+    )
+    result = export_messages(path, select_stale(cutoff), batch_size)
+    if not result["exported"]:
+        os.remove(path)
+        return dict(result, deleted=0)
+    with get_db_session() as session:
+        deleted = delete_stale(session, cutoff, result["last_id"], batch_size)
+    return dict(result, deleted=deleted, path=path)
@@ -0,0 +1,160 @@
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from langchain.schema.messages import AIMessage, BaseMessage, HumanMessage
+
+from expert_gpts.chat_history.cache import MessageCache
+from expert_gpts.chat_history.mysql import (
+    decode_messages,
+    delete_messages,
+    format_search_results,
+    message_to_row,
+    select_last_message_id,
+    select_messages,
+    store_messages,
+)
+from expert_gpts.chat_history.search import get_history_search
+from expert_gpts.database.async_session import get_async_db_session
+from expert_gpts.database.chat_session import ChatSession
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncChatMessageHistory:
+    """
+    Asyncio counterpart of MysqlChatMessageHistory over the same tables.
+
+    Reads are native async queries. Writes, search and the sessions catalog reuse the
+    sync helpers through AsyncSession.run_sync, so both backends store and index the
+    messages the same way and can be used side by side on one database.
+    """
+
+    def __init__(
+        self,
+        session_id: str,
+        ai_key: str,
+        window: Optional[int] = None,
+        cache: Optional[MessageCache] = None,
+    ):
+        self.session_id = session_id
+        self.ai_key = ai_key
+        self.window = window
+        self.cache = cache
+
+    async def get_messages(self) -> List[BaseMessage]:
+        """Retrieve the messages from db, only the last `window` ones if set"""
+        if self.window:
+            return await self.get_last_messages(self.window)
+        return await self._get_messages()
+
+    async def get_last_messages(self, limit: int) -> List[BaseMessage]:
+        """Retrieve the last `limit` messages of the session, oldest first"""
+        return await self._get_messages(limit=limit)
+
+    async def get_messages_after(
+        self, message_id: int, limit: Optional[int] = None
+    ) -> List[BaseMessage]:
+        """Retrieve the messages stored after the message with id `message_id`"""
+        return await self._get_messages(after_id=message_id, limit=limit)
+
+    async def get_last_message_id(self) -> Optional[int]:
+        async with get_async_db_session() as session:
+            return await session.scalar(
+                select_last_message_id(self.session_id, self.ai_key)
+            )
+
+    async def _get_messages(
+        self, after_id: Optional[int] = None, limit: Optional[int] = None
+    ) -> List[BaseMessage]:
+        if self.cache is not None and after_id is None:
+            messages = self.cache.get(self.session_id, self.ai_key, limit)
+            if messages is not None:
+                return messages
+            token = self.cache.load_token()
+
+        stmt, newest_first = select_messages(
+            self.session_id, self.ai_key, after_id, limit
+        )
+        async with get_async_db_session() as session:
+            result = await session.execute(stmt)
+            messages = decode_messages(result.all(), newest_first)
+
+        if self.cache is not None and after_id is None:
+            self.cache.set(
+                self.session_id,
+                self.ai_key,
+                messages,
+                complete=limit is None or len(messages) < limit,
+                token=token,
+            )
+        return messages
+
+    async def add_message(self, message: BaseMessage) -> None:
+        await self.add_messages([message])
+
+    async def add_messages(self, messages: List[BaseMessage]) -> None:
+        """Store the messages in a single transaction"""
+        if not messages:
+            return
+        rows = [
+            message_to_row(self.session_id, self.ai_key, message)
+            for message in messages
+        ]
+        async with get_async_db_session() as session:
+            await session.run_sync(store_messages, rows)
+            await session.commit()
+        if self.cache is not None:
+            for message in messages:
+                self.cache.append(self.session_id, self.ai_key, message)
+
+    async def add_user_message(self, message: str) -> None:
+        await self.add_message(HumanMessage(content=message))
+
+    async def add_ai_message(self, message: str) -> None:
+        await self.add_message(AIMessage(content=message))
+
+    async def clear(self) -> None:
+        """Clear session memory from db"""
+        async with get_async_db_session() as session:
+            await session.run_sync(delete_messages, self.session_id)
+            await session.commit()
+        if self.cache is not None:
+            self.cache.invalidate(self.session_id)
+
+    async def fuzzy_search(
+        self, search: str, distance: int = 5, limit: int = 5
+    ) -> List[str]:
+        logger.info(f"Searching for {search} in {self.session_id}")
+        async with get_async_db_session() as session:
+            return await session.run_sync(
+                lambda sync_session: format_search_results(
+                    get_history_search().search(
+                        sync_session,
+                        self.ai_key,
+                        self.session_id,
+                        search,
+                        distance,
+                        limit,
+                    )
+                )
+            )
+
+    async def get_chats_sessions(
+        self, limit: Optional[int] = None, offset: int = 0
+    ) -> Dict[str, datetime]:
+        """Retrieve the ai_key sessions, most recently active first, a page with limit"""
+        async with get_async_db_session() as session:
+            result = await session.run_sync(
+                ChatSession.list_sessions, self.ai_key, limit, offset
+            )
+            return {record.session_id: record.first_activity_at for record in result}
+
+    async def delete_chat_session(self, session_id: str) -> int:
+        """Delete a record by ai_key and session_id"""
+        async with get_async_db_session() as session:
+            result = await session.run_sync(delete_messages, session_id, self.ai_key)
+            await session.commit()
+        if self.cache is not None:
+            self.cache.invalidate(session_id, self.ai_key)
+        return result
@@ -0,0 +1,149 @@
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from time import monotonic
+from typing import Dict, List, Optional, Tuple
+
+from langchain.schema.messages import BaseMessage
+
+CACHE_KEY_TYPE = Tuple[str, str]
+
+
+@dataclass
+class MessageCacheEntry:
+    messages: List[BaseMessage]
+    # True when messages holds the whole session, not only its tail
+    complete: bool
+    expires_at: float
+
+
+class MessageCache:
+    """
+    LRU cache of the decoded messages of a chat session keyed by (session_id, ai_key).
+
+    Entries are appended in place when a message is added and invalidated on clear/delete,
+    so within one process they stay in sync with the database. Writes from other processes
+    are only seen after ``ttl`` seconds.
+    """
+
+    def __init__(
+        self,
+        max_sessions: int = 256,
+        ttl: float = 300,
+        max_messages: Optional[int] = 500,
+    ):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.max_messages = max_messages
+        self._entries: "OrderedDict[CACHE_KEY_TYPE, MessageCacheEntry]" = OrderedDict()
+        self._lock = threading.RLock()
+        # bumped on every append/invalidate so a load racing a write is not cached
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __repr__(self):
+        return (
+            f"<MessageCache max_sessions={self.max_sessions} ttl={self.ttl} "
+            f"size={len(self._entries)}>"
+        )
+
+    def get(
+        self, session_id: str, ai_key: str, limit: Optional[int] = None
+    ) -> Optional[List[BaseMessage]]:
+        """Cached messages, the last `limit` ones if set, or None on a miss"""
+        with self._lock:
+            entry = self._get_entry((session_id, ai_key))
+            if entry is not None:
+                if limit is None and entry.complete:
+                    self.hits += 1
+                    return list(entry.messages)
+                if limit is not None and (
+                    entry.complete or len(entry.messages) >= limit
+                ):
+                    self.hits += 1
+                    return entry.messages[-limit:] if limit else []
+            self.misses += 1
+            return None
+
+    def load_token(self) -> int:
+        """Token to take before loading messages from db and pass to set()"""
+        with self._lock:
+            return self._writes
+
+    def set(
+        self,
+        session_id: str,
+        ai_key: str,
+        messages: List[BaseMessage],
+        complete: bool,
+        token: Optional[int] = None,
+    ) -> None:
+        with self._lock:
+            if token is not None and token != self._writes:
+                return
+            key = (session_id, ai_key)
+            self._entries[key] = MessageCacheEntry(
+                messages=list(messages),
+                complete=complete,
+                expires_at=monotonic() + self.ttl,
+            )
+            self._entries.move_to_end(key)
+            self._trim(self._entries[key])
+            while len(self._entries) > self.max_sessions:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def append(self, session_id: str, ai_key: str, message: BaseMessage) -> None:
+        """Append to the cached session, sessions not cached are left alone"""
+        with self._lock:
+            self._writes += 1
+            entry = self._get_entry((session_id, ai_key))
+            if entry is not None:
+                entry.messages.append(message)
+                self._trim(entry)
+
+    def invalidate(self, session_id: str, ai_key: Optional[str] = None) -> None:
+        """Drop a session for one ai_key, or for all of them if not given"""
+        with self._lock:
+            self._writes += 1
+            if ai_key is not None:
+                self._entries.pop((session_id, ai_key), None)
+                return
+            for key in [key for key in self._entries if key[0] == session_id]:
+                del self._entries[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._writes += 1
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+    def _get_entry(self, key: CACHE_KEY_TYPE) -> Optional[MessageCacheEntry]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at <= monotonic():
+            del self._entries[key]
+            self.expirations += 1
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _trim(self, entry: MessageCacheEntry) -> None:
+        if self.max_messages and len(entry.messages) > self.max_messages:
+            del entry.messages[: len(entry.messages) - self.max_messages]
+            entry.complete = False
@@ -1,22 +1,175 @@
-import json
 import logging
+import os
 from datetime import datetime
-from typing import Dict, List
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
 
 from langchain.schema import BaseChatMessageHistory
 from langchain.schema.messages import (
     BaseMessage,
     _message_from_dict,
-    _message_to_dict,
     messages_from_dict,
 )
+from sqlalchemy import Select, delete, select
 from sqlalchemy.orm import Session
 
+from expert_gpts.chat_history.cache import MessageCache
+from expert_gpts.chat_history.search import get_history_search
+from expert_gpts.chat_history.storage import decode_record, encode_message
+from expert_gpts.chat_history.write_behind import WriteBehindWriter
 from expert_gpts.database import get_db_session
 from expert_gpts.database.chat_message import ChatMessage as ExpertGPTsChatMessage
+from expert_gpts.database.chat_session import ChatSession
 
 logger = logging.getLogger(__name__)
 
+WRITE_BEHIND_ENABLED = os.getenv("CHAT_HISTORY_WRITE_BEHIND", "false").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv("CHAT_HISTORY_WRITE_BEHIND_BATCH_SIZE", 100))
+WRITE_BEHIND_FLUSH_INTERVAL = float(
+    os.getenv("CHAT_HISTORY_WRITE_BEHIND_FLUSH_INTERVAL", 0.5)
+)
+WRITE_BEHIND_MAX_PENDING = int(os.getenv("CHAT_HISTORY_WRITE_BEHIND_MAX_PENDING", 1000))
+WRITE_BEHIND_SHUTDOWN_TIMEOUT = float(
+    os.getenv("CHAT_HISTORY_WRITE_BEHIND_SHUTDOWN_TIMEOUT", 10)
+)
+
+CACHE_MAX_SESSIONS = int(os.getenv("CHAT_HISTORY_CACHE_SIZE", 256))
+CACHE_TTL = float(os.getenv("CHAT_HISTORY_CACHE_TTL", 300))
+CACHE_MAX_MESSAGES = int(os.getenv("CHAT_HISTORY_CACHE_MAX_MESSAGES", 500))
+
+# sessions per page of the UI sidebar
+CHAT_SESSIONS_PAGE_SIZE = int(os.getenv("CHAT_SESSIONS_PAGE_SIZE", 50))
+
+
+def message_to_row(session_id: str, ai_key: str, message: BaseMessage) -> Dict:
+    return dict(
+        session_id=session_id,
+        ai_key=ai_key,
+        quality=0,
+        created_at=datetime.now(),
+        **encode_message(message),
+    )
+
+
+def store_messages(session: Session, rows: List[Dict]) -> None:
+    """Insert message rows, index them and update the sessions catalog"""
+    messages = [ExpertGPTsChatMessage(**row) for row in rows]
+    session.add_all(messages)
+    session.flush()
+    get_history_search().index(session, messages)
+    ChatSession.record_messages(session, rows)
+
+
+def persist_messages(rows: List[Dict]) -> None:
+    """Bulk insert message rows and index them in a single transaction"""
+    if not rows:
+        return
+    with get_db_session() as session:
+        store_messages(session, rows)
+        session.commit()
+
+
+def delete_messages(session: Session, session_id: str, ai_key: Optional[str] = None):
+    """Delete the messages of a session, for one ai_key or all of them"""
+    stmt = delete(ExpertGPTsChatMessage).where(
+        ExpertGPTsChatMessage.session_id == session_id
+    )
+    if ai_key is not None:
+        stmt = stmt.where(ExpertGPTsChatMessage.ai_key == ai_key)
+    # the search index may look up the messages being deleted
+    get_history_search().delete(session, session_id, ai_key)
+    result = session.execute(stmt)
+    ChatSession.delete_sessions(session, session_id, ai_key)
+    return result.rowcount
+
+
+def select_messages(
+    session_id: str,
+    ai_key: str,
+    after_id: Optional[int] = None,
+    limit: Optional[int] = None,
+) -> Tuple[Select, bool]:
+    """
+    Query of the session messages, and whether it returns them newest first: tail
+    reads go newest first so the (session_id, ai_key, id) index stops at limit.
+    """
+    stmt = select(
+        ExpertGPTsChatMessage.message,
+        ExpertGPTsChatMessage.content,
+        ExpertGPTsChatMessage.type,
+        ExpertGPTsChatMessage.payload,
+    ).where(
+        ExpertGPTsChatMessage.session_id == session_id,
+        ExpertGPTsChatMessage.ai_key == ai_key,
+    )
+    if after_id is not None:
+        stmt = stmt.where(ExpertGPTsChatMessage.id > after_id)
+    newest_first = limit is not None and after_id is None
+    if newest_first:
+        stmt = stmt.order_by(ExpertGPTsChatMessage.id.desc())
+    else:
+        stmt = stmt.order_by(ExpertGPTsChatMessage.id.asc())
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    return stmt, newest_first
+
+
+def decode_messages(records, newest_first: bool = False) -> List[BaseMessage]:
+    items = [decode_record(record) for record in records]
+    if newest_first:
+        items.reverse()
+    return messages_from_dict(items)
+
+
+def select_last_message_id(session_id: str, ai_key: str) -> Select:
+    return (
+        select(ExpertGPTsChatMessage.id)
+        .where(
+            ExpertGPTsChatMessage.session_id == session_id,
+            ExpertGPTsChatMessage.ai_key == ai_key,
+        )
+        .order_by(ExpertGPTsChatMessage.id.desc())
+        .limit(1)
+    )
+
+
+def format_search_results(records: List[ExpertGPTsChatMessage]) -> List[str]:
+    items = []
+    for record in records:
+        content = decode_record(record)
+        items.append(
+            f"At {record.created_at}, by {content['type']}: {content['data']['content']}"
+        )
+    return items
+
+
+@lru_cache
+def get_write_behind_writer() -> Optional[WriteBehindWriter]:
+    if not WRITE_BEHIND_ENABLED:
+        return None
+    return WriteBehindWriter(
+        persist_messages,
+        batch_size=WRITE_BEHIND_BATCH_SIZE,
+        flush_interval=WRITE_BEHIND_FLUSH_INTERVAL,
+        max_pending=WRITE_BEHIND_MAX_PENDING,
+        shutdown_timeout=WRITE_BEHIND_SHUTDOWN_TIMEOUT,
+    )
+
+
+@lru_cache
+def get_message_cache() -> Optional[MessageCache]:
+    if CACHE_MAX_SESSIONS <= 0:
+        return None
+    return MessageCache(
+        max_sessions=CACHE_MAX_SESSIONS,
+        ttl=CACHE_TTL,
+        max_messages=CACHE_MAX_MESSAGES,
+    )
+
 
 class MysqlFuzzySearchConfig:
     def __init__(self, distance: int = 5, limit: int = 5):
@@ -33,33 +186,91 @@ class MysqlFuzzySearchConfig:
 class MysqlChatMessageHistory(BaseChatMessageHistory):
     """Chat message history stored in a Postgres database."""
 
-    def __init__(self, session_id: str, ai_key: str, session: Session):
+    def __init__(
+        self,
+        session_id: str,
+        ai_key: str,
+        session: Session,
+        writer: Optional[WriteBehindWriter] = None,
+        window: Optional[int] = None,
+        cache: Optional[MessageCache] = None,
+    ):
         self.ai_key = ai_key
         self.session = session
         self.session_id = session_id
+        self.writer = writer
+        self.window = window
+        self.cache = cache
+
+    def flush(self) -> None:
+        """Wait for the messages queued by the write-behind writer to be stored"""
+        if self.writer is not None and not self.writer.flush():
+            logger.error(
+                f"{self.session_id}: messages of the write-behind queue were lost, "
+                f"the history may miss them"
+            )
 
     @property
     def messages(self) -> List[BaseMessage]:  # type: ignore
-        """Retrieve all messages from db"""
+        """Retrieve the messages from db, only the last `window` ones if set"""
+        if self.window:
+            return self.get_last_messages(self.window)
+        return self._get_messages()
+
+    def get_last_messages(self, limit: int) -> List[BaseMessage]:
+        """Retrieve the last `limit` messages of the session, oldest first"""
+        return self._get_messages(limit=limit)
+
+    def get_messages_after(
+        self, message_id: int, limit: Optional[int] = None
+    ) -> List[BaseMessage]:
+        """Retrieve the messages stored after the message with id `message_id`"""
+        return self._get_messages(after_id=message_id, limit=limit)
+
+    def get_last_message_id(self) -> Optional[int]:
+        self.flush()
         with get_db_session() as session:
-            result = session.query(ExpertGPTsChatMessage).where(
-                ExpertGPTsChatMessage.session_id == self.session_id,
-                ExpertGPTsChatMessage.ai_key == self.ai_key,
+            return session.scalar(select_last_message_id(self.session_id, self.ai_key))
+
+    def _get_messages(
+        self, after_id: Optional[int] = None, limit: Optional[int] = None
+    ) -> List[BaseMessage]:
+        if self.cache is not None and after_id is None:
+            messages = self.cache.get(self.session_id, self.ai_key, limit)
+            if messages is not None:
+                return messages
+            token = self.cache.load_token()
+
+        self.flush()
+        stmt, newest_first = select_messages(
+            self.session_id, self.ai_key, after_id, limit
+        )
+        with get_db_session() as session:
+            messages = decode_messages(session.execute(stmt), newest_first)
+
+        if self.cache is not None and after_id is None:
+            self.cache.set(
+                self.session_id,
+                self.ai_key,
+                messages,
+                complete=limit is None or len(messages) < limit,
+                token=token,
             )
-            items = [json.loads(record.message) for record in result]
-            messages = messages_from_dict(items)
-            return messages
+        return messages
 
     @property
     def raw_messages(self):  # type: ignore
         """Retrieve all messages from db"""
+        self.flush()
         with get_db_session() as session:
-            result = session.query(ExpertGPTsChatMessage).where(
-                ExpertGPTsChatMessage.session_id == self.session_id
+            result = (
+                session.query(ExpertGPTsChatMessage)
+                .where(ExpertGPTsChatMessage.session_id == self.session_id)
+                .order_by(ExpertGPTsChatMessage.id.asc())
             )
             items = [
                 {
-                    "message": _message_from_dict(json.loads(record.message)),
+                    "message": _message_from_dict(decode_record(record)),
                     "created_at": record.created_at,
                 }
                 for record in result
@@ -68,65 +279,47 @@ class MysqlChatMessageHistory(BaseChatMessageHistory):
 
     def add_message(self, message: BaseMessage) -> None:
         """Append the message to the record in db"""
-        with get_db_session() as session:
-            jsonstr = json.dumps(_message_to_dict(message))
-            session.add(
-                ExpertGPTsChatMessage(
-                    session_id=self.session_id,
-                    message=jsonstr,
-                    ai_key=self.ai_key,
-                    quality=0,
-                    created_at=datetime.now().isoformat(),
-                )
-            )
-            session.commit()
+        row = message_to_row(self.session_id, self.ai_key, message)
+        if self.writer is not None:
+            self.writer.put(row)
+        else:
+            persist_messages([row])
+        if self.cache is not None:
+            self.cache.append(self.session_id, self.ai_key, message)
 
     def clear(self) -> None:
         """Clear session memory from db"""
-
+        self.flush()
         with get_db_session() as session:
-            session.query(ExpertGPTsChatMessage).filter(
-                ExpertGPTsChatMessage.session_id == self.session_id
-            ).delete()
+            delete_messages(session, self.session_id)
+            session.commit()
+        if self.cache is not None:
+            self.cache.invalidate(self.session_id)
 
     def fuzzy_search(self, search: str, distance: int = 5, limit: int = 5):
         logger.info(f"Searching for {search} in {self.session_id}")
+        self.flush()
         with get_db_session() as session:
-            messages = ExpertGPTsChatMessage.search_by_message_levenstein(
-                self.ai_key, self.session_id, search, session, distance, limit
+            messages = get_history_search().search(
+                session, self.ai_key, self.session_id, search, distance, limit
             )
-            items = []
-            for record in messages:
-                content = json.loads(json.loads(record.message))
-                items.append(
-                    f"At {record.created_at}, by {content['type']}: {content['data']['content']}"
-                )
-            return items
+            return format_search_results(messages)
 
-    def get_chats_sessions(self) -> Dict[str, datetime]:  # type: ignore
-        """Retrieve all messages from db"""
+    def get_chats_sessions(
+        self, limit: Optional[int] = None, offset: int = 0
+    ) -> Dict[str, datetime]:  # type: ignore
+        """Retrieve the ai_key sessions, most recently active first, a page with limit"""
+        self.flush()
         with get_db_session() as session:
-            result = (
-                session.query(ExpertGPTsChatMessage)
-                .filter(
-                    ExpertGPTsChatMessage.ai_key == self.ai_key,
-                )
-                .order_by(ExpertGPTsChatMessage.created_at.desc())
-                .distinct()
-            )
-            sessions_dict = {record.session_id: record.created_at for record in result}
-            return sessions_dict
+            result = ChatSession.list_sessions(session, self.ai_key, limit, offset)
+            return {record.session_id: record.first_activity_at for record in result}
 
     def delete_chat_session(self, session_id) -> bool:  # type: ignore
         """Delete a record by ai_key and session_id"""
+        self.flush()
         with get_db_session() as session:
-            result = (
-                session.query(ExpertGPTsChatMessage)
-                .filter(
-                    ExpertGPTsChatMessage.ai_key == self.ai_key,
-                    ExpertGPTsChatMessage.session_id == session_id,
-                )
-                .delete()
-            )
+            result = delete_messages(session, session_id, self.ai_key)
             session.commit()
-            return result
+        if self.cache is not None:
+            self.cache.invalidate(session_id, self.ai_key)
+        return result
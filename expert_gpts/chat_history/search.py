@@ -0,0 +1,242 @@
+import logging
+import os
+import re
+import zlib
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Set
+
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.orm import Session
+
+from expert_gpts.chat_history.storage import record_content
+from expert_gpts.database.chat_message import ChatMessage
+from expert_gpts.database.message_trigram import MessageTrigram
+
+logger = logging.getLogger(__name__)
+
+HISTORY_SEARCH_BACKEND = os.getenv("CHAT_HISTORY_SEARCH", "trigram")
+
+WHITESPACES = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    return WHITESPACES.sub(" ", text.lower()).strip()
+
+
+def trigrams(text: str) -> Set[int]:
+    """Hashes of the distinct trigrams of the normalized text, see MessageTrigram"""
+    text = normalize_text(text)
+    if len(text) < 3:
+        grams = {text} if text else set()
+    else:
+        grams = {"".join(gram) for gram in zip(text, text[1:], text[2:])}
+    return {zlib.crc32(gram.encode("utf-8")) - 2**31 for gram in grams}
+
+
+def substring_distance(pattern: str, text: str, distance: int) -> Optional[int]:
+    """
+    Fewest edits turning pattern into a substring of text, None when more than
+    distance. Myers' bit-parallel algorithm, one pass over text with integers of
+    len(pattern) bits.
+    """
+    length = len(pattern)
+    if not length:
+        return 0
+    mask = (1 << length) - 1
+    last = 1 << (length - 1)
+    equal: Dict[str, int] = {}
+    for i, char in enumerate(pattern):
+        equal[char] = equal.get(char, 0) | (1 << i)
+    positive, negative, score, best = mask, 0, length, length
+    for char in text:
+        eq = equal.get(char, 0)
+        xv = eq | negative
+        xh = (((eq & positive) + positive) ^ positive) | eq
+        horizontal_positive = negative | (~(xh | positive) & mask)
+        horizontal_negative = positive & xh
+        if horizontal_positive & last:
+            score += 1
+        elif horizontal_negative & last:
+            score -= 1
+        # the match may start anywhere in text, the first row stays 0
+        horizontal_positive = (horizontal_positive << 1) & mask
+        horizontal_negative = (horizontal_negative << 1) & mask
+        positive = horizontal_negative | (~(xv | horizontal_positive) & mask)
+        negative = horizontal_positive & xv
+        best = min(best, score)
+    return best if best <= distance else None
+
+
+class HistorySearchBase:
+    """Fuzzy search over the messages of a chat session"""
+
+    def index(self, session: Session, messages: Sequence[ChatMessage]):
+        """Called with the new messages, in the same transaction that inserts them"""
+        pass
+
+    def delete(self, session: Session, session_id: str, ai_key: Optional[str] = None):
+        """Called before the messages of a session, of every ai_key when None, are deleted"""
+        pass
+
+    def search(
+        self,
+        session: Session,
+        ai_key: str,
+        session_id: str,
+        search: str,
+        distance: int = 5,
+        limit: int = 5,
+    ) -> List[ChatMessage]:
+        """
+        Messages matching search within distance edits, best first: the trigram
+        search matches messages containing it, the levenshtein one whole messages
+        """
+        raise NotImplementedError
+
+
+class TrigramHistorySearch(HistorySearchBase):
+    """
+    Portable fuzzy search backed by the message_trigram inverted index.
+
+    A message containing the search text within `distance` edits shares at least
+    len(trigrams(search)) - 3 * distance trigrams with it (each edit breaks at most
+    three trigrams), so candidates are found with an index-driven GROUP BY on the
+    shared trigrams, checked with substring_distance (short searches share too few
+    trigrams to tell) and ranked by edits, shared trigrams and trigram similarity.
+    """
+
+    def __init__(self, max_candidates: int = 200):
+        self.max_candidates = max_candidates
+
+    def index(self, session: Session, messages: Sequence[ChatMessage]):
+        rows = [
+            dict(
+                message_id=message.id,
+                session_id=message.session_id,
+                ai_key=message.ai_key,
+                trigram=trigram,
+            )
+            for message in messages
+            for trigram in trigrams(record_content(message))
+        ]
+        if rows:
+            session.execute(insert(MessageTrigram), rows)
+
+    def delete(self, session: Session, session_id: str, ai_key: Optional[str] = None):
+        if ai_key is not None:
+            # ix_message_trigram_lookup
+            stmt = delete(MessageTrigram).where(
+                MessageTrigram.ai_key == ai_key,
+                MessageTrigram.session_id == session_id,
+            )
+        else:
+            # every ai_key of the session: the trigrams of its messages, by primary key
+            stmt = delete(MessageTrigram).where(
+                MessageTrigram.message_id.in_(
+                    select(ChatMessage.id).where(ChatMessage.session_id == session_id)
+                )
+            )
+        session.execute(stmt)
+
+    def search(
+        self,
+        session: Session,
+        ai_key: str,
+        session_id: str,
+        search: str,
+        distance: int = 5,
+        limit: int = 5,
+    ) -> List[ChatMessage]:
+        search_trigrams = trigrams(search)
+        if not search_trigrams:
+            return []
+        min_shared = max(len(search_trigrams) - 3 * distance, 1)
+
+        shared = func.count(MessageTrigram.trigram).label("shared")
+        candidates = session.execute(
+            select(MessageTrigram.message_id, shared)
+            .where(
+                MessageTrigram.ai_key == ai_key,
+                MessageTrigram.session_id == session_id,
+                MessageTrigram.trigram.in_(search_trigrams),
+            )
+            .group_by(MessageTrigram.message_id)
+            .having(shared >= min_shared)
+            .order_by(shared.desc())
+            .limit(self.max_candidates)
+        ).all()
+        if not candidates:
+            return []
+
+        shared_by_id: Dict[int, int] = {
+            row.message_id: row.shared for row in candidates
+        }
+        messages = session.scalars(
+            select(ChatMessage).where(ChatMessage.id.in_(shared_by_id.keys()))
+        ).all()
+
+        pattern = normalize_text(search)
+        ranked = []
+        for message in messages:
+            content = record_content(message)
+            edits = substring_distance(pattern, normalize_text(content), distance)
+            if edits is None:
+                continue
+            shared_count = shared_by_id[message.id]
+            similarity = (
+                2 * shared_count / (len(search_trigrams) + len(trigrams(content)))
+            )
+            ranked.append(((edits, -shared_count, -similarity, message.id), message))
+        ranked.sort(key=lambda item: item[0])
+        return [message for _, message in ranked[:limit]]
+
+    def reindex(self, session: Session, batch_size: int = 1000) -> int:
+        """Rebuild the whole index from message_store, returns indexed messages"""
+        session.execute(delete(MessageTrigram))
+        indexed, last_id = 0, 0
+        while True:
+            messages = session.scalars(
+                select(ChatMessage)
+                .where(ChatMessage.id > last_id)
+                .order_by(ChatMessage.id)
+                .limit(batch_size)
+            ).all()
+            if not messages:
+                return indexed
+            self.index(session, messages)
+            indexed += len(messages)
+            last_id = messages[-1].id
+
+
+class LevenshteinHistorySearch(HistorySearchBase):
+    """
+    MySQL/MariaDB only search with the levenshtein stored function, see
+    ChatMessage.create_levenstein: distance of the whole message to the search.
+    Scans every message of the session.
+    """
+
+    def search(
+        self,
+        session: Session,
+        ai_key: str,
+        session_id: str,
+        search: str,
+        distance: int = 5,
+        limit: int = 5,
+    ) -> List[ChatMessage]:
+        return ChatMessage.search_by_message_levenstein(
+            ai_key, session_id, search, session, distance, limit
+        )
+
+
+HISTORY_SEARCH_BACKENDS = {
+    "trigram": TrigramHistorySearch,
+    "levenshtein": LevenshteinHistorySearch,
+}
+
+
+@lru_cache
+def get_history_search() -> HistorySearchBase:
+    if HISTORY_SEARCH_BACKEND not in HISTORY_SEARCH_BACKENDS:
+        raise ValueError(f"Unknown chat history search {HISTORY_SEARCH_BACKEND}")
+    return HISTORY_SEARCH_BACKENDS[HISTORY_SEARCH_BACKEND]()
@@ -0,0 +1,91 @@
+"""
+Storage formats of the message_store rows.
+
+json: the whole LangChain message dict as JSON text in `message` (legacy format).
+compact: the content and type in plain `content`/`type` columns, queryable without
+decoding, and the rest of the dict (additional_kwargs, example...) zlib compressed in
+`payload`. `message` is left as JSON null.
+
+Both formats are read transparently, existing json rows are converted with
+`python -m bin.chat_history compact-storage`.
+"""
+import json
+import os
+import zlib
+from typing import Dict
+
+from langchain.schema.messages import BaseMessage, _message_to_dict
+from sqlalchemy import JSON, select, update
+from sqlalchemy.orm import Session
+
+from expert_gpts.database.chat_message import ChatMessage
+
+STORAGE_FORMAT = os.getenv("CHAT_HISTORY_STORAGE_FORMAT", "json")
+STORAGE_FORMATS = ("json", "compact")
+
+
+def compress(data: Dict) -> bytes:
+    return zlib.compress(json.dumps(data, separators=(",", ":")).encode("utf-8"))
+
+
+def encode_message(message: BaseMessage, storage_format: str = STORAGE_FORMAT) -> Dict:
+    """message_store columns of a message in the given storage format"""
+    return encode_message_dict(_message_to_dict(message), storage_format)
+
+
+def encode_message_dict(item: Dict, storage_format: str = STORAGE_FORMAT) -> Dict:
+    if storage_format == "json":
+        return dict(message=json.dumps(item))
+    if storage_format == "compact":
+        data = dict(item["data"])
+        content = data.pop("content")
+        return dict(
+            message=JSON.NULL,
+            content=content,
+            type=item["type"],
+            payload=compress(data),
+        )
+    raise ValueError(f"Unknown chat history storage format {storage_format}")
+
+
+def decode_record(record) -> Dict:
+    """LangChain message dict of a row with message, content, type and payload"""
+    if record.payload is None:
+        return json.loads(record.message)
+    data = json.loads(zlib.decompress(record.payload))
+    data["content"] = record.content
+    return {"type": record.type, "data": data}
+
+
+def record_content(record) -> str:
+    """Text content of a row, without decoding the payload of compact rows"""
+    if record.content is not None:
+        return record.content
+    return json.loads(record.message)["data"]["content"]
+
+
+def compact_messages(session: Session, batch_size: int = 1000) -> int:
+    """Convert the json rows to the compact format, returns converted rows"""
+    converted, last_id = 0, 0
+    while True:
+        records = session.execute(
+            select(ChatMessage.id, ChatMessage.message)
+            .where(ChatMessage.id > last_id, ChatMessage.payload.is_(None))
+            .order_by(ChatMessage.id)
+            .limit(batch_size)
+        ).all()
+        if not records:
+            return converted
+        session.execute(
+            update(ChatMessage),
+            [
+                dict(
+                    id=record.id,
+                    **encode_message_dict(json.loads(record.message), "compact"),
+                )
+                for record in records
+            ],
+        )
+        session.commit()
+        converted += len(records)
+        last_id = records[-1].id
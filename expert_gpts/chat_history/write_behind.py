@@ -0,0 +1,185 @@
+import atexit
+import logging
+import threading
+from collections import deque
+from time import monotonic, sleep
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+MAX_WRITE_RETRIES = 5
+# seconds before the first retry of a batch, doubled on each one
+WRITE_RETRY_BACKOFF = 0.5
+WRITE_RETRY_MAX_BACKOFF = 5.0
+
+
+class WriteBehindWriter:
+    """
+    Buffers rows in a bounded in-process queue and persists them in batches from a
+    background thread.
+
+    A batch is written when ``batch_size`` rows are pending or when the oldest pending
+    row has waited ``flush_interval`` seconds. ``max_pending`` bounds the queue: when it
+    is full ``put`` blocks the caller until the flusher frees space (back-pressure).
+    On a hard crash at most ``max_pending`` rows / ``flush_interval`` seconds of
+    messages are lost; on a normal interpreter exit the queue is drained for up to
+    ``shutdown_timeout`` seconds.
+
+    A failing batch is retried ``MAX_WRITE_RETRIES`` times with an exponential backoff,
+    the queue filling up meanwhile. A batch still failing is dropped, logged as an
+    error, and the next ``flush`` returns False.
+    """
+
+    def __init__(
+        self,
+        sink: Callable[[List[Dict]], None],
+        batch_size: int = 100,
+        flush_interval: float = 0.5,
+        max_pending: int = 1000,
+        shutdown_timeout: float = 10,
+        name: str = "chat-history-write-behind",
+    ):
+        self.sink = sink
+        self.name = name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max(max_pending, batch_size)
+        self.shutdown_timeout = shutdown_timeout
+
+        self._pending: Deque[Tuple[float, Dict]] = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._enqueued = 0
+        self._processed = 0
+        self._flush_until = 0
+        self._batches = 0
+        self._failed_batches = 0
+        self._dropped = 0
+        # dropped rows already reported by a flush
+        self._dropped_reported = 0
+
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def __repr__(self):
+        return (
+            f"<WriteBehindWriter batch_size={self.batch_size} "
+            f"flush_interval={self.flush_interval} max_pending={self.max_pending}>"
+        )
+
+    def put(self, row: Dict) -> None:
+        """Queue a row, blocking while the queue is full."""
+        with self._cond:
+            if self._closed:
+                write_inline = True
+            else:
+                write_inline = False
+                while len(self._pending) >= self.max_pending:
+                    self._flush_until = max(self._flush_until, self._enqueued)
+                    self._cond.notify_all()
+                    self._cond.wait()
+                self._pending.append((monotonic(), row))
+                self._enqueued += 1
+                if len(self._pending) >= self.batch_size:
+                    self._cond.notify_all()
+        if write_inline:
+            self.sink([row])
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until every row queued before this call has been written. False on timeout,
+        or when rows were dropped since the previous flush.
+        """
+        with self._cond:
+            target = self._enqueued
+            if self._processed < target:
+                self._flush_until = max(self._flush_until, target)
+                self._cond.notify_all()
+                if not self._cond.wait_for(lambda: self._processed >= target, timeout):
+                    return False
+            dropped = self._dropped - self._dropped_reported
+            self._dropped_reported = self._dropped
+            return not dropped
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """Stop accepting queued rows and drain what is pending."""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(self.shutdown_timeout if timeout is None else timeout)
+        if self._thread.is_alive():
+            logger.error(
+                f"{self.name} queue not drained on shutdown, "
+                f"{len(self._pending)} rows lost"
+            )
+
+    def stats(self) -> Dict[str, int]:
+        with self._cond:
+            return {
+                "enqueued": self._enqueued,
+                "processed": self._processed,
+                "pending": len(self._pending),
+                "batches": self._batches,
+                "failed_batches": self._failed_batches,
+                "dropped": self._dropped,
+            }
+
+    def _must_write(self) -> bool:
+        if not self._pending:
+            return False
+        if self._closed or len(self._pending) >= self.batch_size:
+            return True
+        if self._flush_until > self._processed:
+            return True
+        return monotonic() - self._pending[0][0] >= self.flush_interval
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._must_write():
+                    if self._closed and not self._pending:
+                        return
+                    if self._pending:
+                        timeout = self._pending[0][0] + self.flush_interval
+                        self._cond.wait(max(timeout - monotonic(), 0))
+                    else:
+                        self._cond.wait()
+                batch = [
+                    self._pending.popleft()[1]
+                    for _ in range(min(self.batch_size, len(self._pending)))
+                ]
+                self._cond.notify_all()
+
+            written = self._write(batch)
+
+            with self._cond:
+                self._processed += len(batch)
+                self._batches += 1
+                if not written:
+                    self._dropped += len(batch)
+                self._cond.notify_all()
+
+    def _write(self, batch: List[Dict]) -> bool:
+        """Write the batch, retrying with backoff, False when it is dropped"""
+        backoff = WRITE_RETRY_BACKOFF
+        for attempt in range(1, MAX_WRITE_RETRIES + 1):
+            try:
+                self.sink(batch)
+                return True
+            except Exception:
+                logger.exception(
+                    f"{self.name}: error persisting {len(batch)} rows "
+                    f"(attempt {attempt}/{MAX_WRITE_RETRIES})"
+                )
+                with self._cond:
+                    self._failed_batches += 1
+            if attempt < MAX_WRITE_RETRIES:
+                sleep(backoff)
+                backoff = min(backoff * 2, WRITE_RETRY_MAX_BACKOFF)
+        logger.error(
+            f"{self.name}: dropped {len(batch)} rows after {MAX_WRITE_RETRIES} attempts"
+        )
+        return False
@@ -1,28 +1,155 @@
+"""
+Database engine and sessions.
+
+The engine is created once per process with a pooled, pre-pinged connection pool
+configured from env (see .env.dist). Dash runs every callback in a thread of its
+server, so the pattern is one short session per unit of work:
+
+    with get_db_session() as session:
+        ...
+        session.commit()
+
+Sessions are never shared between threads, the pool bounds the connections
+(DATABASE_POOL_SIZE + DATABASE_MAX_OVERFLOW) and makes callbacks wait up to
+DATABASE_POOL_TIMEOUT seconds for one when all are checked out (back-pressure).
+Code that prefers a thread-local session can use get_session() and must call
+ScopedSession.remove() when the request ends.
+"""
+import logging
 import os
+import threading
 from contextlib import contextmanager
+from time import perf_counter
+from typing import Dict
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine, make_url
 from sqlalchemy.orm import DeclarativeBase, scoped_session, sessionmaker
+from sqlalchemy.pool import QueuePool
+
+logger = logging.getLogger(__name__)
+
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///var/db.sqlite")
+DATABASE_POOL_SIZE = int(os.getenv("DATABASE_POOL_SIZE", 5))
+DATABASE_MAX_OVERFLOW = int(os.getenv("DATABASE_MAX_OVERFLOW", 10))
+DATABASE_POOL_TIMEOUT = float(os.getenv("DATABASE_POOL_TIMEOUT", 30))
+# recycle connections before the MariaDB wait_timeout closes them server side
+DATABASE_POOL_RECYCLE = int(os.getenv("DATABASE_POOL_RECYCLE", 3600))
+DATABASE_POOL_PRE_PING = os.getenv("DATABASE_POOL_PRE_PING", "true").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+
+
+class PoolMetrics:
+    """Counters of the connection pool, updated from the pool events"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.connects = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.invalidations = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    def increment(self, counter: str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def record_wait(self, seconds: float):
+        with self._lock:
+            self.wait_time += seconds
+            self.max_wait_time = max(self.max_wait_time, seconds)
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "connects": self.connects,
+                "checkouts": self.checkouts,
+                "checkins": self.checkins,
+                "checked_out": self.checkouts - self.checkins,
+                "invalidations": self.invalidations,
+                "avg_wait_time": self.wait_time / self.checkouts
+                if self.checkouts
+                else 0.0,
+                "max_wait_time": self.max_wait_time,
+            }
+
 
-engine = create_engine(os.getenv("DATABASE_URL", "sqlite:///var/db.sqlite"))
+pool_metrics = PoolMetrics()
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool recording how long checkouts wait for a connection"""
+
+    def _do_get(self):
+        started_at = perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            pool_metrics.record_wait(perf_counter() - started_at)
+
+
+def create_configured_engine(url: str = DATABASE_URL, **kwargs) -> Engine:
+    options = dict(pool_pre_ping=DATABASE_POOL_PRE_PING)
+    database_url = make_url(url)
+    in_memory = database_url.get_backend_name() == "sqlite" and (
+        database_url.database in (None, "", ":memory:")
+    )
+    if not in_memory:
+        # in memory sqlite needs its SingletonThreadPool, everything else is pooled
+        options.update(
+            poolclass=TimedQueuePool,
+            pool_size=DATABASE_POOL_SIZE,
+            max_overflow=DATABASE_MAX_OVERFLOW,
+            pool_timeout=DATABASE_POOL_TIMEOUT,
+            pool_recycle=DATABASE_POOL_RECYCLE,
+        )
+    options.update(kwargs)
+    configured_engine = create_engine(database_url, **options)
+
+    event.listen(
+        configured_engine, "connect", lambda *args: pool_metrics.increment("connects")
+    )
+    event.listen(
+        configured_engine, "checkout", lambda *args: pool_metrics.increment("checkouts")
+    )
+    event.listen(
+        configured_engine, "checkin", lambda *args: pool_metrics.increment("checkins")
+    )
+    event.listen(
+        configured_engine,
+        "invalidate",
+        lambda *args: pool_metrics.increment("invalidations"),
+    )
+    return configured_engine
+
+
+engine = create_configured_engine()
+SessionLocal = sessionmaker(bind=engine)
+ScopedSession = scoped_session(SessionLocal)
 
 
 def get_session():
-    session_factory = sessionmaker(bind=engine)
-    return scoped_session(session_factory)
+    return ScopedSession
+
+
+def get_pool_metrics() -> Dict[str, float]:
+    return {**pool_metrics.snapshot(), "status": engine.pool.status()}
 
 
 @contextmanager
 def get_db_session():
-    session = get_session()
+    session = SessionLocal()
     try:
         yield session
-        session.close()
     except Exception as e:
         session.rollback()
         raise e
     finally:
-        session.remove()
+        session.close()
 
 
 def with_db_session(func):
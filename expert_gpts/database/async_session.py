@@ -0,0 +1,92 @@
+"""
+Async engine and sessions, for asyncio callers of the chat history
+(see expert_gpts.chat_history.async_history).
+
+ASYNC_DATABASE_URL defaults to DATABASE_URL with its async driver: aiosqlite for
+SQLite, aiomysql for MySQL/MariaDB (asyncmy works too by setting the URL) and asyncpg
+for Postgres. The pool is configured with the same DATABASE_POOL_* env as the sync one.
+"""
+import os
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import AsyncIterator
+
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import (
+    AsyncEngine,
+    AsyncSession,
+    async_sessionmaker,
+    create_async_engine,
+)
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from expert_gpts.database import (
+    DATABASE_MAX_OVERFLOW,
+    DATABASE_POOL_PRE_PING,
+    DATABASE_POOL_RECYCLE,
+    DATABASE_POOL_SIZE,
+    DATABASE_POOL_TIMEOUT,
+    DATABASE_URL,
+)
+
+ASYNC_DRIVERS = {
+    "sqlite": "aiosqlite",
+    "mysql": "aiomysql",
+    "mariadb": "aiomysql",
+    "postgresql": "asyncpg",
+}
+
+
+def to_async_url(url: str) -> str:
+    """Same database with the async driver of its backend"""
+    database_url = make_url(url)
+    backend = database_url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver known for {backend}")
+    return database_url.set(
+        drivername=f"{backend}+{ASYNC_DRIVERS[backend]}"
+    ).render_as_string(hide_password=False)
+
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or to_async_url(DATABASE_URL)
+
+
+def create_configured_async_engine(url: str = ASYNC_DATABASE_URL, **kwargs):
+    options = dict(pool_pre_ping=DATABASE_POOL_PRE_PING)
+    database_url = make_url(url)
+    in_memory = database_url.get_backend_name() == "sqlite" and (
+        database_url.database in (None, "", ":memory:")
+    )
+    if not in_memory:
+        # aiosqlite defaults to NullPool, pool every backend the same way
+        options.update(
+            poolclass=AsyncAdaptedQueuePool,
+            pool_size=DATABASE_POOL_SIZE,
+            max_overflow=DATABASE_MAX_OVERFLOW,
+            pool_timeout=DATABASE_POOL_TIMEOUT,
+            pool_recycle=DATABASE_POOL_RECYCLE,
+        )
+    options.update(kwargs)
+    return create_async_engine(database_url, **options)
+
+
+@lru_cache
+def get_async_engine() -> AsyncEngine:
+    return create_configured_async_engine()
+
+
+@lru_cache
+def get_async_sessionmaker() -> async_sessionmaker:
+    return async_sessionmaker(bind=get_async_engine(), expire_on_commit=False)
+
+
+@asynccontextmanager
+async def get_async_db_session() -> AsyncIterator[AsyncSession]:
+    session = get_async_sessionmaker()()
+    try:
+        yield session
+    except Exception as e:
+        await session.rollback()
+        raise e
+    finally:
+        await session.close()
@@ -1,6 +1,17 @@
 from typing import Optional
 
-from sqlalchemy import JSON, DateTime, Integer, String, text
+from sqlalchemy import (
+    JSON,
+    DateTime,
+    Index,
+    Integer,
+    LargeBinary,
+    String,
+    Text,
+    inspect,
+    text,
+)
+from sqlalchemy.dialects.mysql import MEDIUMTEXT
 from sqlalchemy.engine.base import Engine
 from sqlalchemy.orm import Mapped, Session, mapped_column
 
@@ -9,6 +20,12 @@ from expert_gpts.database import Base
 
 class ChatMessage(Base):
     __tablename__ = "message_store"
+    __table_args__ = (
+        # tail reads of a session: WHERE session_id, ai_key ORDER BY id DESC LIMIT n
+        Index("ix_message_store_session_ai_key_id", "session_id", "ai_key", "id"),
+        # sessions listing of an ai_key ordered by activity
+        Index("ix_message_store_ai_key_created_at", "ai_key", "created_at"),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
     created_at: Mapped[str] = mapped_column(DateTime())
@@ -16,6 +33,48 @@ class ChatMessage(Base):
     ai_key: Mapped[str] = mapped_column(String(190))
     message: Mapped[str] = mapped_column(JSON())
     quality: Mapped[Optional[int]] = mapped_column(Integer(), nullable=True)
+    # compact storage format, see expert_gpts.chat_history.storage
+    content: Mapped[Optional[str]] = mapped_column(
+        Text().with_variant(MEDIUMTEXT(), "mysql", "mariadb"), nullable=True
+    )
+    type: Mapped[Optional[str]] = mapped_column(String(32), nullable=True)
+    payload: Mapped[Optional[bytes]] = mapped_column(LargeBinary(), nullable=True)
+
+    @classmethod
+    def create_indexes(cls, engine: Engine):
+        """
+        create_all skips tables that already exist, so indexes added later to
+        the model have to be created one by one on existing databases.
+
+        :param engine:
+        :return:
+        """
+        for index in cls.__table__.indexes:
+            index.create(engine, checkfirst=True)
+
+    @classmethod
+    def create_columns(cls, engine: Engine):
+        """
+        Same as create_indexes for columns added later to the model, they are all
+        nullable so existing rows stay valid.
+
+        :param engine:
+        :return:
+        """
+        existing = {
+            column["name"] for column in inspect(engine).get_columns(cls.__tablename__)
+        }
+        with engine.begin() as connection:
+            for column in cls.__table__.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                connection.execute(
+                    text(
+                        f"ALTER TABLE {cls.__tablename__} "
+                        f"ADD COLUMN {column.name} {column_type} NULL"
+                    )
+                )
 
     @classmethod
     def create_levenstein(cls, engine: Engine):
@@ -90,33 +149,22 @@ END;
         distance: int = 4,
         limit: int = 3,
     ) -> list["ChatMessage"]:
-        # create query with query builder - order of where very important
-        # SELECT *, JSON_VALUE(message, '$.message.content') as message_2
-        # FROM `message_store` WHERE session_id = "{session_id}"
-        # AND
-        # levenshtein({message}, JSON_VALUE(message, '$.message.content'))
-        # BETWEEN 0 AND {distance} LIMIT {limit};
-
-        query = """
-SELECT *, JSON_VALUE(message, '$.message.content') as message_2
-FROM `message_store` WHERE
-session_id = "{session_id}"
-AND
-ai_key = "{ai_key}"
-AND
-levenshtein("{message}", JSON_VALUE(message, '$.message.content'))
-BETWEEN 0 AND {distance} ORDER BY created_at ASC LIMIT {limit};
-        """
-
-        query = session.execute(
-            text(
-                query.format(
-                    message=message,
-                    distance=distance,
-                    limit=limit,
-                    session_id=session_id,
-                    ai_key=ai_key,
-                )
+        # SELECT * FROM `message_store` WHERE session_id = :session_id AND ai_key = :ai_key
+        # AND levenshtein(:message, COALESCE(content, JSON_VALUE(message, '$.message.content')))
+        # BETWEEN 0 AND :distance ORDER BY created_at ASC LIMIT :limit;
+        return (
+            session.query(cls)
+            .where(
+                cls.session_id == session_id,
+                cls.ai_key == ai_key,
+                text(
+                    "levenshtein(:message, "
+                    "COALESCE(content, JSON_VALUE(message, '$.message.content'))) "
+                    "BETWEEN 0 AND :distance"
+                ),
             )
+            .order_by(cls.created_at.asc())
+            .limit(limit)
+            .params(message=message, distance=distance)
+            .all()
         )
-        return query.all()
@@ -0,0 +1,144 @@
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy import (
+    DateTime,
+    Index,
+    Integer,
+    String,
+    delete,
+    func,
+    insert,
+    select,
+    update,
+)
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Mapped, Session, mapped_column
+
+from expert_gpts.database import Base
+from expert_gpts.database.chat_message import ChatMessage
+
+
+class ChatSession(Base):
+    """Catalog of the chat sessions of message_store, one row per session and ai_key"""
+
+    __tablename__ = "chat_session"
+    __table_args__ = (
+        Index("ix_chat_session_ai_key_last_activity", "ai_key", "last_activity_at"),
+    )
+
+    session_id: Mapped[str] = mapped_column(String(190), primary_key=True)
+    ai_key: Mapped[str] = mapped_column(String(190), primary_key=True)
+    first_activity_at: Mapped[datetime] = mapped_column(DateTime())
+    last_activity_at: Mapped[datetime] = mapped_column(DateTime())
+    message_count: Mapped[int] = mapped_column(Integer(), default=0)
+
+    @classmethod
+    def record_messages(cls, session: Session, rows: List[Dict]):
+        """
+        Update the catalog with new message_store rows, in the same transaction
+        that inserts them.
+
+        :param session:
+        :param rows: message_store rows with session_id, ai_key and created_at
+        :return:
+        """
+        activity = {}
+        for row in rows:
+            key = (row["session_id"], row["ai_key"])
+            first, last, count = activity.get(
+                key, (row["created_at"], row["created_at"], 0)
+            )
+            activity[key] = (
+                min(first, row["created_at"]),
+                max(last, row["created_at"]),
+                count + 1,
+            )
+
+        for (session_id, ai_key), (first, last, count) in activity.items():
+            if cls._add_activity(session, session_id, ai_key, last, count):
+                continue
+            try:
+                with session.begin_nested():
+                    session.execute(
+                        insert(cls).values(
+                            session_id=session_id,
+                            ai_key=ai_key,
+                            first_activity_at=first,
+                            last_activity_at=last,
+                            message_count=count,
+                        )
+                    )
+            except IntegrityError:
+                # created meanwhile by another writer
+                cls._add_activity(session, session_id, ai_key, last, count)
+
+    @classmethod
+    def _add_activity(
+        cls, session: Session, session_id: str, ai_key: str, last: datetime, count: int
+    ) -> bool:
+        result = session.execute(
+            update(cls)
+            .where(cls.session_id == session_id, cls.ai_key == ai_key)
+            .values(
+                last_activity_at=last,
+                message_count=cls.message_count + count,
+            )
+        )
+        return result.rowcount > 0
+
+    @classmethod
+    def delete_sessions(
+        cls, session: Session, session_id: str, ai_key: Optional[str] = None
+    ):
+        stmt = delete(cls).where(cls.session_id == session_id)
+        if ai_key is not None:
+            stmt = stmt.where(cls.ai_key == ai_key)
+        session.execute(stmt)
+
+    @classmethod
+    def list_sessions(
+        cls,
+        session: Session,
+        ai_key: str,
+        limit: Optional[int] = None,
+        offset: int = 0,
+    ) -> List["ChatSession"]:
+        """Sessions of an ai_key, most recent activity first, all of them without limit"""
+        return session.scalars(
+            select(cls)
+            .where(cls.ai_key == ai_key)
+            .order_by(cls.last_activity_at.desc())
+            .limit(limit)
+            .offset(offset)
+        ).all()
+
+    @classmethod
+    def rebuild(cls, session: Session) -> int:
+        """
+        Rebuild the whole catalog from message_store, for databases that stored
+        messages before the catalog existed.
+
+        :param session:
+        :return: number of sessions
+        """
+        session.execute(delete(cls))
+        session.execute(
+            insert(cls).from_select(
+                [
+                    "session_id",
+                    "ai_key",
+                    "first_activity_at",
+                    "last_activity_at",
+                    "message_count",
+                ],
+                select(
+                    ChatMessage.session_id,
+                    ChatMessage.ai_key,
+                    func.min(ChatMessage.created_at),
+                    func.max(ChatMessage.created_at),
+                    func.count(ChatMessage.id),
+                ).group_by(ChatMessage.session_id, ChatMessage.ai_key),
+            )
+        )
+        return session.scalar(select(func.count()).select_from(cls))
@@ -0,0 +1,40 @@
+from datetime import datetime
+from typing import Dict, List
+
+from sqlalchemy import JSON, BigInteger, DateTime, Float, String, delete, select
+from sqlalchemy.orm import Mapped, Session, mapped_column
+
+from expert_gpts.database import Base
+
+
+class IngestionManifest(Base):
+    """
+    Sources ingested in each vector index: file stats and content hash to detect
+    changes, and the document/node ids written to the vector store to delete them.
+    """
+
+    __tablename__ = "ingestion_manifest"
+
+    index_name: Mapped[str] = mapped_column(String(190), primary_key=True)
+    path: Mapped[str] = mapped_column(String(512), primary_key=True)
+    mtime: Mapped[float] = mapped_column(Float())
+    size: Mapped[int] = mapped_column(BigInteger())
+    content_hash: Mapped[str] = mapped_column(String(64))
+    doc_ids: Mapped[List[str]] = mapped_column(JSON())
+    node_ids: Mapped[List[str]] = mapped_column(JSON())
+    updated_at: Mapped[datetime] = mapped_column(DateTime())
+
+    @classmethod
+    def for_index(
+        cls, session: Session, index_name: str
+    ) -> Dict[str, "IngestionManifest"]:
+        return {
+            entry.path: entry
+            for entry in session.scalars(
+                select(cls).where(cls.index_name == index_name)
+            )
+        }
+
+    @classmethod
+    def delete_index(cls, session: Session, index_name: str):
+        session.execute(delete(cls).where(cls.index_name == index_name))
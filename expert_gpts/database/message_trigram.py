@@ -0,0 +1,25 @@
+from sqlalchemy import Index, Integer, String
+from sqlalchemy.orm import Mapped, mapped_column
+
+from expert_gpts.database import Base
+
+
+class MessageTrigram(Base):
+    """
+    Inverted index of the trigrams of each message_store content. Trigrams are stored
+    as signed crc32 hashes: compact and free of collation issues (accents, case).
+    """
+
+    __tablename__ = "message_trigram"
+    __table_args__ = (
+        Index(
+            "ix_message_trigram_lookup", "ai_key", "session_id", "trigram", "message_id"
+        ),
+    )
+
+    message_id: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)
+    trigram: Mapped[int] = mapped_column(
+        Integer(), primary_key=True, autoincrement=False
+    )
+    session_id: Mapped[str] = mapped_column(String(190))
+    ai_key: Mapped[str] = mapped_column(String(190))
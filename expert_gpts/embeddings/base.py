@@ -1,15 +1,50 @@
-from typing import List
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Literal, Optional
 
 from langchain.agents import Tool
 
+# synthesize: answer from the retrieved nodes with an LLM call
+# retrieve: the retrieved nodes text as is, no LLM call
+SEARCH_MODE_TYPE = Literal["synthesize", "retrieve"]
+# vector: similarity search of the query embedding
+# hybrid: vector and BM25 searches fused, see expert_gpts.embeddings.hybrid
+RETRIEVAL_TYPE = Literal["vector", "hybrid"]
+
+
+@dataclass
+class RetrievedNode:
+    text: str
+    score: Optional[float]
+    metadata: Dict[str, Any] = field(default_factory=dict)
+    node_id: Optional[str] = None
+
+
+def format_context(nodes: List[RetrievedNode]) -> str:
+    return "\n\n".join(node.text for node in nodes)
+
 
 class EmbeddingsHandlerBase:
     def __init__(self, *args, **kwargs):
         pass
 
-    def search(self, query: str):
+    def search(self, query: str, retrieval: RETRIEVAL_TYPE = "vector"):
+        raise NotImplementedError
+
+    def retrieve(
+        self, query: str, retrieval: RETRIEVAL_TYPE = "vector"
+    ) -> List[RetrievedNode]:
         raise NotImplementedError
 
+    def get_context(
+        self,
+        query: str,
+        search_mode: SEARCH_MODE_TYPE = "synthesize",
+        retrieval: RETRIEVAL_TYPE = "vector",
+    ):
+        if search_mode == "retrieve":
+            return format_context(self.retrieve(query, retrieval))
+        return str(self.search(query, retrieval))
+
     def save(self, remember_this: List[str]):
         raise NotImplementedError
 
@@ -0,0 +1,176 @@
+"""
+BM25 inverted index kept next to each vector index, for the hybrid retrieval.
+
+The nodes text is indexed in a SQLite FTS5 table, one file per index under
+BM25_INDEX_PATH, written by the ingestion pipeline and the memory saves with the
+same nodes as the vector store and scored with the FTS5 bm25() ranking. Queries
+are an OR of their words, identifiers like `snake_case`, `E1234` or `pkg.module`
+stay whole tokens so exact matches of them rank first.
+"""
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+from functools import lru_cache
+from typing import List, Optional, Sequence
+
+from llama_index.schema import BaseNode, NodeWithScore, TextNode
+
+from expert_gpts.embeddings.cache import SQLITE_MAX_PARAMS
+
+logger = logging.getLogger(__name__)
+
+BM25_INDEX_ENABLED = os.getenv("BM25_INDEX", "true").lower() in ("1", "true", "yes")
+BM25_INDEX_PATH = os.getenv("BM25_INDEX_PATH", "var/bm25")
+# words of a query sent to FTS5, the rest are ignored
+BM25_MAX_QUERY_TERMS = int(os.getenv("BM25_MAX_QUERY_TERMS", 32))
+
+# words, with the dots, colons, slashes and dashes of the identifiers inside them
+TERM_PATTERN = re.compile(r"\w+(?:[.:/\-]\w+)*")
+IDENTIFIER_PATTERN = re.compile(r"[\d_]|\w[.:/\-]\w|[a-z][A-Z]")
+
+
+def query_terms(query: str) -> List[str]:
+    return list(dict.fromkeys(TERM_PATTERN.findall(query)))[:BM25_MAX_QUERY_TERMS]
+
+
+def is_identifier(term: str) -> bool:
+    """Codes, paths, snake_case or camelCase names, what embeddings match poorly"""
+    return bool(IDENTIFIER_PATTERN.search(term))
+
+
+def match_expression(terms: Sequence[str]) -> str:
+    # quoted, FTS5 operators and punctuation in the query are plain text
+    return " OR ".join('"%s"' % term.replace('"', '""') for term in terms)
+
+
+class BM25Index:
+    """
+    node id -> text FTS5 index of a vector index. Safe to share between threads, and
+    between processes thanks to SQLite WAL mode.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS bm25_nodes ("
+            "id INTEGER PRIMARY KEY, node_id TEXT NOT NULL UNIQUE, ref_doc_id TEXT, "
+            "text TEXT NOT NULL, metadata TEXT NOT NULL)"
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS ix_bm25_nodes_ref_doc_id "
+            "ON bm25_nodes (ref_doc_id)"
+        )
+        # external content table, the text is stored once in bm25_nodes
+        self._connection.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS bm25_fts USING fts5("
+            "text, content='bm25_nodes', content_rowid='id', "
+            "tokenize=\"unicode61 remove_diacritics 2 tokenchars '_'\")"
+        )
+        self._connection.commit()
+
+    def __repr__(self):
+        return f"<BM25Index path={self.path} size={self.size}>"
+
+    @property
+    def size(self) -> int:
+        with self._lock:
+            return self._connection.execute(
+                "SELECT COUNT(*) FROM bm25_nodes"
+            ).fetchone()[0]
+
+    def add(self, nodes: Sequence[BaseNode]) -> None:
+        """Index the nodes, replacing the ones with the same id"""
+        if not nodes:
+            return
+        with self._lock:
+            self._delete_where("node_id", [node.node_id for node in nodes])
+            for node in nodes:
+                cursor = self._connection.execute(
+                    "INSERT INTO bm25_nodes (node_id, ref_doc_id, text, metadata) "
+                    "VALUES (?, ?, ?, ?)",
+                    (
+                        node.node_id,
+                        node.ref_doc_id,
+                        node.get_content(),
+                        json.dumps(node.metadata, default=str),
+                    ),
+                )
+                self._connection.execute(
+                    "INSERT INTO bm25_fts (rowid, text) VALUES (?, ?)",
+                    (cursor.lastrowid, node.get_content()),
+                )
+            self._connection.commit()
+
+    def delete(self, ref_doc_ids: Sequence[str]) -> None:
+        """Remove the nodes of the documents"""
+        with self._lock:
+            self._delete_where("ref_doc_id", list(ref_doc_ids))
+            self._connection.commit()
+
+    def _delete_where(self, column: str, values: List[str]) -> None:
+        for start in range(0, len(values), SQLITE_MAX_PARAMS):
+            end = start + SQLITE_MAX_PARAMS
+            chunk = values[start:end]
+            where = f"{column} IN ({','.join('?' * len(chunk))})"
+            rows = self._connection.execute(
+                f"SELECT id, text FROM bm25_nodes WHERE {where}", chunk
+            ).fetchall()
+            if not rows:
+                continue
+            # external content rows leave the FTS5 index with their indexed text
+            self._connection.executemany(
+                "INSERT INTO bm25_fts (bm25_fts, rowid, text) VALUES ('delete', ?, ?)",
+                rows,
+            )
+            self._connection.execute(f"DELETE FROM bm25_nodes WHERE {where}", chunk)
+
+    def search(self, query: str, top_k: int) -> List[NodeWithScore]:
+        """
+        Best nodes of the query, scored with BM25 (higher is better).
+
+        :param query:
+        :param top_k:
+        :return:
+        """
+        terms = query_terms(query)
+        if not terms:
+            return []
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT n.node_id, n.text, n.metadata, -bm25(bm25_fts) AS score "
+                "FROM bm25_fts JOIN bm25_nodes n ON n.id = bm25_fts.rowid "
+                "WHERE bm25_fts MATCH ? ORDER BY bm25(bm25_fts) LIMIT ?",
+                (match_expression(terms), top_k),
+            ).fetchall()
+        return [
+            NodeWithScore(
+                node=TextNode(id_=node_id, text=text, metadata=json.loads(metadata)),
+                score=score,
+            )
+            for node_id, text, metadata, score in rows
+        ]
+
+    def drop(self) -> None:
+        with self._lock:
+            self._connection.execute(
+                "INSERT INTO bm25_fts (bm25_fts) VALUES ('delete-all')"
+            )
+            self._connection.execute("DELETE FROM bm25_nodes")
+            self._connection.commit()
+
+
+@lru_cache
+def get_bm25_index(index_name: str) -> Optional[BM25Index]:
+    """BM25 index of a vector index, None when disabled with BM25_INDEX=false"""
+    if not BM25_INDEX_ENABLED:
+        return None
+    return BM25Index(os.path.join(BM25_INDEX_PATH, f"{index_name}.sqlite"))
@@ -0,0 +1,248 @@
+"""
+Persistent embedding cache in front of the embed model.
+
+Embeddings are stored in a local SQLite file keyed by (model, kind, sha256 of the
+text), kind being "text" for ingested chunks and "query" for searches, so unchanged
+corpora are not embedded again on each load_docs run. The cache is bounded to
+EMBEDDINGS_CACHE_MAX_ENTRIES, least recently used entries are evicted first.
+"""
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+from array import array
+from functools import lru_cache
+from time import time
+from typing import Callable, Dict, List, Optional, Sequence
+
+from llama_index.embeddings.base import BaseEmbedding
+from pydantic import PrivateAttr
+
+logger = logging.getLogger(__name__)
+
+EMBEDDINGS_CACHE_ENABLED = os.getenv("EMBEDDINGS_CACHE", "true").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+EMBEDDINGS_CACHE_PATH = os.getenv(
+    "EMBEDDINGS_CACHE_PATH", "var/embeddings_cache.sqlite"
+)
+EMBEDDINGS_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDINGS_CACHE_MAX_ENTRIES", 200000))
+
+# sqlite default limit of host parameters per statement is 999
+SQLITE_MAX_PARAMS = 900
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    (model, hash) -> embedding store, embeddings kept as float32. Safe to share
+    between threads, and between processes thanks to SQLite WAL mode.
+    """
+
+    def __init__(self, path: str, max_entries: int = 200000):
+        self.path = path
+        self.max_entries = max_entries
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS embedding_cache ("
+            "model TEXT NOT NULL, text_hash TEXT NOT NULL, embedding BLOB NOT NULL, "
+            "last_used_at REAL NOT NULL, PRIMARY KEY (model, text_hash))"
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS ix_embedding_cache_last_used_at "
+            "ON embedding_cache (last_used_at)"
+        )
+        self._connection.commit()
+        self._size = self._connection.execute(
+            "SELECT COUNT(*) FROM embedding_cache"
+        ).fetchone()[0]
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __repr__(self):
+        return f"<EmbeddingCache path={self.path} size={self._size}>"
+
+    def get_many(self, model: str, hashes: Sequence[str]) -> Dict[str, List[float]]:
+        found = {}
+        with self._lock:
+            distinct = list(dict.fromkeys(hashes))
+            for start in range(0, len(distinct), SQLITE_MAX_PARAMS):
+                end = start + SQLITE_MAX_PARAMS
+                chunk = distinct[start:end]
+                rows = self._connection.execute(
+                    "SELECT text_hash, embedding FROM embedding_cache "
+                    f"WHERE model = ? AND text_hash IN ({','.join('?' * len(chunk))})",
+                    [model, *chunk],
+                ).fetchall()
+                for hash_, blob in rows:
+                    embedding = array("f")
+                    embedding.frombytes(blob)
+                    found[hash_] = embedding.tolist()
+            if found:
+                now = time()
+                self._connection.executemany(
+                    "UPDATE embedding_cache SET last_used_at = ? "
+                    "WHERE model = ? AND text_hash = ?",
+                    [(now, model, hash_) for hash_ in found],
+                )
+                self._connection.commit()
+            self.hits += sum(1 for hash_ in hashes if hash_ in found)
+            self.misses += sum(1 for hash_ in hashes if hash_ not in found)
+        return found
+
+    def put_many(self, model: str, embeddings: Dict[str, List[float]]) -> None:
+        if not embeddings:
+            return
+        now = time()
+        with self._lock:
+            cursor = self._connection.executemany(
+                "INSERT OR IGNORE INTO embedding_cache "
+                "(model, text_hash, embedding, last_used_at) VALUES (?, ?, ?, ?)",
+                [
+                    (model, hash_, array("f", embedding).tobytes(), now)
+                    for hash_, embedding in embeddings.items()
+                ],
+            )
+            self._size += max(cursor.rowcount, 0)
+            if self.max_entries and self._size > self.max_entries:
+                self._evict(self._size - self.max_entries)
+            self._connection.commit()
+
+    def _evict(self, count: int) -> None:
+        cursor = self._connection.execute(
+            "DELETE FROM embedding_cache WHERE rowid IN ("
+            "SELECT rowid FROM embedding_cache ORDER BY last_used_at LIMIT ?)",
+            (count,),
+        )
+        self._size -= cursor.rowcount
+        self.evictions += cursor.rowcount
+
+    def clear(self) -> None:
+        with self._lock:
+            self._connection.execute("DELETE FROM embedding_cache")
+            self._connection.commit()
+            self._size = 0
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": self._size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+            }
+
+
+class CachedEmbedding(BaseEmbedding):
+    """Embed model wrapper looking up the EmbeddingCache before calling the model"""
+
+    _embed_model: BaseEmbedding = PrivateAttr()
+    _cache: EmbeddingCache = PrivateAttr()
+
+    def __init__(self, embed_model: BaseEmbedding, cache: EmbeddingCache, **kwargs):
+        super().__init__(
+            model_name=embed_model.model_name,
+            embed_batch_size=embed_model.embed_batch_size,
+            callback_manager=embed_model.callback_manager,
+            **kwargs,
+        )
+        self._embed_model = embed_model
+        self._cache = cache
+
+    @property
+    def embed_model(self) -> BaseEmbedding:
+        return self._embed_model
+
+    @property
+    def cache(self) -> EmbeddingCache:
+        return self._cache
+
+    def _cache_model(self, kind: str) -> str:
+        # keyed by the provider, not by the BatchingEmbedding in front of it
+        provider = getattr(self._embed_model, "embed_model", self._embed_model)
+        return f"{provider.__class__.__name__}:{self.model_name}:{kind}"
+
+    def _lookup(self, kind: str, texts: List[str]):
+        hashes = [text_hash(text) for text in texts]
+        found = self._cache.get_many(self._cache_model(kind), hashes)
+        missing = list(
+            dict.fromkeys(
+                text for text, hash_ in zip(texts, hashes) if hash_ not in found
+            )
+        )
+        return hashes, found, missing
+
+    def _store(self, kind, hashes, found, missing, embeddings) -> List[List[float]]:
+        computed = {text_hash(text): e for text, e in zip(missing, embeddings)}
+        self._cache.put_many(self._cache_model(kind), computed)
+        found.update(computed)
+        return [found[hash_] for hash_ in hashes]
+
+    def _embed(
+        self,
+        kind: str,
+        texts: List[str],
+        embed: Callable[[List[str]], List[List[float]]],
+    ) -> List[List[float]]:
+        hashes, found, missing = self._lookup(kind, texts)
+        embeddings = embed(missing) if missing else []
+        return self._store(kind, hashes, found, missing, embeddings)
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._embed(
+            "query",
+            [query],
+            lambda texts: [self._embed_model._get_query_embedding(texts[0])],
+        )[0]
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        hashes, found, missing = self._lookup("query", [query])
+        embeddings = []
+        if missing:
+            embeddings = [await self._embed_model._aget_query_embedding(query)]
+        return self._store("query", hashes, found, missing, embeddings)[0]
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._get_text_embeddings([text])[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return self._embed("text", texts, self._embed_model._get_text_embeddings)
+
+    async def _aget_text_embedding(self, text: str) -> List[float]:
+        return (await self._aget_text_embeddings([text]))[0]
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        hashes, found, missing = self._lookup("text", texts)
+        embeddings = []
+        if missing:
+            embeddings = await self._embed_model._aget_text_embeddings(missing)
+        return self._store("text", hashes, found, missing, embeddings)
+
+
+@lru_cache
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    if not EMBEDDINGS_CACHE_ENABLED:
+        return None
+    return EmbeddingCache(EMBEDDINGS_CACHE_PATH, EMBEDDINGS_CACHE_MAX_ENTRIES)
+
+
+def with_embedding_cache(embed_model: BaseEmbedding) -> BaseEmbedding:
+    """The embed model behind the persistent cache, unless EMBEDDINGS_CACHE=false"""
+    cache = get_embedding_cache()
+    if cache is None:
+        return embed_model
+    return CachedEmbedding(embed_model, cache)
@@ -0,0 +1,43 @@
+"""
+Chunking of the indexes: `chunking` of the experts, chain and planner in the config,
+`chunk_size`/`chunk_overlap` of an embeddings item for its sources, these env values
+otherwise. Nodes already ingested keep their chunking, changing it needs a
+`load_docs --rebuild` of the index. bin/bench_chunking.py compares settings.
+"""
+import os
+from functools import lru_cache
+from typing import Optional
+
+from llama_index.langchain_helpers.text_splitter import TokenTextSplitter
+from llama_index.node_parser import SimpleNodeParser
+
+from shared.config import ChunkingOptions
+
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", 1024))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", 20))
+CONTEXT_WINDOW = int(os.getenv("CONTEXT_WINDOW", 4096))
+SIMILARITY_TOP_K = int(os.getenv("SIMILARITY_TOP_K", 2))
+
+
+def resolve_chunking(options: Optional[ChunkingOptions] = None) -> ChunkingOptions:
+    """The options with the env defaults in place of the unset values"""
+    options = options or ChunkingOptions()
+    return ChunkingOptions(
+        chunk_size=options.chunk_size or CHUNK_SIZE,
+        chunk_overlap=(
+            options.chunk_overlap
+            if options.chunk_overlap is not None
+            else CHUNK_OVERLAP
+        ),
+        context_window=options.context_window or CONTEXT_WINDOW,
+        similarity_top_k=options.similarity_top_k or SIMILARITY_TOP_K,
+    )
+
+
+@lru_cache
+def get_node_parser(chunk_size: int, chunk_overlap: int) -> SimpleNodeParser:
+    return SimpleNodeParser(
+        text_splitter=TokenTextSplitter(
+            chunk_size=chunk_size, chunk_overlap=chunk_overlap
+        )
+    )
@@ -1,10 +1,60 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from time import perf_counter
+from typing import Dict, Optional, Tuple
+
+from langchain.agents import Tool
+
+from expert_gpts.embeddings.base import RETRIEVAL_TYPE
+from expert_gpts.embeddings.fanout import (
+    FANOUT_SEARCH_DEADLINE,
+    FANOUT_SEARCH_PER_INDEX,
+    FANOUT_SEARCH_TOP_K,
+    FANOUT_SEARCH_WORKERS,
+    FanOutResult,
+    format_hits,
+    merge_hits,
+)
 from expert_gpts.embeddings.llamaindex import LlamaIndexEmbeddingsHandler
-from shared.config import EMBEDDINGS_TYPE
+from expert_gpts.embeddings.providers import EMBEDDINGS_PROVIDER
+from expert_gpts.embeddings.vector_stores import VECTOR_STORE
+from shared.config import (
+    EMBEDDINGS_TYPE,
+    VECTOR_STORE_TYPE,
+    ChunkingOptions,
+    VectorStoreOptions,
+)
 from shared.llm_manager_base import BaseLLMManager
+from shared.llms import system_prompts
 from shared.patterns import Singleton
 
+logger = logging.getLogger(__name__)
+
+# handlers kept built, the least recently used one is dropped above it
+EMBEDDINGS_HANDLERS_MAX = int(os.getenv("EMBEDDINGS_HANDLERS_MAX", 32))
+
 
 class EmbeddingsHandlerFactory(metaclass=Singleton):
+    """
+    Registry of the embeddings handlers, one per index and settings, built on the
+    first request and shared by every expert, chain and tool using the index. Handlers
+    are built out of the registry lock, the requests of a handler being built wait for
+    it and the ones of other handlers do not.
+    """
+
+    def __init__(self, max_handlers: int = EMBEDDINGS_HANDLERS_MAX):
+        self.max_handlers = max_handlers
+        self._handlers: "OrderedDict[Tuple, LlamaIndexEmbeddingsHandler]" = (
+            OrderedDict()
+        )
+        # handlers being built, by key
+        self._building: Dict[Tuple, Future] = {}
+        self._lock = threading.RLock()
+        self._metrics = dict(hits=0, misses=0, evictions=0, build_time=0.0)
+
     def get_chain_embeddings(
         self,
         llm_manager: BaseLLMManager,
@@ -12,13 +62,21 @@ class EmbeddingsHandlerFactory(metaclass=Singleton):
         load_docs: bool = False,
         index_name: str = "main_chain_memory",
         index_prefix: str = "main_chain_memory_",
+        vector_store: Optional[VECTOR_STORE_TYPE] = None,
+        vector_store_options: Optional[VectorStoreOptions] = None,
+        embeddings_provider: Optional[str] = None,
+        chunking: Optional[ChunkingOptions] = None,
     ) -> LlamaIndexEmbeddingsHandler:
-        return LlamaIndexEmbeddingsHandler(
+        return self.get_embeddings(
             llm_manager,
             embeddings=embeddings,
             index_name=index_name,
             index_prefix=index_prefix,
             load_docs=load_docs,
+            vector_store=vector_store,
+            vector_store_options=vector_store_options,
+            embeddings_provider=embeddings_provider,
+            chunking=chunking,
         )
 
     def get_expert_embeddings(
@@ -27,11 +85,224 @@ class EmbeddingsHandlerFactory(metaclass=Singleton):
         expert_key: str,
         embeddings: EMBEDDINGS_TYPE = None,
         load_docs: bool = False,
+        vector_store: Optional[VECTOR_STORE_TYPE] = None,
+        vector_store_options: Optional[VectorStoreOptions] = None,
+        embeddings_provider: Optional[str] = None,
+        chunking: Optional[ChunkingOptions] = None,
     ) -> LlamaIndexEmbeddingsHandler:
-        return LlamaIndexEmbeddingsHandler(
+        return self.get_embeddings(
             llm_manager,
             embeddings=embeddings,
             index_name=f"{expert_key}_memory",
             index_prefix=f"{expert_key}_memory_",
             load_docs=load_docs,
+            vector_store=vector_store,
+            vector_store_options=vector_store_options,
+            embeddings_provider=embeddings_provider,
+            chunking=chunking,
+        )
+
+    def get_embeddings(
+        self,
+        llm_manager: BaseLLMManager,
+        index_name: str,
+        index_prefix: str,
+        embeddings: EMBEDDINGS_TYPE = None,
+        load_docs: bool = False,
+        vector_store: Optional[VECTOR_STORE_TYPE] = None,
+        vector_store_options: Optional[VectorStoreOptions] = None,
+        embeddings_provider: Optional[str] = None,
+        chunking: Optional[ChunkingOptions] = None,
+    ) -> LlamaIndexEmbeddingsHandler:
+        """
+        Handler of the index, built once per index and settings.
+
+        :param llm_manager:
+        :param index_name:
+        :param index_prefix:
+        :param embeddings: sources of the index, replace the ones of the handler if set
+        :param load_docs: ingest the sources, see LlamaIndexEmbeddingsHandler.ingest
+        :param vector_store:
+        :param vector_store_options:
+        :param embeddings_provider: see expert_gpts.embeddings.providers
+        :param chunking: see expert_gpts.embeddings.chunking
+        :return:
+        """
+        vector_store = vector_store or VECTOR_STORE
+        embeddings_provider = embeddings_provider or EMBEDDINGS_PROVIDER
+        key = (
+            index_name,
+            index_prefix,
+            vector_store,
+            vector_store_options.json(sort_keys=True) if vector_store_options else None,
+            embeddings_provider,
+            chunking.json(sort_keys=True) if chunking else None,
         )
+        with self._lock:
+            handler = self._handlers.get(key)
+            building = self._building.get(key)
+            if handler is not None or building is not None:
+                self._metrics["hits"] += 1
+            else:
+                self._metrics["misses"] += 1
+                self._building[key] = Future()
+        if handler is not None:
+            with self._lock:
+                if key in self._handlers:
+                    self._handlers.move_to_end(key)
+        elif building is not None:
+            handler = building.result()
+        else:
+            handler = self._build(
+                key,
+                llm_manager,
+                embeddings=embeddings,
+                index_name=index_name,
+                index_prefix=index_prefix,
+                vector_store=vector_store,
+                vector_store_options=vector_store_options,
+                embeddings_provider=embeddings_provider,
+                chunking=chunking,
+            )
+        if embeddings is not None:
+            handler.embeddings = embeddings
+        if load_docs:
+            handler.ingest(handler.embeddings)
+        return handler
+
+    def _build(self, key: Tuple, llm_manager: BaseLLMManager, **kwargs):
+        """Build the handler of key and register it, the waiting requests get it too"""
+        future = self._building[key]
+        started_at = perf_counter()
+        try:
+            handler = LlamaIndexEmbeddingsHandler(llm_manager, **kwargs)
+        except BaseException as e:
+            with self._lock:
+                del self._building[key]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            self._metrics["build_time"] += perf_counter() - started_at
+            self._handlers[key] = handler
+            del self._building[key]
+            self._evict()
+        future.set_result(handler)
+        return handler
+
+    def _evict(self):
+        while len(self._handlers) > self.max_handlers:
+            key, handler = self._handlers.popitem(last=False)
+            handler.close()
+            self._metrics["evictions"] += 1
+            logger.debug(f"evicted embeddings handler {key}")
+
+    def evict(self, index_name: str):
+        """Drop the handlers of an index, the next request builds them again"""
+        with self._lock:
+            for key in [key for key in self._handlers if key[0] == index_name]:
+                self._handlers.pop(key).close()
+                self._metrics["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            for handler in self._handlers.values():
+                handler.close()
+            self._handlers.clear()
+
+    def search_many(
+        self,
+        handlers: Dict[str, LlamaIndexEmbeddingsHandler],
+        query: str,
+        top_k: int = FANOUT_SEARCH_TOP_K,
+        per_index: int = FANOUT_SEARCH_PER_INDEX,
+        deadline: float = FANOUT_SEARCH_DEADLINE,
+        retrievals: Optional[Dict[str, RETRIEVAL_TYPE]] = None,
+    ) -> FanOutResult:
+        """
+        Retrieve the query from several indexes concurrently, see expert_gpts.embeddings.fanout.
+
+        :param handlers: handler by the key shown with its nodes, e.g. the expert key
+        :param query:
+        :param top_k: nodes of the result
+        :param per_index: nodes of the result from the same index at most
+        :param deadline: seconds, the indexes answering later are left out
+        :param retrievals: retrieval by handler key, vector when missing
+        :return:
+        """
+        retrievals = retrievals or {}
+        started_at = perf_counter()
+        # one embedding per embed model, every index shares the default one
+        models = {
+            id(handler.index.service_context.embed_model): (
+                handler.index.service_context.embed_model
+            )
+            for handler in handlers.values()
+        }
+        executor = ThreadPoolExecutor(
+            max_workers=max(min(len(handlers) + len(models), FANOUT_SEARCH_WORKERS), 1),
+            thread_name_prefix="fanout-search",
+        )
+        # queued first, the searches waiting for them can not take their workers
+        embeddings = {
+            key: executor.submit(model.get_query_embedding, query)
+            for key, model in models.items()
+        }
+        expired = threading.Event()
+
+        def search(handler: LlamaIndexEmbeddingsHandler, retrieval: RETRIEVAL_TYPE):
+            embed_model = handler.index.service_context.embed_model
+            query_embedding = embeddings[id(embed_model)].result()
+            if expired.is_set():
+                raise TimeoutError("query embedded after the deadline")
+            return handler.retrieve(
+                query, retrieval=retrieval, query_embedding=query_embedding
+            )
+
+        futures = {
+            key: executor.submit(search, handler, retrievals.get(key, "vector"))
+            for key, handler in handlers.items()
+        }
+        done, _ = wait(
+            futures.values(), timeout=max(deadline - (perf_counter() - started_at), 0)
+        )
+        # searches over the deadline finish in their threads, the queued ones are dropped
+        # and the ones still waiting for their embedding skip the retrieval
+        expired.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+        results, failed, timed_out = {}, [], []
+        for key, future in futures.items():
+            if future not in done:
+                timed_out.append(key)
+                continue
+            try:
+                results[key] = future.result()
+            except Exception as e:
+                logger.error(f"search of {key} failed: {e}")
+                failed.append(key)
+        if timed_out:
+            logger.warning(f"search of {timed_out} over the {deadline}s deadline")
+        return FanOutResult(
+            hits=merge_hits(results, top_k, per_index),
+            timed_out=timed_out,
+            failed=failed,
+            elapsed=perf_counter() - started_at,
+        )
+
+    def get_search_all_tool(
+        self,
+        handlers: Dict[str, LlamaIndexEmbeddingsHandler],
+        tool_key: str = "default",
+        retrievals: Optional[Dict[str, RETRIEVAL_TYPE]] = None,
+    ) -> Tool:
+        """One tool searching the indexes of every expert, instead of a tool call each"""
+        return Tool(
+            name=f"{tool_key}_search_all_experts",
+            func=lambda q: format_hits(
+                self.search_many(handlers, q, retrievals=retrievals).hits
+            ),
+            description=system_prompts.SEARCH_ALL_EXPERTS_TOOL_PROMPT,
+        )
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {**self._metrics, "handlers": len(self._handlers)}
@@ -0,0 +1,67 @@
+"""
+Search of several indexes at once (search all experts tool): the query is embedded
+once per embed model, the embed models concurrently, each index is queried with its
+retrieval as soon as the embedding of its model is ready, and their nodes are merged
+by reciprocal rank fusion keeping at most FANOUT_SEARCH_PER_INDEX nodes of each
+index. Indexes not answering within FANOUT_SEARCH_DEADLINE seconds of the call, the
+embedding included, are left out of the result.
+
+Each search runs in threads of its own, at most FANOUT_SEARCH_WORKERS: a search still
+running after the deadline keeps its thread until it returns, it must not hold the
+workers of the next searches.
+"""
+import os
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+from expert_gpts.embeddings.base import RetrievedNode
+from expert_gpts.embeddings.hybrid import HYBRID_RRF_K
+
+FANOUT_SEARCH_WORKERS = int(os.getenv("FANOUT_SEARCH_WORKERS", 8))
+FANOUT_SEARCH_TOP_K = int(os.getenv("FANOUT_SEARCH_TOP_K", 6))
+FANOUT_SEARCH_PER_INDEX = int(os.getenv("FANOUT_SEARCH_PER_INDEX", 2))
+# seconds, embedding included
+FANOUT_SEARCH_DEADLINE = float(os.getenv("FANOUT_SEARCH_DEADLINE", 10))
+
+
+@dataclass
+class IndexHit:
+    key: str
+    node: RetrievedNode
+    # reciprocal rank of the node in its index
+    score: float = 0.0
+
+
+@dataclass
+class FanOutResult:
+    hits: List[IndexHit]
+    timed_out: List[str] = field(default_factory=list)
+    failed: List[str] = field(default_factory=list)
+    elapsed: float = 0.0
+
+
+def merge_hits(
+    results: Dict[str, List[RetrievedNode]],
+    top_k: int,
+    per_index: int,
+    rrf_k: int = HYBRID_RRF_K,
+) -> List[IndexHit]:
+    """
+    Best nodes of all the indexes by reciprocal rank, per_index at most from each one.
+    Scores of indexes with other embed models or retrievals are not comparable, ranks
+    are; equal ranks keep the order of results.
+    """
+    hits = [
+        IndexHit(key=key, node=node, score=1 / (rrf_k + rank))
+        for key, nodes in results.items()
+        for rank, node in enumerate(
+            sorted(nodes, key=lambda node: node.score or 0.0, reverse=True)[:per_index],
+            start=1,
+        )
+    ]
+    hits.sort(key=lambda hit: hit.score, reverse=True)
+    return hits[:top_k]
+
+
+def format_hits(hits: List[IndexHit]) -> str:
+    return "\n\n".join(f"[{hit.key}] {hit.node.text}" for hit in hits)
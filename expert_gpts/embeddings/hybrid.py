@@ -0,0 +1,100 @@
+"""
+Hybrid retrieval: the vector search and the BM25 index of an index fused with
+reciprocal-rank fusion, each node scoring sum(1 / (HYBRID_RRF_K + rank)) over the
+rankings it is in.
+
+When the query has identifiers (codes, paths, snake_case names...), BM25 finds more
+nodes than the top-k, the best score is at least HYBRID_BM25_DECISIVE times the
+first one out of the top-k and the best node contains one of the identifiers, the
+lexical results are returned as is and the query is not embedded.
+"""
+import os
+from typing import Dict, List, Sequence
+
+from llama_index.indices.base_retriever import BaseRetriever
+from llama_index.indices.query.schema import QueryBundle
+from llama_index.schema import NodeWithScore
+
+from expert_gpts.embeddings.bm25 import BM25Index, is_identifier, query_terms
+
+HYBRID_RRF_K = int(os.getenv("HYBRID_RRF_K", 60))
+# candidates of each retrieval per result
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", 5))
+HYBRID_BM25_DECISIVE = float(os.getenv("HYBRID_BM25_DECISIVE", 2.0))
+
+
+def reciprocal_rank_fusion(
+    rankings: Sequence[List[NodeWithScore]], rrf_k: int = HYBRID_RRF_K
+) -> List[NodeWithScore]:
+    """Nodes of the rankings by fused score, the first ranking's node objects win"""
+    fused: Dict[str, NodeWithScore] = {}
+    for ranking in rankings:
+        for rank, node in enumerate(ranking, start=1):
+            node_id = node.node.node_id
+            if node_id not in fused:
+                fused[node_id] = NodeWithScore(node=node.node, score=0.0)
+            fused[node_id].score += 1 / (rrf_k + rank)
+    return sorted(fused.values(), key=lambda node: node.score, reverse=True)
+
+
+class HybridRetriever(BaseRetriever):
+    def __init__(
+        self,
+        vector_retriever: BaseRetriever,
+        bm25_index: BM25Index,
+        similarity_top_k: int,
+        candidates: int = HYBRID_CANDIDATES,
+        rrf_k: int = HYBRID_RRF_K,
+        decisive: float = HYBRID_BM25_DECISIVE,
+    ):
+        """
+        :param vector_retriever: returning similarity_top_k * candidates nodes
+        :param bm25_index:
+        :param similarity_top_k:
+        :param candidates: nodes of each retrieval per result
+        :param rrf_k:
+        :param decisive: BM25 score ratio of the fast path, 0 disables it
+        """
+        self.vector_retriever = vector_retriever
+        self.bm25_index = bm25_index
+        self.similarity_top_k = similarity_top_k
+        self.candidates = candidates
+        self.rrf_k = rrf_k
+        self.decisive = decisive
+
+    def lexical(self, query: str) -> List[NodeWithScore]:
+        """BM25 candidates of the query"""
+        return self.bm25_index.search(
+            query,
+            max(self.similarity_top_k * self.candidates, self.similarity_top_k + 1),
+        )
+
+    def is_decisive(self, query: str, lexical: List[NodeWithScore]) -> bool:
+        """
+        Whether the BM25 top-k is clear enough to skip the vector search: more hits
+        than the top-k, the best one decisive times the first one out of it and
+        containing an identifier of the query. Few hits are not a clear ranking.
+        """
+        if not self.decisive or len(lexical) <= self.similarity_top_k:
+            return False
+        identifiers = [term for term in query_terms(query) if is_identifier(term)]
+        if not identifiers:
+            return False
+        if lexical[0].score < self.decisive * lexical[self.similarity_top_k].score:
+            return False
+        text = lexical[0].node.get_content().lower()
+        return any(identifier.lower() in text for identifier in identifiers)
+
+    def fuse(
+        self, query_bundle: QueryBundle, lexical: List[NodeWithScore]
+    ) -> List[NodeWithScore]:
+        vector = self.vector_retriever.retrieve(query_bundle)
+        return reciprocal_rank_fusion([vector, lexical], self.rrf_k)[
+            : self.similarity_top_k
+        ]
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        lexical = self.lexical(query_bundle.query_str)
+        if self.is_decisive(query_bundle.query_str, lexical):
+            return lexical[: self.similarity_top_k]
+        return self.fuse(query_bundle, lexical)
@@ -0,0 +1,288 @@
+"""
+Incremental ingestion of the embeddings sources (EmbeddingItem folder_path files and
+inline content) into a vector index.
+
+The IngestionManifest of the index records what was ingested from each source, so a
+run only embeds the new and modified sources, deletes the nodes of the modified and
+removed ones, and skips the rest. Files whose mtime and size did not change are not
+even hashed.
+
+Sources are scanned and read lazily: the folders are walked with include/exclude
+globs and a max file size, and plain text files larger than INGESTION_SEGMENT_SIZE
+are read in segments of that size, one document each, so the memory held by a
+source does not depend on its size.
+"""
+import fnmatch
+import hashlib
+import logging
+import os
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional
+
+from llama_index import Document, SimpleDirectoryReader
+from llama_index.readers.file.base import DEFAULT_FILE_READER_CLS
+from llama_index.vector_stores import RedisVectorStore
+from llama_index.vector_stores.types import VectorStore
+
+from expert_gpts.database import get_db_session
+from expert_gpts.database.ingestion_manifest import IngestionManifest
+from expert_gpts.embeddings.bm25 import BM25Index
+from shared.config import EMBEDDINGS_TYPE, EmbeddingItem
+
+logger = logging.getLogger(__name__)
+
+CONTENT_SOURCE_PREFIX = "content://"
+HASH_BLOCK_SIZE = 1024 * 1024
+# bytes, 0 for no limit, EmbeddingItem.max_file_size overrides it
+INGESTION_MAX_FILE_SIZE = int(os.getenv("INGESTION_MAX_FILE_SIZE", 0))
+# characters of a plain text file per document
+INGESTION_SEGMENT_SIZE = int(os.getenv("INGESTION_SEGMENT_SIZE", 1024 * 1024))
+
+
+@dataclass
+class Source:
+    path: str
+    mtime: float
+    size: int
+    content: Optional[str] = None
+    content_hash: Optional[str] = None
+    # chunking of the embeddings item, the index one when not set
+    chunk_size: Optional[int] = None
+    chunk_overlap: Optional[int] = None
+
+    @property
+    def is_file(self) -> bool:
+        return self.content is None
+
+    @property
+    def is_segmented(self) -> bool:
+        """Plain text file read in segments, see iter_documents"""
+        return (
+            self.is_file
+            and self.size > INGESTION_SEGMENT_SIZE
+            and os.path.splitext(self.path)[1].lower() not in DEFAULT_FILE_READER_CLS
+        )
+
+    def get_content_hash(self) -> str:
+        if self.content_hash is None:
+            digest = hashlib.sha256()
+            if self.is_file:
+                with open(self.path, "rb") as file:
+                    for block in iter(lambda: file.read(HASH_BLOCK_SIZE), b""):
+                        digest.update(block)
+            else:
+                digest.update(self.content.encode("utf-8"))
+            self.content_hash = digest.hexdigest()
+        return self.content_hash
+
+
+@dataclass
+class IngestionPlan:
+    index_name: str
+    added: List[Source] = field(default_factory=list)
+    modified: List[Source] = field(default_factory=list)
+    removed: List[IngestionManifest] = field(default_factory=list)
+    unchanged: List[Source] = field(default_factory=list)
+    # throughput of each ingestion pipeline stage once applied
+    stages: Dict[str, Dict[str, float]] = field(default_factory=dict)
+
+    @property
+    def has_changes(self) -> bool:
+        return bool(self.added or self.modified or self.removed)
+
+    def summary(self) -> Dict[str, int]:
+        return {
+            "added": len(self.added),
+            "modified": len(self.modified),
+            "removed": len(self.removed),
+            "unchanged": len(self.unchanged),
+        }
+
+    def describe(self) -> List[str]:
+        return (
+            [f"add {source.path}" for source in self.added]
+            + [f"re-embed {source.path}" for source in self.modified]
+            + [f"delete {entry.path}" for entry in self.removed]
+        )
+
+
+def matches(path: str, patterns: Optional[List[str]]) -> bool:
+    return any(fnmatch.fnmatch(path, pattern) for pattern in patterns or [])
+
+
+def iter_files(item: EmbeddingItem) -> Iterator[Source]:
+    """Files under the folder path, recursively and without hidden files like
+    SimpleDirectoryReader, filtered by the include/exclude globs and max file size"""
+    max_file_size = item.max_file_size or INGESTION_MAX_FILE_SIZE
+    for root, dirs, files in os.walk(item.folder_path):
+        relative_root = os.path.relpath(root, item.folder_path)
+        dirs[:] = sorted(
+            d
+            for d in dirs
+            if not d.startswith(".")
+            and not matches(
+                os.path.normpath(os.path.join(relative_root, d)), item.exclude
+            )
+        )
+        for name in sorted(files):
+            relative_path = os.path.normpath(os.path.join(relative_root, name))
+            if name.startswith(".") or matches(relative_path, item.exclude):
+                continue
+            if item.include and not matches(relative_path, item.include):
+                continue
+            path = os.path.normpath(os.path.join(root, name))
+            stat = os.stat(path)
+            if max_file_size and stat.st_size > max_file_size:
+                logger.warning(f"skipping {path}, {stat.st_size} bytes")
+                continue
+            yield Source(
+                path,
+                stat.st_mtime,
+                stat.st_size,
+                chunk_size=item.chunk_size,
+                chunk_overlap=item.chunk_overlap,
+            )
+
+
+def iter_sources(embeddings: EMBEDDINGS_TYPE) -> Iterator[Source]:
+    """Files of the folder paths and inline contents"""
+    for key, item in (embeddings or {}).items():
+        if item is None:
+            continue
+        if item.folder_path:
+            yield from iter_files(item)
+        if item.content:
+            path = f"{CONTENT_SOURCE_PREFIX}{key}"
+            yield Source(
+                path,
+                0,
+                len(item.content),
+                content=item.content,
+                chunk_size=item.chunk_size,
+                chunk_overlap=item.chunk_overlap,
+            )
+
+
+def plan_ingestion(
+    index_name: str, embeddings: EMBEDDINGS_TYPE, rebuild: bool = False
+) -> IngestionPlan:
+    plan = IngestionPlan(index_name)
+    with get_db_session() as session:
+        manifest = {} if rebuild else IngestionManifest.for_index(session, index_name)
+        session.expunge_all()
+    sources = set()
+    for source in iter_sources(embeddings):
+        path = source.path
+        if path in sources:
+            continue
+        sources.add(path)
+        entry = manifest.get(path)
+        if entry is None:
+            plan.added.append(source)
+        elif entry.mtime == source.mtime and entry.size == source.size:
+            plan.unchanged.append(source)
+        elif entry.content_hash == source.get_content_hash():
+            # touched but same content
+            plan.unchanged.append(source)
+        else:
+            plan.modified.append(source)
+    plan.removed = [entry for path, entry in manifest.items() if path not in sources]
+    return plan
+
+
+def load_source(source: Source) -> List[Document]:
+    """Documents of a source, with ids derived from its path"""
+    if source.is_file:
+        return SimpleDirectoryReader(
+            input_files=[source.path], filename_as_id=True
+        ).load_data()
+    return [Document(text=source.content, id_=source.path)]
+
+
+def iter_documents(source: Source) -> Iterator[List[Document]]:
+    """Documents of a source, segment by segment for the segmented ones"""
+    if not source.is_segmented:
+        yield load_source(source)
+        return
+    # same reading and ids as SimpleDirectoryReader for a multi document file
+    with open(source.path, "r", errors="ignore", encoding="utf-8") as file:
+        part, rest = 0, ""
+        while True:
+            text = rest + file.read(INGESTION_SEGMENT_SIZE - len(rest))
+            if not text:
+                return
+            # cut at the last line break, the rest starts the next segment
+            cut = text.rfind("\n") + 1
+            if len(text) < INGESTION_SEGMENT_SIZE or cut == 0:
+                cut = len(text)
+            text, rest = text[:cut], text[cut:]
+            yield [Document(text=text, id_=f"{source.path}_part_{part}")]
+            part += 1
+
+
+def delete_documents(
+    vector_store: VectorStore,
+    doc_ids: List[str],
+    bm25_index: Optional[BM25Index] = None,
+):
+    if bm25_index is not None:
+        bm25_index.delete(doc_ids)
+    for doc_id in doc_ids:
+        if isinstance(vector_store, RedisVectorStore):
+            delete_redis_document(vector_store, doc_id)
+        else:
+            vector_store.delete(doc_id)
+
+
+def delete_redis_document(vector_store: RedisVectorStore, doc_id: str):
+    """RedisVectorStore.delete only removes the first 10 nodes found of a document"""
+    from redis.commands.search.query import Query
+
+    client = vector_store.client
+    query = "@doc_id:{%s}" % vector_store.tokenizer.escape(doc_id)
+    while True:
+        results = client.ft(vector_store._index_name).search(
+            Query(query).no_content().paging(0, 1000)
+        )
+        if not results.docs:
+            return
+        client.delete(*[doc.id for doc in results.docs])
+
+
+def record_source(
+    session, index_name: str, source: Source, doc_ids: List[str], node_ids: List[str]
+):
+    session.merge(
+        IngestionManifest(
+            index_name=index_name,
+            path=source.path,
+            mtime=source.mtime,
+            size=source.size,
+            content_hash=source.get_content_hash(),
+            doc_ids=doc_ids,
+            node_ids=node_ids,
+            updated_at=datetime.now(),
+        )
+    )
+
+
+def remove_sources(
+    vector_store: VectorStore,
+    plan: IngestionPlan,
+    bm25_index: Optional[BM25Index] = None,
+):
+    """Delete the nodes of the removed sources and refresh the unchanged mtimes"""
+    with get_db_session() as session:
+        for entry in plan.removed:
+            delete_documents(vector_store, entry.doc_ids, bm25_index)
+            session.delete(session.merge(entry))
+            session.commit()
+            logger.info(f"{plan.index_name}: deleted {entry.path}")
+
+        previous = IngestionManifest.for_index(session, plan.index_name)
+        for source in plan.unchanged:
+            entry = previous.get(source.path)
+            if entry is not None and entry.mtime != source.mtime:
+                entry.mtime = source.mtime
+        session.commit()
@@ -1,39 +1,52 @@
 import logging
-import os
-from typing import List
+import threading
+from typing import Any, Callable, List, Optional
 
 from langchain.agents import Tool
-from langchain.embeddings import OpenAIEmbeddings
-from llama_index import (
-    LLMPredictor,
-    OpenAIEmbedding,
-    PromptHelper,
-    ServiceContext,
-    SimpleDirectoryReader,
-    StringIterableReader,
-    VectorStoreIndex,
-)
+from llama_index import LLMPredictor, PromptHelper, ServiceContext, VectorStoreIndex
 from llama_index.indices.postprocessor import MetadataReplacementPostProcessor
-from llama_index.langchain_helpers.text_splitter import TokenTextSplitter
-from llama_index.node_parser import SimpleNodeParser
+from llama_index.indices.query.schema import QueryBundle
 from llama_index.response.schema import RESPONSE_TYPE
+from llama_index.schema import NodeWithScore
 from llama_index.storage.storage_context import StorageContext
-from llama_index.vector_stores import RedisVectorStore
+from redis.exceptions import ResponseError
 
-from expert_gpts.embeddings.base import EmbeddingsHandlerBase
-from shared.config import EMBEDDINGS_TYPE
+from expert_gpts.chat_history.write_behind import WriteBehindWriter
+from expert_gpts.database import get_db_session
+from expert_gpts.database.ingestion_manifest import IngestionManifest
+from expert_gpts.embeddings.base import (
+    RETRIEVAL_TYPE,
+    SEARCH_MODE_TYPE,
+    EmbeddingsHandlerBase,
+    RetrievedNode,
+)
+from expert_gpts.embeddings.bm25 import get_bm25_index
+from expert_gpts.embeddings.chunking import get_node_parser, resolve_chunking
+from expert_gpts.embeddings.hybrid import HYBRID_CANDIDATES, HybridRetriever
+from expert_gpts.embeddings.ingestion import IngestionPlan, plan_ingestion
+from expert_gpts.embeddings.memories import (
+    MEMORY_SAVE_BATCH_SIZE,
+    MEMORY_SAVE_FLUSH_INTERVAL,
+    MEMORY_SAVE_MAX_PENDING,
+    MEMORY_WRITE_BEHIND,
+    write_memories,
+)
+from expert_gpts.embeddings.pipeline import IngestionPipeline, get_parse_executor
+from expert_gpts.embeddings.providers import EMBEDDINGS_PROVIDER, get_embed_model
+from expert_gpts.embeddings.retrieval_cache import get_retrieval_cache
+from expert_gpts.embeddings.vector_stores import get_vector_store, persist_vector_store
+from shared.config import (
+    EMBEDDINGS_TYPE,
+    VECTOR_STORE_TYPE,
+    ChunkingOptions,
+    VectorStoreOptions,
+)
 from shared.llm_manager_base import BaseLLMManager
+from shared.llms import system_prompts
 from shared.llms.openai import GPT_3_5_TURBO
-from shared.llms.system_prompts import (
-    GET_MEMORIES_TOOL_PROMPT,
-    SAVE_MEMORIES_TOOL_PROMPT,
-)
 
 logger = logging.getLogger(__name__)
 
-EMBEDS_MODEL = OpenAIEmbedding()
-embeddings = OpenAIEmbeddings()
-
 
 # https://zeeshankhawar.medium.com/connecting-chatgpt-with-your-own-data-using-llama-index-and-langchain-74ba79fb7429
 # https://betterprogramming.pub/llamaindex-how-to-use-index-correctly-6f928b8944c6
@@ -45,7 +58,7 @@ embeddings = OpenAIEmbeddings()
 
 
 class LlamaIndexEmbeddingsHandler(EmbeddingsHandlerBase):
-    _instances = {}
+    """Embeddings of one index, get them from EmbeddingsHandlerFactory to share them"""
 
     def __init__(
         self,
@@ -54,11 +67,19 @@ class LlamaIndexEmbeddingsHandler(EmbeddingsHandlerBase):
         index_name: str = "pg_essays",
         index_prefix: str = "llama",
         load_docs: bool = False,
+        vector_store: Optional[VECTOR_STORE_TYPE] = None,
+        vector_store_options: Optional[VectorStoreOptions] = None,
+        embeddings_provider: Optional[str] = None,
+        chunking: Optional[ChunkingOptions] = None,
     ):
-        vector_store = RedisVectorStore(
-            index_name=index_name,
-            index_prefix=index_prefix,
-            redis_url=os.getenv("REDIS_URL"),
+        self.chunking = resolve_chunking(chunking)
+        embeddings_provider = embeddings_provider or EMBEDDINGS_PROVIDER
+        # cached searches of other settings of the index are not reused
+        self.cache_settings = (
+            f"{embeddings_provider}:{self.chunking.json(sort_keys=True)}"
+        )
+        vector_store = get_vector_store(
+            index_name, index_prefix, vector_store, vector_store_options
         )
 
         storage_context = StorageContext.from_defaults(vector_store=vector_store)
@@ -68,92 +89,272 @@ class LlamaIndexEmbeddingsHandler(EmbeddingsHandlerBase):
                 max_tokens=256, temperature=0.9, model=GPT_3_5_TURBO, as_predictor=True
             )
         )
-        node_parser = SimpleNodeParser(
-            text_splitter=TokenTextSplitter(chunk_size=1024, chunk_overlap=20)
+        node_parser = get_node_parser(
+            self.chunking.chunk_size, self.chunking.chunk_overlap
         )
         prompt_helper = PromptHelper(
-            context_window=4096,
+            context_window=self.chunking.context_window,
             num_output=256,
             chunk_overlap_ratio=0.1,
             chunk_size_limit=None,
         )
         service_context = ServiceContext.from_defaults(
             llm_predictor=llm_predictor,
-            embed_model=EMBEDS_MODEL,
+            embed_model=get_embed_model(embeddings_provider),
             node_parser=node_parser,
             prompt_helper=prompt_helper,
         )
-        if not load_docs:
-            self.index = VectorStoreIndex.from_vector_store(
-                vector_store=vector_store,
-                storage_context=storage_context,
-                service_context=service_context,
-            )
-        else:
-            self.document_strings = []
-            self.documents = []
-            for key, value in embeddings.items():
-                if value.folder_path:
-                    self.documents.extend(
-                        SimpleDirectoryReader(
-                            value.folder_path, recursive=True
-                        ).load_data()
-                    )
-
-            for key, value in embeddings.items():
-                if value.content:
-                    self.document_strings.append(value.content)
-            self.documents.extend(
-                StringIterableReader().load_data(self.document_strings)
-            )
-
-            self.index = VectorStoreIndex.from_documents(
-                documents=self.documents,
-                storage_context=storage_context,
-                service_context=service_context,
-            )
+        self.index_name = index_name
+        self.vector_store = vector_store
+        self.embeddings = embeddings
+        self.bm25_index = get_bm25_index(index_name)
+        # saves queue, started by the first save
+        self._memory_writer: Optional[WriteBehindWriter] = None
+        self._memory_writer_lock = threading.Lock()
+        self.index = VectorStoreIndex.from_vector_store(
+            vector_store=vector_store,
+            storage_context=storage_context,
+            service_context=service_context,
+        )
+        if load_docs:
+            self.ingest(embeddings)
 
         self.metadata_postprocessor = MetadataReplacementPostProcessor(
             target_metadata_key="window"
         )
+        # built once, both only hold references to the index
+        # https://gpt-index.readthedocs.io/en/latest/examples/node_postprocessor/MetadataReplacementDemo.html
+        self.query_engine = self.index.as_query_engine(
+            similarity_top_k=self.chunking.similarity_top_k,
+            node_postprocessors=[self.metadata_postprocessor],
+        )
+        self.retriever = self.index.as_retriever(
+            similarity_top_k=self.chunking.similarity_top_k
+        )
+        self.hybrid_retriever = (
+            HybridRetriever(
+                self.index.as_retriever(
+                    similarity_top_k=self.chunking.similarity_top_k * HYBRID_CANDIDATES
+                ),
+                self.bm25_index,
+                self.chunking.similarity_top_k,
+            )
+            if self.bm25_index is not None
+            else None
+        )
 
-    def __call__(cls, *args, **kwargs):
-        """Call method for the singleton metaclass."""
-        cls_key = None
-        if cls_key not in cls._instances:
-            cls_key = (
-                f"llamaindex_instance_{kwargs['index_name']}_{kwargs['index_prefix']}"
+    def ingest(
+        self, embeddings: EMBEDDINGS_TYPE, dry_run: bool = False, rebuild: bool = False
+    ) -> IngestionPlan:
+        """
+        Ingest the new and changed embeddings sources, see expert_gpts.embeddings.ingestion.
+
+        :param embeddings:
+        :param dry_run: only plan the work
+        :param rebuild: drop the index and ingest everything again, needed once for
+            indexes loaded before the ingestion manifest existed
+        :return:
+        """
+        plan = plan_ingestion(self.index_name, embeddings, rebuild=rebuild)
+        logger.info(f"{self.index_name} ingestion plan: {plan.summary()}")
+        if dry_run:
+            return plan
+        if rebuild:
+            self.drop_index()
+        if plan.has_changes:
+            pipeline = IngestionPipeline(
+                self.index, get_parse_executor(), self.bm25_index, self.chunking
             )
+            plan.stages = pipeline.run(plan)
+            logger.info(f"{self.index_name} ingestion stages: {plan.stages}")
+            persist_vector_store(self.vector_store)
+            self.invalidate_cache()
+        return plan
 
-            cls._instances[cls_key] = cls(*args, **kwargs)
+    def drop_index(self):
+        """Delete the index and its nodes from the vector store and the manifest"""
+        try:
+            self.vector_store.delete_index()
+        except ResponseError as e:
+            logger.warning(f"Could not drop index {self.index_name}: {e}")
+        if self.bm25_index is not None:
+            self.bm25_index.drop()
+        with get_db_session() as session:
+            IngestionManifest.delete_index(session, self.index_name)
+            session.commit()
+        self.invalidate_cache()
 
-        return cls._instances[cls_key]
+    def invalidate_cache(self):
+        """Drop the cached searches of the index, see retrieval_cache"""
+        cache = get_retrieval_cache()
+        if cache is not None:
+            cache.invalidate(self.index_name)
 
-    def search(self, query: str) -> RESPONSE_TYPE:
+    def _cached(
+        self,
+        mode: str,
+        query: str,
+        compute: Callable[[QueryBundle], Any],
+        query_embedding: Optional[List[float]] = None,
+    ) -> Any:
+        cache = get_retrieval_cache()
+        if cache is None:
+            return compute(QueryBundle(query, embedding=query_embedding))
+        embed = self.index.service_context.embed_model.get_query_embedding
+        if query_embedding is not None:
+            embed = lambda _: query_embedding  # noqa: E731
+        # the query embedding of the similarity lookup is reused by the search
+        return cache.get_or_compute(
+            self.index_name,
+            mode,
+            query,
+            embed=embed,
+            compute=lambda embedding: compute(QueryBundle(query, embedding=embedding)),
+            settings=self.cache_settings,
+            # LLM answers of similar questions differ, only the nodes are shared
+            semantic=mode.startswith("retrieve"),
+        )
+
+    def search(self, query: str, retrieval: RETRIEVAL_TYPE = "vector") -> RESPONSE_TYPE:
         logger.debug(f"query: {query}")
-        # https://gpt-index.readthedocs.io/en/latest/examples/node_postprocessor/MetadataReplacementDemo.html
-        return self.index.as_query_engine(
-            similarity_top_k=2,
-            node_postprocessors=[self.metadata_postprocessor],
-        ).query(query)
+        self.flush_memories()
+        if self._is_hybrid(retrieval):
+            return self._hybrid("synthesize", query, self._synthesize)
+        return self._cached("synthesize", query, self.query_engine.query)
+
+    def retrieve(
+        self,
+        query: str,
+        retrieval: RETRIEVAL_TYPE = "vector",
+        query_embedding: Optional[List[float]] = None,
+    ) -> List[RetrievedNode]:
+        """
+        Top-k nodes of the query, without the LLM answer synthesis of search.
+
+        :param query:
+        :param retrieval:
+        :param query_embedding: embedding of the query by the embed model of the
+            index, computed when not set
+        :return:
+        """
+        logger.debug(f"retrieve: {query}")
+        self.flush_memories()
+        if self._is_hybrid(retrieval):
+            return self._hybrid(
+                "retrieve", query, self._to_retrieved_nodes, query_embedding
+            )
+        return self._cached("retrieve", query, self._retrieve, query_embedding)
+
+    def _is_hybrid(self, retrieval: RETRIEVAL_TYPE) -> bool:
+        if retrieval == "hybrid" and self.hybrid_retriever is None:
+            logger.warning(f"{self.index_name}: BM25_INDEX disabled, vector retrieval")
+        return retrieval == "hybrid" and self.hybrid_retriever is not None
+
+    def _hybrid(
+        self,
+        mode: SEARCH_MODE_TYPE,
+        query: str,
+        respond: Callable[[QueryBundle, List[NodeWithScore]], Any],
+        query_embedding: Optional[List[float]] = None,
+    ) -> Any:
+        """BM25 results alone when decisive, no embedding, else fused with the vectors"""
+        lexical = self.hybrid_retriever.lexical(query)
+        if self.hybrid_retriever.is_decisive(query, lexical):
+            return respond(
+                QueryBundle(query), lexical[: self.chunking.similarity_top_k]
+            )
+        return self._cached(
+            f"{mode}_hybrid",
+            query,
+            lambda bundle: respond(bundle, self.hybrid_retriever.fuse(bundle, lexical)),
+            query_embedding,
+        )
+
+    def _synthesize(
+        self, query_bundle: QueryBundle, nodes: List[NodeWithScore]
+    ) -> RESPONSE_TYPE:
+        return self.query_engine.synthesize(
+            query_bundle, self.metadata_postprocessor.postprocess_nodes(nodes)
+        )
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[RetrievedNode]:
+        return self._to_retrieved_nodes(
+            query_bundle, self.retriever.retrieve(query_bundle)
+        )
+
+    def _to_retrieved_nodes(
+        self, query_bundle: QueryBundle, nodes: List[NodeWithScore]
+    ) -> List[RetrievedNode]:
+        nodes = self.metadata_postprocessor.postprocess_nodes(nodes)
+        return [
+            RetrievedNode(
+                text=node.node.get_content(),
+                score=node.score,
+                metadata=node.node.metadata,
+                node_id=node.node.node_id,
+            )
+            for node in nodes
+        ]
 
     def save(self, remember_this: List[str]):
+        """Queue memories, see expert_gpts.embeddings.memories"""
         logger.debug(f"remember_this: {remember_this}")
-        documents = StringIterableReader().load_data(remember_this)
-        self.documents.extend(documents)
-        for document in documents:
-            self.index.insert(document)
+        rows = [dict(text=text) for text in remember_this]
+        if not MEMORY_WRITE_BEHIND:
+            self._write_memories(rows)
+            return
+        writer = self._get_memory_writer()
+        for row in rows:
+            writer.put(row)
+
+    def _get_memory_writer(self) -> WriteBehindWriter:
+        with self._memory_writer_lock:
+            if self._memory_writer is None:
+                self._memory_writer = WriteBehindWriter(
+                    self._write_memories,
+                    batch_size=MEMORY_SAVE_BATCH_SIZE,
+                    flush_interval=MEMORY_SAVE_FLUSH_INTERVAL,
+                    max_pending=MEMORY_SAVE_MAX_PENDING,
+                    name=f"{self.index_name}-memories",
+                )
+            return self._memory_writer
 
-    def get_embeddings_tool_get_memory(self, tool_key: str = "default") -> Tool:
+    def _write_memories(self, rows: List[dict]):
+        written, duplicates = write_memories(
+            self.index, [row["text"] for row in rows], bm25_index=self.bm25_index
+        )
+        logger.debug(
+            f"{self.index_name}: {written} memory nodes written, {duplicates} duplicates"
+        )
+        if written:
+            persist_vector_store(self.vector_store)
+            self.invalidate_cache()
+
+    def flush_memories(self):
+        """Wait for the queued memories to be written"""
+        if self._memory_writer is not None and not self._memory_writer.flush():
+            logger.error(f"{self.index_name}: queued memories were lost")
+
+    def close(self):
+        """Write the queued memories and stop the writer"""
+        if self._memory_writer is not None:
+            self._memory_writer.close()
+
+    def get_embeddings_tool_get_memory(
+        self,
+        tool_key: str = "default",
+        search_mode: SEARCH_MODE_TYPE = "synthesize",
+        retrieval: RETRIEVAL_TYPE = "vector",
+    ) -> Tool:
         return Tool(
             name=f"{tool_key}_get_memories",
-            func=lambda q: str(self.search(q)),
-            description=GET_MEMORIES_TOOL_PROMPT,
+            func=lambda q: self.get_context(q, search_mode, retrieval),
+            description=system_prompts.GET_MEMORIES_TOOL_PROMPT,
         )
 
     def get_embeddings_tool_save_memory(self, tool_key: str = "default") -> Tool:
         return Tool(
             name=f"{tool_key}_save_memory",
             func=lambda q: str(self.save([q])),
-            description=SAVE_MEMORIES_TOOL_PROMPT,
+            description=system_prompts.SAVE_MEMORIES_TOOL_PROMPT,
         )
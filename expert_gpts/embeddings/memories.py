@@ -0,0 +1,86 @@
+"""
+Write path of the memories saved by the agents (save memory tool).
+
+Saves are queued in a WriteBehindWriter per index and written in batches: the
+texts of a batch are chunked and embedded with one batched call, the chunks with a
+cosine similarity of at least MEMORY_DEDUP_SIMILARITY to a stored node (or to a
+previous chunk of the batch) are dropped, and the rest are added to the vector
+store at once. Reads of the index flush the pending saves first.
+"""
+import logging
+import os
+from typing import List, Optional, Tuple
+
+import numpy as np
+from llama_index import StringIterableReader, VectorStoreIndex
+from llama_index.schema import MetadataMode
+from llama_index.vector_stores.types import VectorStore, VectorStoreQuery
+from redis.exceptions import ResponseError
+
+from expert_gpts.embeddings.bm25 import BM25Index
+from expert_gpts.embeddings.vector_stores.numpy_store import normalize
+
+logger = logging.getLogger(__name__)
+
+MEMORY_WRITE_BEHIND = os.getenv("MEMORY_WRITE_BEHIND", "true").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+MEMORY_SAVE_BATCH_SIZE = int(os.getenv("MEMORY_SAVE_BATCH_SIZE", 32))
+MEMORY_SAVE_FLUSH_INTERVAL = float(os.getenv("MEMORY_SAVE_FLUSH_INTERVAL", 1))
+MEMORY_SAVE_MAX_PENDING = int(os.getenv("MEMORY_SAVE_MAX_PENDING", 256))
+MEMORY_DEDUP_SIMILARITY = float(os.getenv("MEMORY_DEDUP_SIMILARITY", 0.97))
+
+
+def stored_similarity(vector_store: VectorStore, embedding: List[float]) -> float:
+    """Cosine similarity of the closest stored node"""
+    try:
+        result = vector_store.query(
+            VectorStoreQuery(query_embedding=embedding, similarity_top_k=1)
+        )
+    except ResponseError:
+        # the redis index is created by the first add
+        return 0.0
+    return max(result.similarities or [0.0])
+
+
+def write_memories(
+    index: VectorStoreIndex,
+    texts: List[str],
+    similarity: float = MEMORY_DEDUP_SIMILARITY,
+    bm25_index: Optional[BM25Index] = None,
+) -> Tuple[int, int]:
+    """
+    Embed and add the texts to the index, skipping near-duplicates.
+
+    :param index:
+    :param texts:
+    :param similarity: cosine similarity from which a chunk is a duplicate
+    :param bm25_index: indexed with the vector store when set
+    :return: written and duplicated nodes
+    """
+    documents = StringIterableReader().load_data(list(dict.fromkeys(texts)))
+    nodes = index.service_context.node_parser.get_nodes_from_documents(documents)
+    if not nodes:
+        return 0, 0
+    embeddings = index.service_context.embed_model._get_text_embeddings(
+        [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+    )
+
+    kept, kept_vectors = [], np.empty((0, len(embeddings[0])), dtype=np.float32)
+    for node, embedding in zip(nodes, embeddings):
+        vector = normalize(embedding)
+        if len(kept) and (kept_vectors @ vector).max() >= similarity:
+            continue
+        if stored_similarity(index.vector_store, embedding) >= similarity:
+            continue
+        node.embedding = embedding
+        kept.append(node)
+        kept_vectors = np.vstack([kept_vectors, vector])
+    if kept:
+        # nodes carry their embedding, insert_nodes does not embed them again
+        index.insert_nodes(kept)
+        if bm25_index is not None:
+            bm25_index.add(kept)
+    return len(kept), len(nodes) - len(kept)
@@ -0,0 +1,385 @@
+"""
+Staged ingestion pipeline of an IngestionPlan into a vector index:
+
+    parse (process pool) -> chunk -> embed (batched, N threads) -> write (batched)
+
+Stages run in their own threads connected by bounded queues, so the memory holds at
+most a few batches whatever the corpus size, and a slow embedding API does not stall
+the parsing of the next files. Large plain text files are parsed segment by segment
+in the parse thread (see ingestion.iter_documents), so a file is never held whole.
+Each source is recorded in the IngestionManifest once all its nodes are written.
+"""
+import logging
+import os
+import queue
+import threading
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from functools import lru_cache
+from time import perf_counter
+from typing import Dict, List, Optional
+
+from llama_index import VectorStoreIndex
+from llama_index.node_parser import NodeParser
+from llama_index.schema import BaseNode, Document, MetadataMode
+
+from expert_gpts.database import get_db_session
+from expert_gpts.database.ingestion_manifest import IngestionManifest
+from expert_gpts.embeddings.bm25 import BM25Index
+from expert_gpts.embeddings.chunking import get_node_parser, resolve_chunking
+from expert_gpts.embeddings.ingestion import (
+    IngestionPlan,
+    Source,
+    delete_documents,
+    iter_documents,
+    load_source,
+    record_source,
+    remove_sources,
+)
+from shared.config import ChunkingOptions
+
+logger = logging.getLogger(__name__)
+
+INGESTION_PARSE_WORKERS = int(os.getenv("INGESTION_PARSE_WORKERS", os.cpu_count() or 1))
+INGESTION_EMBED_BATCH_SIZE = int(os.getenv("INGESTION_EMBED_BATCH_SIZE", 64))
+INGESTION_EMBED_CONCURRENCY = int(os.getenv("INGESTION_EMBED_CONCURRENCY", 4))
+INGESTION_WRITE_BATCH_SIZE = int(os.getenv("INGESTION_WRITE_BATCH_SIZE", 256))
+INGESTION_QUEUE_SIZE = int(os.getenv("INGESTION_QUEUE_SIZE", 8))
+
+DONE = object()
+
+
+@lru_cache
+def get_parse_executor() -> Optional[Executor]:
+    """Process pool shared by the pipelines of all the indexes, None parses inline"""
+    if INGESTION_PARSE_WORKERS <= 1:
+        return None
+    return ProcessPoolExecutor(max_workers=INGESTION_PARSE_WORKERS)
+
+
+class StageStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.items = 0
+        self.batches = 0
+        self.busy_time = 0.0
+
+    def record(self, items: int, seconds: float):
+        with self._lock:
+            self.items += items
+            self.batches += 1
+            self.busy_time += seconds
+
+    def snapshot(self, wall_time: float) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "items": self.items,
+                "batches": self.batches,
+                "busy_time": self.busy_time,
+                "items_per_second": self.items / wall_time if wall_time else 0.0,
+            }
+
+
+class SourceTracker:
+    """Nodes of each source still to be written, to record sources when complete"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending: Dict[str, int] = {}
+        self._sources: Dict[str, tuple] = {}
+        self._paths: Dict[str, str] = {}
+        # sources whose last documents were registered
+        self._parsed = set()
+
+    def register(
+        self,
+        source: Source,
+        documents: List[Document],
+        nodes: List[BaseNode],
+        last: bool = True,
+    ):
+        """Nodes of some documents of the source, last when no more will follow"""
+        with self._lock:
+            for document in documents:
+                self._paths[document.doc_id] = source.path
+            self._pending[source.path] = self._pending.get(source.path, 0) + len(nodes)
+            _, doc_ids, node_ids = self._sources.setdefault(
+                source.path, (source, [], [])
+            )
+            doc_ids.extend(document.doc_id for document in documents)
+            node_ids.extend(node.node_id for node in nodes)
+            if last:
+                self._parsed.add(source.path)
+            return self._pop_complete([source.path])
+
+    def written(self, nodes: List[BaseNode]):
+        with self._lock:
+            paths = [self._paths[node.ref_doc_id] for node in nodes]
+            for path in paths:
+                self._pending[path] -= 1
+            return self._pop_complete(set(paths))
+
+    def _pop_complete(self, paths) -> List[tuple]:
+        complete = []
+        for path in paths:
+            if path in self._parsed and self._pending.get(path) == 0:
+                self._parsed.discard(path)
+                del self._pending[path]
+                source, doc_ids, node_ids = self._sources.pop(path)
+                for doc_id in doc_ids:
+                    self._paths.pop(doc_id, None)
+                complete.append((source, doc_ids, node_ids))
+        return complete
+
+
+class IngestionPipeline:
+    def __init__(
+        self,
+        index: VectorStoreIndex,
+        parse_executor: Optional[Executor] = None,
+        bm25_index: Optional[BM25Index] = None,
+        chunking: Optional[ChunkingOptions] = None,
+        embed_batch_size: int = INGESTION_EMBED_BATCH_SIZE,
+        embed_concurrency: int = INGESTION_EMBED_CONCURRENCY,
+        write_batch_size: int = INGESTION_WRITE_BATCH_SIZE,
+        queue_size: int = INGESTION_QUEUE_SIZE,
+    ):
+        self.index = index
+        self.parse_executor = parse_executor
+        self.bm25_index = bm25_index
+        self.chunking = resolve_chunking(chunking)
+        self.embed_batch_size = embed_batch_size
+        self.embed_concurrency = embed_concurrency
+        self.write_batch_size = write_batch_size
+        self.queue_size = queue_size
+        self.stats = {
+            stage: StageStats() for stage in ("parse", "chunk", "embed", "write")
+        }
+        self.wall_time = 0.0
+
+    def __repr__(self):
+        return (
+            f"<IngestionPipeline embed_batch_size={self.embed_batch_size} "
+            f"embed_concurrency={self.embed_concurrency} "
+            f"write_batch_size={self.write_batch_size}>"
+        )
+
+    def run(self, plan: IngestionPlan) -> Dict[str, Dict[str, float]]:
+        """Apply the plan, returns the throughput of each stage"""
+        started_at = perf_counter()
+        remove_sources(self.index.vector_store, plan, self.bm25_index)
+        sources = plan.modified + plan.added
+        if sources:
+            self._run(plan.index_name, sources)
+        self.wall_time = perf_counter() - started_at
+        return self.report()
+
+    def report(self) -> Dict[str, Dict[str, float]]:
+        return {
+            stage: stats.snapshot(self.wall_time) for stage, stats in self.stats.items()
+        }
+
+    def _run(self, index_name: str, sources: List[Source]):
+        self._errors = []
+        self._stop = threading.Event()
+        self._tracker = SourceTracker()
+        self._index_name = index_name
+        with get_db_session() as session:
+            self._previous = IngestionManifest.for_index(session, index_name)
+            session.expunge_all()
+
+        parsed = queue.Queue(maxsize=self.queue_size)
+        chunked = queue.Queue(maxsize=self.queue_size)
+        embedded = queue.Queue(maxsize=self.queue_size)
+        threads = [
+            threading.Thread(
+                target=self._guard(self._parse, parsed), args=(sources, parsed)
+            ),
+            threading.Thread(
+                target=self._guard(self._chunk, chunked), args=(parsed, chunked)
+            ),
+        ]
+        embedders = [
+            threading.Thread(
+                target=self._guard(self._embed, embedded), args=(chunked, embedded)
+            )
+            for _ in range(self.embed_concurrency)
+        ]
+        for thread in threads + embedders:
+            thread.daemon = True
+            thread.start()
+
+        try:
+            self._write(embedded, expected_done=len(embedders))
+        except Exception:
+            self._stop.set()
+            raise
+        for thread in threads + embedders:
+            thread.join()
+        if self._errors:
+            raise self._errors[0]
+
+    def _guard(self, stage, downstream: queue.Queue):
+        def run(*args):
+            try:
+                stage(*args)
+            except Exception as e:
+                logger.exception(f"{self._index_name}: ingestion stage failed")
+                self._errors.append(e)
+                self._stop.set()
+                self._put(downstream, DONE, force=True)
+
+        return run
+
+    def _put(self, target: queue.Queue, item, force: bool = False):
+        while True:
+            if self._stop.is_set() and not force:
+                return
+            try:
+                target.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _get(self, source: queue.Queue):
+        while True:
+            try:
+                return source.get(timeout=0.1)
+            except queue.Empty:
+                if self._stop.is_set():
+                    return DONE
+
+    def _parse(self, sources: List[Source], parsed: queue.Queue):
+        in_flight = deque()
+
+        def emit():
+            source, started_at, result = in_flight.popleft()
+            documents = result.result() if self.parse_executor else result
+            self.stats["parse"].record(1, perf_counter() - started_at)
+            self._put(parsed, (source, documents, True))
+
+        for source in sources:
+            if self._stop.is_set():
+                break
+            if source.is_segmented:
+                # keep the order of the sources, segments of one are contiguous
+                while in_flight and not self._stop.is_set():
+                    emit()
+                self._parse_segments(source, parsed)
+                continue
+            started_at = perf_counter()
+            if self.parse_executor is not None:
+                in_flight.append(
+                    (
+                        source,
+                        started_at,
+                        self.parse_executor.submit(load_source, source),
+                    )
+                )
+            else:
+                in_flight.append((source, started_at, load_source(source)))
+            if len(in_flight) >= self.queue_size:
+                emit()
+        while in_flight and not self._stop.is_set():
+            emit()
+        self._put(parsed, DONE)
+
+    def _parse_segments(self, source: Source, parsed: queue.Queue):
+        started_at = perf_counter()
+        segments = iter_documents(source)
+        documents = next(segments, [])
+        while not self._stop.is_set():
+            following = next(segments, None)
+            self._put(parsed, (source, documents, following is None))
+            if following is None:
+                break
+            documents = following
+        self.stats["parse"].record(1, perf_counter() - started_at)
+
+    def _node_parser(self, source: Source) -> NodeParser:
+        if source.chunk_size is None and source.chunk_overlap is None:
+            return self.index.service_context.node_parser
+        return get_node_parser(
+            source.chunk_size or self.chunking.chunk_size,
+            source.chunk_overlap
+            if source.chunk_overlap is not None
+            else self.chunking.chunk_overlap,
+        )
+
+    def _chunk(self, parsed: queue.Queue, chunked: queue.Queue):
+        batch, chunking = [], None
+        while True:
+            item = self._get(parsed)
+            if item is DONE:
+                break
+            source, documents, last = item
+            started_at = perf_counter()
+            previous = self._previous.get(source.path)
+            if previous is not None and source.path != chunking:
+                # the new nodes replace these, delete them before any is written
+                delete_documents(
+                    self.index.vector_store, previous.doc_ids, self.bm25_index
+                )
+            chunking = None if last else source.path
+            nodes = self._node_parser(source).get_nodes_from_documents(documents)
+            self.stats["chunk"].record(len(nodes), perf_counter() - started_at)
+            self._record(self._tracker.register(source, documents, nodes, last))
+            for node in nodes:
+                batch.append(node)
+                if len(batch) >= self.embed_batch_size:
+                    self._put(chunked, batch)
+                    batch = []
+        if batch:
+            self._put(chunked, batch)
+        for _ in range(self.embed_concurrency):
+            self._put(chunked, DONE)
+
+    def _embed(self, chunked: queue.Queue, embedded: queue.Queue):
+        embed_model = self.index.service_context.embed_model
+        while True:
+            nodes = self._get(chunked)
+            if nodes is DONE:
+                break
+            started_at = perf_counter()
+            embeddings = embed_model._get_text_embeddings(
+                [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+            )
+            for node, embedding in zip(nodes, embeddings):
+                node.embedding = embedding
+            self.stats["embed"].record(len(nodes), perf_counter() - started_at)
+            self._put(embedded, nodes)
+        self._put(embedded, DONE)
+
+    def _write(self, embedded: queue.Queue, expected_done: int):
+        batch, done = [], 0
+        while done < expected_done:
+            nodes = self._get(embedded)
+            if nodes is DONE:
+                done += 1
+                if self._stop.is_set():
+                    break
+                continue
+            batch.extend(nodes)
+            if len(batch) >= self.write_batch_size:
+                self._write_batch(batch)
+                batch = []
+        if batch and not self._stop.is_set():
+            self._write_batch(batch)
+
+    def _write_batch(self, nodes: List[BaseNode]):
+        started_at = perf_counter()
+        # nodes carry their embedding, insert_nodes does not embed them again
+        self.index.insert_nodes(nodes)
+        if self.bm25_index is not None:
+            self.bm25_index.add(nodes)
+        self.stats["write"].record(len(nodes), perf_counter() - started_at)
+        self._record(self._tracker.written(nodes))
+
+    def _record(self, complete: List[tuple]):
+        if not complete:
+            return
+        with get_db_session() as session:
+            for source, doc_ids, node_ids in complete:
+                record_source(session, self._index_name, source, doc_ids, node_ids)
+                logger.info(f"{self._index_name}: ingested {source.path}")
+            session.commit()
@@ -0,0 +1,56 @@
+"""
+Embed models of the embeddings indexes, selected per index with `embeddings_provider`
+in the config (EMBEDDINGS_PROVIDER env by default):
+
+- openai: OpenAIEmbedding (text-embedding-ada-002)
+- local: LocalEmbedding, deterministic hashed bag of words computed on the CPU, no
+  network, to run the tests and benchmarks offline
+- package.module:attribute: a BaseEmbedding class or factory of your own
+
+Each provider sits behind a BatchingEmbedding merging concurrent requests into
+batched calls (EMBEDDINGS_BATCH_SIZE texts, waiting EMBEDDINGS_BATCH_MAX_WAIT
+seconds at most, EMBEDDINGS_MAX_CONCURRENCY calls at once) and the persistent
+embedding cache. Indexes must be queried with the provider they were ingested with,
+changing it needs a `load_docs --rebuild`.
+"""
+import importlib
+import os
+from functools import lru_cache
+
+from llama_index import OpenAIEmbedding
+from llama_index.embeddings.base import BaseEmbedding
+
+from expert_gpts.embeddings.cache import with_embedding_cache
+from expert_gpts.embeddings.providers.batching import BatchingEmbedding
+from expert_gpts.embeddings.providers.local import LocalEmbedding
+
+EMBEDDINGS_PROVIDER = os.getenv("EMBEDDINGS_PROVIDER", "openai")
+EMBEDDINGS_BATCH_SIZE = int(os.getenv("EMBEDDINGS_BATCH_SIZE", 64))
+# seconds a request waits for concurrent ones to join its batch, 0 disables it
+EMBEDDINGS_BATCH_MAX_WAIT = float(os.getenv("EMBEDDINGS_BATCH_MAX_WAIT", 0.005))
+EMBEDDINGS_MAX_CONCURRENCY = int(os.getenv("EMBEDDINGS_MAX_CONCURRENCY", 4))
+LOCAL_EMBEDDINGS_DIM = int(os.getenv("LOCAL_EMBEDDINGS_DIM", 512))
+
+
+def build_embedding_provider(provider: str) -> BaseEmbedding:
+    if provider == "openai":
+        return OpenAIEmbedding()
+    if provider == "local":
+        return LocalEmbedding(dim=LOCAL_EMBEDDINGS_DIM)
+    if ":" in provider:
+        module, attribute = provider.split(":", 1)
+        return getattr(importlib.import_module(module), attribute)()
+    raise ValueError(f"Unknown embeddings provider {provider}")
+
+
+@lru_cache
+def get_embed_model(provider: str = EMBEDDINGS_PROVIDER) -> BaseEmbedding:
+    """Embed model of the provider, built once and shared by its indexes"""
+    return with_embedding_cache(
+        BatchingEmbedding(
+            build_embedding_provider(provider),
+            batch_size=EMBEDDINGS_BATCH_SIZE,
+            max_wait=EMBEDDINGS_BATCH_MAX_WAIT,
+            max_concurrency=EMBEDDINGS_MAX_CONCURRENCY,
+        )
+    )
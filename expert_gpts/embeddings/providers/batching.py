@@ -0,0 +1,185 @@
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from time import monotonic
+from typing import Callable, Dict, List
+
+from llama_index import OpenAIEmbedding
+from llama_index.embeddings.base import BaseEmbedding
+from llama_index.embeddings.openai import get_embeddings
+from pydantic import PrivateAttr
+
+
+class MicroBatcher:
+    """
+    Merges the embed requests of concurrent threads into batched calls: a request
+    waits at most max_wait seconds for others to join its batch of up to batch_size
+    texts. Requests of batch_size texts or more are sent as they are. The calls of
+    every batcher sharing the semaphore are capped by it.
+    """
+
+    def __init__(
+        self,
+        embed: Callable[[List[str]], List[List[float]]],
+        semaphore: threading.Semaphore,
+        batch_size: int = 64,
+        max_wait: float = 0.005,
+        name: str = "embeddings",
+    ):
+        self.embed_texts = embed
+        self.semaphore = semaphore
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.name = name
+        self._queue: "queue.Queue" = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._executor = None
+        self._stats = dict(requests=0, texts=0, calls=0)
+
+    def __repr__(self):
+        return (
+            f"<MicroBatcher {self.name} batch_size={self.batch_size} "
+            f"max_wait={self.max_wait}>"
+        )
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        with self._lock:
+            self._stats["requests"] += 1
+            self._stats["texts"] += len(texts)
+        if len(texts) >= self.batch_size or self.max_wait <= 0:
+            with self.semaphore:
+                return self._call(texts)
+        future: Future = Future()
+        self._start()
+        self._queue.put((texts, future))
+        return future.result()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._executor = ThreadPoolExecutor(
+                    thread_name_prefix=f"{self.name}-batch"
+                )
+                self._thread = threading.Thread(
+                    target=self._run, name=f"{self.name}-batcher", daemon=True
+                )
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            size = len(batch[0][0])
+            deadline = monotonic() + self.max_wait
+            while size < self.batch_size:
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+                size += len(batch[-1][0])
+            # blocks while the calls are capped, the next batch fills up meanwhile
+            self.semaphore.acquire()
+            self._executor.submit(self._send, batch)
+
+    def _send(self, batch: List[tuple]):
+        try:
+            embeddings = self._call([text for texts, _ in batch for text in texts])
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        finally:
+            self.semaphore.release()
+        end = 0
+        for texts, future in batch:
+            start, end = end, end + len(texts)
+            future.set_result(embeddings[start:end])
+
+    def _call(self, texts: List[str]) -> List[List[float]]:
+        with self._lock:
+            self._stats["calls"] += 1
+        return self.embed_texts(texts)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats)
+
+
+def embed_queries(embed_model: BaseEmbedding, queries: List[str]) -> List[List[float]]:
+    """Query embeddings in one call when the provider can, BaseEmbedding has no batch"""
+    if isinstance(embed_model, OpenAIEmbedding):
+        # as OpenAIEmbedding._get_text_embeddings, Azure and proxies need the kwargs
+        return get_embeddings(
+            queries,
+            engine=embed_model._query_engine,
+            deployment_id=embed_model.deployment_name,
+            **embed_model.openai_kwargs,
+        )
+    if hasattr(embed_model, "_get_query_embeddings"):
+        return embed_model._get_query_embeddings(queries)
+    return [embed_model._get_query_embedding(query) for query in queries]
+
+
+class BatchingEmbedding(BaseEmbedding):
+    """Embed model wrapper batching the concurrent requests, see MicroBatcher"""
+
+    _embed_model: BaseEmbedding = PrivateAttr()
+    _queries: MicroBatcher = PrivateAttr()
+    _texts: MicroBatcher = PrivateAttr()
+
+    def __init__(
+        self,
+        embed_model: BaseEmbedding,
+        batch_size: int = 64,
+        max_wait: float = 0.005,
+        max_concurrency: int = 4,
+        **kwargs,
+    ):
+        super().__init__(
+            model_name=embed_model.model_name,
+            embed_batch_size=embed_model.embed_batch_size,
+            callback_manager=embed_model.callback_manager,
+            **kwargs,
+        )
+        self._embed_model = embed_model
+        semaphore = threading.BoundedSemaphore(max_concurrency)
+        name = embed_model.__class__.__name__
+        self._queries = MicroBatcher(
+            lambda queries: embed_queries(embed_model, queries),
+            semaphore,
+            batch_size,
+            max_wait,
+            name=f"{name}-queries",
+        )
+        self._texts = MicroBatcher(
+            embed_model._get_text_embeddings,
+            semaphore,
+            batch_size,
+            max_wait,
+            name=f"{name}-texts",
+        )
+
+    @property
+    def embed_model(self) -> BaseEmbedding:
+        return self._embed_model
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return dict(queries=self._queries.stats(), texts=self._texts.stats())
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._queries.embed([query])[0]
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return await self._embed_model._aget_query_embedding(query)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._texts.embed([text])[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return self._texts.embed(texts)
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return await self._embed_model._aget_text_embeddings(texts)
@@ -0,0 +1,61 @@
+import hashlib
+import math
+import re
+from collections import Counter
+from functools import lru_cache
+from typing import List, Tuple
+
+import numpy as np
+from llama_index.embeddings.base import BaseEmbedding
+
+WORD_PATTERN = re.compile(r"\w+")
+
+
+@lru_cache(maxsize=2**17)
+def bucket(word: str, dim: int) -> Tuple[int, float]:
+    """Dimension and sign of a word, from its hash"""
+    value = int.from_bytes(
+        hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest(), "little"
+    )
+    return value % dim, 1.0 if value >> 63 else -1.0
+
+
+class LocalEmbedding(BaseEmbedding):
+    """
+    Deterministic embeddings computed on the CPU, no model or network: the words of
+    the text hashed into `dim` signed dimensions (a random projection of the bag of
+    words) weighted by 1 + log(tf), L2 normalized. Texts sharing words are similar,
+    enough to run and benchmark the ingestion and the retrieval offline, it does not
+    know synonyms like a trained model.
+    """
+
+    dim: int = 512
+
+    def __init__(self, dim: int = 512, **kwargs):
+        super().__init__(model_name=f"local-hashing-{dim}", dim=dim, **kwargs)
+
+    def _embed(self, text: str) -> List[float]:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for word, count in Counter(WORD_PATTERN.findall(text.lower())).items():
+            index, sign = bucket(word, self.dim)
+            vector[index] += sign * (1 + math.log(count))
+        norm = np.linalg.norm(vector)
+        if norm:
+            vector /= norm
+        return vector.tolist()
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._embed(query)
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return self._embed(query)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._embed(text)
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+    def _get_query_embeddings(self, queries: List[str]) -> List[List[float]]:
+        # queries and texts are embedded alike
+        return self._get_text_embeddings(queries)
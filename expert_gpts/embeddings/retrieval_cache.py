@@ -0,0 +1,192 @@
+"""
+In-process cache of the embeddings searches, per index, search mode and the settings
+changing their results (embeddings provider, chunking and top-k).
+
+A query is looked up by its exact text first and then, for the modes allowing it,
+by its embedding: the result of the most similar cached query is returned when their
+cosine similarity is at least RETRIEVAL_CACHE_SIMILARITY, so near-identical
+questions skip the vector search. Only retrieved nodes are shared that way, the
+answers synthesized by the LLM need the exact question: different questions often
+have embeddings above 0.95 and would get the answer of another question. Entries
+expire after RETRIEVAL_CACHE_TTL seconds, each bucket keeps the
+RETRIEVAL_CACHE_MAX_ENTRIES most recently used ones, and the handlers invalidate an
+index when save() or an ingestion changes it. Other processes' changes are only
+seen once the entries expire.
+"""
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import lru_cache
+from time import monotonic
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from expert_gpts.embeddings.vector_stores.numpy_store import normalize
+
+RETRIEVAL_CACHE_ENABLED = os.getenv("RETRIEVAL_CACHE", "true").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+RETRIEVAL_CACHE_MAX_ENTRIES = int(os.getenv("RETRIEVAL_CACHE_MAX_ENTRIES", 1000))
+RETRIEVAL_CACHE_TTL = float(os.getenv("RETRIEVAL_CACHE_TTL", 3600))
+RETRIEVAL_CACHE_SIMILARITY = float(os.getenv("RETRIEVAL_CACHE_SIMILARITY", 0.95))
+
+
+@dataclass
+class CachedRetrieval:
+    vector: np.ndarray
+    value: Any
+    expires_at: float
+
+
+class RetrievalBucket:
+    """Entries of one index, search mode and settings, by query text in LRU order"""
+
+    def __init__(self):
+        self.entries: "OrderedDict[str, CachedRetrieval]" = OrderedDict()
+        # stacked vectors of the entries for the similarity lookup, None when stale
+        self._matrix: Optional[np.ndarray] = None
+        self._texts: List[str] = []
+
+    def changed(self):
+        self._matrix = None
+
+    def most_similar(self, vector: np.ndarray) -> Tuple[Optional[str], float]:
+        if not self.entries:
+            return None, 0.0
+        if self._matrix is None:
+            self._texts = list(self.entries)
+            self._matrix = np.stack([self.entries[t].vector for t in self._texts])
+        scores = self._matrix @ vector
+        best = int(scores.argmax())
+        return self._texts[best], float(scores[best])
+
+
+class RetrievalCache:
+    def __init__(
+        self,
+        max_entries: int = RETRIEVAL_CACHE_MAX_ENTRIES,
+        ttl: float = RETRIEVAL_CACHE_TTL,
+        similarity: float = RETRIEVAL_CACHE_SIMILARITY,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity = similarity
+        self._lock = threading.Lock()
+        self._buckets: Dict[Tuple[str, str, str], RetrievalBucket] = {}
+        # bumped on invalidation, results computed before it are not stored
+        self._generations: Dict[str, int] = {}
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get_or_compute(
+        self,
+        index_name: str,
+        mode: str,
+        query: str,
+        embed: Callable[[str], List[float]],
+        compute: Callable[[List[float]], Any],
+        settings: str = "",
+        semantic: bool = True,
+    ) -> Any:
+        """
+        Cached result of the query, else compute it and cache it.
+
+        :param index_name:
+        :param mode: search mode, results of different modes are not interchangeable
+        :param query:
+        :param embed: query embedding, only called when the exact text is not cached
+        :param compute: result from the query embedding
+        :param settings: the settings the result depends on, others get their own entries
+        :param semantic: whether the result of a similar query may be returned
+        :return:
+        """
+        key = (index_name, mode, settings)
+        with self._lock:
+            generation = self._generations.get(index_name, 0)
+            entry = self._get(key, query)
+            if entry is not None:
+                self.exact_hits += 1
+                return entry.value
+
+        embedding = embed(query)
+        vector = normalize(embedding)
+        with self._lock:
+            bucket = self._buckets.get(key) if semantic else None
+            if bucket is not None:
+                text, score = bucket.most_similar(vector)
+                entry = self._get(key, text) if score >= self.similarity else None
+                if entry is not None:
+                    self.semantic_hits += 1
+                    return entry.value
+            self.misses += 1
+
+        value = compute(embedding)
+        with self._lock:
+            if self._generations.get(index_name, 0) == generation:
+                self._put(key, query, vector, value)
+        return value
+
+    def _get(self, key: Tuple[str, str, str], text: str) -> Optional[CachedRetrieval]:
+        bucket = self._buckets.get(key)
+        entry = bucket.entries.get(text) if bucket else None
+        if entry is None:
+            return None
+        if entry.expires_at <= monotonic():
+            del bucket.entries[text]
+            bucket.changed()
+            return None
+        bucket.entries.move_to_end(text)
+        return entry
+
+    def _put(
+        self, key: Tuple[str, str, str], text: str, vector: np.ndarray, value: Any
+    ):
+        bucket = self._buckets.setdefault(key, RetrievalBucket())
+        bucket.entries[text] = CachedRetrieval(vector, value, monotonic() + self.ttl)
+        bucket.entries.move_to_end(text)
+        while len(bucket.entries) > self.max_entries:
+            bucket.entries.popitem(last=False)
+            self.evictions += 1
+        bucket.changed()
+
+    def invalidate(self, index_name: str):
+        """Drop the cached results of the index, called when its nodes change"""
+        with self._lock:
+            self._generations[index_name] = self._generations.get(index_name, 0) + 1
+            for key in [key for key in self._buckets if key[0] == index_name]:
+                del self._buckets[key]
+            self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            for index_name in {key[0] for key in self._buckets}:
+                self._generations[index_name] = self._generations.get(index_name, 0) + 1
+            self._buckets.clear()
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            hits = self.exact_hits + self.semantic_hits
+            lookups = hits + self.misses
+            return {
+                "size": sum(len(b.entries) for b in self._buckets.values()),
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+@lru_cache
+def get_retrieval_cache() -> Optional[RetrievalCache]:
+    if not RETRIEVAL_CACHE_ENABLED:
+        return None
+    return RetrievalCache()
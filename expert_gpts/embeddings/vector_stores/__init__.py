@@ -0,0 +1,140 @@
+"""
+Vector stores of the embeddings indexes, selected per index with `vector_store` in
+the config (VECTOR_STORE env by default):
+
+- redis: RedisVectorStore on Redis Stack (REDIS_URL), every index shares one
+  blocking connection pool of REDIS_POOL_MAX_CONNECTIONS connections
+- numpy: NumpyVectorStore, in-process and persisted under NUMPY_VECTOR_STORE_PATH
+- ivf: IvfVectorStore, the numpy store with an approximate (IVF) index, tuned with
+  `vector_store_options` (IVF_NLIST and IVF_NPROBE env by default)
+
+Both local stores can keep their vectors quantized in memory (`quantization` option,
+VECTOR_STORE_QUANTIZATION env by default), RedisVectorStore has a fixed float32
+schema so it cannot.
+"""
+import os
+from functools import lru_cache
+from typing import Optional
+
+import redis
+from llama_index.vector_stores import RedisVectorStore
+from llama_index.vector_stores.types import VectorStore
+
+from expert_gpts.embeddings.vector_stores.ivf_store import IvfVectorStore
+from expert_gpts.embeddings.vector_stores.numpy_store import NumpyVectorStore
+from expert_gpts.embeddings.vector_stores.quantization import QUANTIZATION_TYPE
+from shared.config import VECTOR_STORE_TYPE, VectorStoreOptions
+
+VECTOR_STORE = os.getenv("VECTOR_STORE", "redis")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
+REDIS_POOL_MAX_CONNECTIONS = int(os.getenv("REDIS_POOL_MAX_CONNECTIONS", 50))
+# seconds waiting for a free connection when all are in use
+REDIS_POOL_TIMEOUT = float(os.getenv("REDIS_POOL_TIMEOUT", 20))
+NUMPY_VECTOR_STORE_PATH = os.getenv("NUMPY_VECTOR_STORE_PATH", "var/vector_stores")
+NUMPY_VECTOR_STORE_MMAP = os.getenv("NUMPY_VECTOR_STORE_MMAP", "false").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+# journal entries of a numpy/ivf store, relative to its rows, before it is compacted
+NUMPY_VECTOR_STORE_JOURNAL_RATIO = float(
+    os.getenv("NUMPY_VECTOR_STORE_JOURNAL_RATIO", 0.25)
+)
+IVF_NLIST = int(os.getenv("IVF_NLIST", 256))
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", 8))
+# float16 or int8, unset keeps float32
+VECTOR_STORE_QUANTIZATION = os.getenv("VECTOR_STORE_QUANTIZATION") or None
+# candidates per result re-ranked on the float32 vectors
+VECTOR_STORE_RERANK = int(os.getenv("VECTOR_STORE_RERANK", 4))
+
+
+@lru_cache
+def get_redis_client(redis_url: str = REDIS_URL) -> redis.Redis:
+    """Client on the connection pool shared by the indexes of redis_url"""
+    return redis.Redis(
+        connection_pool=redis.BlockingConnectionPool.from_url(
+            redis_url,
+            max_connections=REDIS_POOL_MAX_CONNECTIONS,
+            timeout=REDIS_POOL_TIMEOUT,
+        )
+    )
+
+
+def get_redis_vector_store(index_name: str, index_prefix: str) -> RedisVectorStore:
+    vector_store = RedisVectorStore(
+        index_name=index_name,
+        index_prefix=index_prefix,
+        redis_url=REDIS_URL,
+    )
+    # RedisVectorStore opens a client of its own, only used to check the modules
+    vector_store.client.close()
+    vector_store._redis_client = get_redis_client(REDIS_URL)
+    return vector_store
+
+
+@lru_cache
+def get_numpy_vector_store(
+    index_name: str,
+    quantization: Optional[QUANTIZATION_TYPE] = None,
+    rerank: int = VECTOR_STORE_RERANK,
+) -> NumpyVectorStore:
+    """One store per index and process, every handler of the index shares its matrix"""
+    return NumpyVectorStore(
+        os.path.join(NUMPY_VECTOR_STORE_PATH, index_name),
+        mmap=NUMPY_VECTOR_STORE_MMAP,
+        quantization=quantization,
+        rerank=rerank,
+        journal_ratio=NUMPY_VECTOR_STORE_JOURNAL_RATIO,
+    )
+
+
+@lru_cache
+def get_ivf_vector_store(
+    index_name: str,
+    nlist: int,
+    nprobe: int,
+    quantization: Optional[QUANTIZATION_TYPE] = None,
+    rerank: int = VECTOR_STORE_RERANK,
+) -> IvfVectorStore:
+    return IvfVectorStore(
+        os.path.join(NUMPY_VECTOR_STORE_PATH, index_name),
+        nlist=nlist,
+        nprobe=nprobe,
+        mmap=NUMPY_VECTOR_STORE_MMAP,
+        quantization=quantization,
+        rerank=rerank,
+        journal_ratio=NUMPY_VECTOR_STORE_JOURNAL_RATIO,
+    )
+
+
+def get_vector_store(
+    index_name: str,
+    index_prefix: str,
+    vector_store: Optional[VECTOR_STORE_TYPE] = None,
+    options: Optional[VectorStoreOptions] = None,
+) -> VectorStore:
+    vector_store = vector_store or VECTOR_STORE
+    options = options or VectorStoreOptions()
+    if vector_store == "redis":
+        if options.quantization:
+            raise ValueError(f"{index_name}: quantization needs a numpy or ivf store")
+        return get_redis_vector_store(index_name, index_prefix)
+    quantization = options.quantization or VECTOR_STORE_QUANTIZATION
+    rerank = options.rerank or VECTOR_STORE_RERANK
+    if vector_store == "numpy":
+        return get_numpy_vector_store(index_name, quantization, rerank)
+    if vector_store == "ivf":
+        return get_ivf_vector_store(
+            index_name,
+            options.nlist or IVF_NLIST,
+            options.nprobe or IVF_NPROBE,
+            quantization,
+            rerank,
+        )
+    raise ValueError(f"Unknown vector store {vector_store}")
+
+
+def persist_vector_store(vector_store: VectorStore):
+    """Write the changes of local stores to disk, Redis persists by itself"""
+    if isinstance(vector_store, NumpyVectorStore):
+        vector_store.persist()
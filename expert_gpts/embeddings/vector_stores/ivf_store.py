@@ -0,0 +1,213 @@
+"""
+Approximate nearest neighbours on top of NumpyVectorStore with an inverted file
+(IVF) index: the vectors are clustered with spherical k-means into nlist lists and
+a query only scores the rows of the nprobe lists whose centroids are closest to
+it, trading recall for latency (nprobe = nlist scores every row).
+
+New rows are assigned to their closest centroid. The centroids are trained once
+the store holds min_train_size vectors and trained again each time it doubles
+since the last training, so the lists stay balanced while the corpus grows.
+"""
+import json
+import logging
+import os
+from typing import List, Optional
+
+import numpy as np
+from llama_index.vector_stores.types import VectorStoreQuery
+
+from expert_gpts.embeddings.vector_stores.numpy_store import (
+    NumpyVectorStore,
+    normalize,
+    top_k,
+    write_file,
+)
+from expert_gpts.embeddings.vector_stores.quantization import QUANTIZATION_TYPE
+
+logger = logging.getLogger(__name__)
+
+CENTROIDS_FILE = "centroids.npy"
+ASSIGNMENTS_FILE = "assignments.npy"
+IVF_FILE = "ivf.json"
+
+# k-means trains on a sample of at most this many vectors per list
+TRAIN_SAMPLE_PER_LIST = 256
+TRAIN_ITERATIONS = 10
+# below 39 vectors per list k-means centroids are mostly noise
+MIN_VECTORS_PER_LIST = 39
+
+
+def assign(vectors: np.ndarray, centroids: np.ndarray, batch_size: int = 65536):
+    """Closest centroid of each normalized vector, in batches to bound memory"""
+    assignments = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), batch_size):
+        end = start + batch_size
+        scores = vectors[start:end] @ centroids.T
+        assignments[start:end] = scores.argmax(axis=1)
+    return assignments
+
+
+def train_centroids(
+    vectors: np.ndarray,
+    nlist: int,
+    iterations: int = TRAIN_ITERATIONS,
+    seed: int = 0,
+) -> np.ndarray:
+    """Spherical k-means centroids of the normalized vectors"""
+    rng = np.random.default_rng(seed)
+    sample_size = min(len(vectors), nlist * TRAIN_SAMPLE_PER_LIST)
+    sample = np.asarray(
+        vectors[np.sort(rng.choice(len(vectors), sample_size, replace=False))]
+    )
+    centroids = sample[rng.choice(sample_size, nlist, replace=False)]
+    for _ in range(iterations):
+        assignments = assign(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, sample)
+        # lists left empty restart from a random vector
+        empty = np.flatnonzero(np.bincount(assignments, minlength=nlist) == 0)
+        sums[empty] = sample[rng.choice(sample_size, len(empty), replace=False)]
+        centroids = normalize(sums)
+    return centroids
+
+
+class IvfVectorStore(NumpyVectorStore):
+    """NumpyVectorStore with an IVF index, see the module docstring"""
+
+    def __init__(
+        self,
+        path: str,
+        nlist: int = 256,
+        nprobe: int = 8,
+        min_train_size: Optional[int] = None,
+        mmap: bool = False,
+        initial_capacity: int = 1024,
+        quantization: Optional[QUANTIZATION_TYPE] = None,
+        rerank: int = 4,
+        journal_ratio: float = 0.25,
+    ):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_train_size = min_train_size or nlist * MIN_VECTORS_PER_LIST
+        super().__init__(
+            path,
+            mmap=mmap,
+            initial_capacity=initial_capacity,
+            quantization=quantization,
+            rerank=rerank,
+            journal_ratio=journal_ratio,
+        )
+        with self._lock:
+            self._train_if_needed()
+
+    @property
+    def trained(self) -> bool:
+        return self._centroids is not None
+
+    def _reset(self):
+        super()._reset()
+        self._centroids: Optional[np.ndarray] = None
+        self._assignments = np.empty(0, dtype=np.int32)
+        self._trained_size = 0
+        # rows of each list, built on the first query after a change
+        self._lists: Optional[List[np.ndarray]] = None
+
+    def train(self):
+        """Train the centroids on the current vectors and assign every row"""
+        with self._lock:
+            vectors = self._vectors(slice(0, self._size))
+            self._centroids = train_centroids(vectors, min(self.nlist, self._size))
+            self._assignments[: self._size] = assign(vectors, self._centroids)
+            self._trained_size = self._size
+            self._lists = None
+            self._dirty = True
+            # every assignment changed, written by a compaction
+            self._compact = True
+            logger.info(
+                f"{self.path}: trained {len(self._centroids)} lists on {self._size} vectors"
+            )
+
+    def _train_if_needed(self):
+        if self._size < self.min_train_size:
+            return
+        if not self.trained or self._size >= 2 * self._trained_size:
+            self.train()
+
+    def _reserve(self, count: int, dim: int):
+        super()._reserve(count, dim)
+        if len(self._assignments) < self._capacity:
+            assignments = np.zeros(self._capacity, dtype=np.int32)
+            assignments[: self._size] = self._assignments[: self._size]
+            self._assignments = assignments
+
+    def _rows_added(self, start: int, vectors: np.ndarray):
+        self._lists = None
+        if self.trained:
+            end = start + len(vectors)
+            self._assignments[start:end] = assign(vectors, self._centroids)
+        self._train_if_needed()
+
+    def _delete_rows(self, rows: List[int]):
+        self._lists = None
+        super()._delete_rows(rows)
+
+    def _move_row(self, source: int, target: int):
+        super()._move_row(source, target)
+        self._assignments[target] = self._assignments[source]
+
+    def _list_rows(self) -> List[np.ndarray]:
+        if self._lists is None:
+            assignments = self._assignments[: self._size]
+            order = np.argsort(assignments, kind="stable")
+            counts = np.bincount(assignments, minlength=len(self._centroids))
+            self._lists = np.split(order, np.cumsum(counts)[:-1])
+        return self._lists
+
+    def _candidate_rows(
+        self, query: VectorStoreQuery, vector: np.ndarray
+    ) -> Optional[np.ndarray]:
+        rows = super()._candidate_rows(query, vector)
+        if not self.trained or self.nprobe >= len(self._centroids):
+            return rows
+        lists = self._list_rows()
+        probes = top_k(self._centroids @ vector, self.nprobe)
+        probed = np.concatenate([lists[probe] for probe in probes])
+        return probed if rows is None else np.intersect1d(rows, probed)
+
+    def _write_generation(self, directory: str):
+        super()._write_generation(directory)
+        if not self.trained:
+            return
+        write_file(
+            os.path.join(directory, CENTROIDS_FILE),
+            lambda f: np.save(f, self._centroids),
+        )
+        write_file(
+            os.path.join(directory, ASSIGNMENTS_FILE),
+            lambda f: np.save(f, self._assignments[: self._size]),
+        )
+        write_file(
+            os.path.join(directory, IVF_FILE),
+            lambda f: f.write(
+                json.dumps(dict(trained_size=self._trained_size)).encode()
+            ),
+        )
+
+    def _read_generation(self, directory: str):
+        super()._read_generation(directory)
+        self._assignments = np.zeros(len(self._matrix), dtype=np.int32)
+        centroids_path = os.path.join(directory, CENTROIDS_FILE)
+        if not os.path.exists(centroids_path):
+            # stores written by NumpyVectorStore are trained on load
+            return
+        centroids = np.load(centroids_path)
+        with open(os.path.join(directory, IVF_FILE), "r") as f:
+            trained_size = json.load(f)["trained_size"]
+        if len(centroids) != min(self.nlist, trained_size):
+            logger.info(f"{directory}: nlist changed, the lists are trained again")
+            return
+        self._centroids = centroids
+        self._assignments[: self._size] = np.load(
+            os.path.join(directory, ASSIGNMENTS_FILE)
+        )
+        self._trained_size = trained_size
@@ -0,0 +1,811 @@
+"""
+In-process vector store on a NumPy matrix.
+
+Embeddings are kept L2 normalized in one contiguous float32 matrix, so a cosine
+query is a single matrix-vector product and the top-k comes from argpartition.
+The matrix grows by doubling its capacity and deletes move the last row into
+the freed one, keeping it contiguous. Nodes are kept as their JSON next to it.
+
+On disk a generation directory holds the matrix and the nodes (vectors.npy +
+nodes.jsonl) and a journal.jsonl of the adds and deletes persisted since it was
+written. A persist appends its changes to the journal, so saving a few memories
+costs their rows and not the whole store, and once the journal holds more than
+journal_ratio times the rows of the store (or the IVF lists were trained again) it
+is compacted: a new generation is written and the CURRENT pointer file swapped to it
+with os.replace, so readers always load a complete generation. A journal line cut by
+a crash is dropped on the next load.
+
+Writers hold an exclusive lock on the LOCK file of the store: when another process
+(load_docs, another worker) persisted since this one loaded or persisted, its
+generation and journal are loaded and the changes made here are replayed on them
+before writing, instead of overwriting them with a stale copy. Queries first compare
+the CURRENT pointer and the journal size with the ones loaded and catch up the same
+way, reading only the new journal entries when the generation is the same and
+nothing is pending here.
+
+With mmap the matrix of the current generation stays memory mapped read-only: added
+rows go to a tail matrix in memory and each row of the store points to its source, a
+row of the mapped matrix or of the tail, so writes never copy the mapped matrix and
+deletes only move sources. Deleted and replaced rows are still scanned by the queries
+without quantization until the next compaction maps the new generation.
+
+With quantization (float16 or int8, see quantization.py) queries scan a quantized
+copy of the matrix held in memory, and the rerank * top-k best candidates are
+re-scored on the float32 matrix, which is then always memory mapped: only the
+pages of the candidates are read.
+"""
+import base64
+import fcntl
+import json
+import logging
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+from time import time_ns
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+from llama_index.schema import TextNode
+from llama_index.vector_stores.types import (
+    NodeWithEmbedding,
+    VectorStore,
+    VectorStoreQuery,
+    VectorStoreQueryMode,
+    VectorStoreQueryResult,
+)
+
+from expert_gpts.embeddings.vector_stores.quantization import (
+    CODE_DTYPES,
+    QUANTIZATION_TYPE,
+    encode,
+    scores,
+)
+
+logger = logging.getLogger(__name__)
+
+CURRENT_FILE = "CURRENT"
+LOCK_FILE = "LOCK"
+VECTORS_FILE = "vectors.npy"
+NODES_FILE = "nodes.jsonl"
+JOURNAL_FILE = "journal.jsonl"
+CODES_FILE = "codes.npy"
+SCALES_FILE = "scales.npy"
+# rows quantized at once when the codes are built from the matrix
+ENCODE_BATCH_SIZE = 65536
+# rows copied at once when a generation is written, mapped ones are read in batches
+WRITE_BATCH_SIZE = 8192
+# journal entries always allowed before a compaction, small stores included
+JOURNAL_MIN_ENTRIES = 1024
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """L2 normalized float32 rows, zero vectors stay zero"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, np.finfo(np.float32).tiny)
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Positions of the k highest scores, best first"""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < len(scores):
+        positions = np.argpartition(-scores, k - 1)[:k]
+    else:
+        positions = np.arange(len(scores))
+    return positions[np.argsort(-scores[positions], kind="stable")]
+
+
+def write_file(path: str, write):
+    with open(path, "wb") as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+@contextmanager
+def file_lock(path: str):
+    """Exclusive lock of the store directory, shared by the processes using it"""
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, LOCK_FILE), "a") as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class NumpyVectorStore(VectorStore):
+    """Local VectorStore of llama index, see the module docstring"""
+
+    stores_text: bool = True
+    is_embedding_query: bool = True
+
+    def __init__(
+        self,
+        path: str,
+        mmap: bool = False,
+        initial_capacity: int = 1024,
+        quantization: Optional[QUANTIZATION_TYPE] = None,
+        rerank: int = 4,
+        journal_ratio: float = 0.25,
+    ):
+        self.path = path
+        self.quantization = quantization
+        self.rerank = rerank
+        self.journal_ratio = journal_ratio
+        # the float32 matrix is only read by the re-rank, the OS pages it in
+        self.mmap = mmap or quantization is not None
+        self.initial_capacity = initial_capacity
+        self._lock = threading.RLock()
+        self._reset()
+        self._dirty = False
+        # generation and journal the matrix was loaded from or written to
+        self._generation: Optional[str] = None
+        self._journal_size = 0
+        self._journal_entries = 0
+        # ("add", node_id) and ("delete", ref_doc_id) since then
+        self._pending: List[Tuple[str, str]] = []
+        # changes the journal cannot hold, like the IVF lists trained again
+        self._compact = False
+        self.load()
+
+    @property
+    def client(self) -> Any:
+        return self
+
+    @property
+    def dim(self) -> int:
+        if self.mmap and not len(self._matrix):
+            return self._tail.shape[1]
+        return self._matrix.shape[1]
+
+    @property
+    def _capacity(self) -> int:
+        """Rows the store can hold before growing"""
+        return len(self._sources) if self._sources is not None else len(self._matrix)
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes of the matrix scanned by the queries, the quantized one if any"""
+        if self.quantization is None:
+            return self._size * self.dim * np.dtype(np.float32).itemsize
+        scales = self._scales[: self._size].nbytes if self._scales is not None else 0
+        return self._codes[: self._size].nbytes + scales
+
+    @property
+    def size(self) -> int:
+        # no __len__, llama index takes empty stores as falsy and swaps them
+        return self._size
+
+    def add(self, embedding_results: List[NodeWithEmbedding]) -> List[str]:
+        if not embedding_results:
+            return []
+        vectors = normalize([result.embedding for result in embedding_results])
+        with self._lock:
+            if self._size and vectors.shape[1] != self.dim:
+                raise ValueError(
+                    f"Embeddings of {vectors.shape[1]} dimensions, "
+                    f"the store has {self.dim}"
+                )
+            self._insert(
+                [result.node.node_id for result in embedding_results],
+                [result.node.ref_doc_id or "None" for result in embedding_results],
+                [
+                    result.node.json(exclude={"embedding"})
+                    for result in embedding_results
+                ],
+                vectors,
+            )
+            self._pending.extend(("add", result.id) for result in embedding_results)
+            self._dirty = True
+        return [result.id for result in embedding_results]
+
+    def _insert(
+        self,
+        node_ids: List[str],
+        ref_doc_ids: List[str],
+        records: List[str],
+        vectors: np.ndarray,
+    ):
+        """Append normalized rows, re-added nodes replace the previous version"""
+        last = {node_id: position for position, node_id in enumerate(node_ids)}
+        if len(last) < len(node_ids):
+            # a node added twice in the batch, as replayed from the journal
+            keep = sorted(last.values())
+            node_ids = [node_ids[position] for position in keep]
+            ref_doc_ids = [ref_doc_ids[position] for position in keep]
+            records = [records[position] for position in keep]
+            vectors = vectors[keep]
+        for node_id in node_ids:
+            if node_id in self._rows:
+                self._delete_rows([self._rows[node_id]])
+        self._reserve(len(vectors), vectors.shape[1])
+        start = self._size
+        self._write_rows(start, vectors)
+        if self.quantization is not None:
+            self._encode_rows(start, vectors)
+        for node_id, ref_doc_id, record in zip(node_ids, ref_doc_ids, records):
+            self._append_row(node_id, ref_doc_id, record)
+        self._rows_added(start, vectors)
+
+    def _append_row(self, node_id: str, ref_doc_id: str, record: str):
+        self._rows[node_id] = self._size
+        self._ids.append(node_id)
+        self._ref_doc_ids.append(ref_doc_id)
+        self._records.append(record)
+        self._doc_nodes.setdefault(ref_doc_id, set()).add(node_id)
+        self._size += 1
+
+    def _rows_added(self, start: int, vectors: np.ndarray):
+        """Called with the rows written from start, for the stores indexing them"""
+        pass
+
+    def _reserve(self, count: int, dim: int):
+        """Grow the matrix capacity, doubling it to amortize the copies"""
+        needed = self._size + count
+        if self.mmap:
+            self._reserve_mapped(needed, count, dim)
+        elif needed > len(self._matrix):
+            capacity = max(needed, 2 * len(self._matrix), self.initial_capacity)
+            matrix = np.empty((capacity, dim), dtype=np.float32)
+            if self._size:
+                matrix[: self._size] = self._matrix[: self._size]
+            self._matrix = matrix
+        if self.quantization is not None and (
+            self._codes is None or len(self._codes) < self._capacity
+        ):
+            self._grow_codes(self._capacity, dim)
+
+    def _reserve_mapped(self, needed: int, count: int, dim: int):
+        """Grow the sources of the rows and the tail, the mapped matrix stays as is"""
+        if self._sources is None or needed > len(self._sources):
+            capacity = max(needed, 2 * self._capacity, self.initial_capacity)
+            sources = np.empty(capacity, dtype=np.int64)
+            if self._sources is None:
+                sources[: self._size] = np.arange(self._size)
+            else:
+                sources[: self._size] = self._sources[: self._size]
+            self._sources = sources
+        tail_needed = self._tail_size + count
+        if tail_needed > len(self._tail):
+            capacity = max(tail_needed, 2 * len(self._tail), self.initial_capacity)
+            tail = np.empty((capacity, dim), dtype=np.float32)
+            if self._tail_size:
+                tail[: self._tail_size] = self._tail[: self._tail_size]
+            self._tail = tail
+
+    def _write_rows(self, start: int, vectors: np.ndarray):
+        end = start + len(vectors)
+        if not self.mmap:
+            self._matrix[start:end] = vectors
+            return
+        tail_start, tail_end = self._tail_size, self._tail_size + len(vectors)
+        self._tail[tail_start:tail_end] = vectors
+        mapped = len(self._matrix)
+        self._sources[start:end] = np.arange(mapped + tail_start, mapped + tail_end)
+        self._tail_size = tail_end
+
+    def _vectors(self, rows) -> np.ndarray:
+        """Float32 vectors of the rows, a slice or positions"""
+        if self._sources is None:
+            return self._matrix[rows]
+        sources = self._sources[: self._size][rows]
+        vectors = np.empty((len(sources), self.dim), dtype=np.float32)
+        mapped = sources < len(self._matrix)
+        if mapped.any():
+            vectors[mapped] = self._matrix[sources[mapped]]
+        if not mapped.all():
+            vectors[~mapped] = self._tail[sources[~mapped] - len(self._matrix)]
+        return vectors
+
+    def _similarities(self, vector: np.ndarray) -> np.ndarray:
+        """Dot products of the vector with every row"""
+        if self._sources is None:
+            return self._matrix[: self._size] @ vector
+        mapped = len(self._matrix)
+        similarities = np.empty(mapped + self._tail_size, dtype=np.float32)
+        if mapped:
+            similarities[:mapped] = self._matrix @ vector
+        if self._tail_size:
+            similarities[mapped:] = self._tail[: self._tail_size] @ vector
+        return similarities[self._sources[: self._size]]
+
+    def _grow_codes(self, capacity: int, dim: int):
+        codes = np.empty((capacity, dim), dtype=CODE_DTYPES[self.quantization])
+        scales = (
+            np.empty(capacity, dtype=np.float32)
+            if self.quantization == "int8"
+            else None
+        )
+        if self._size and self._codes is not None:
+            codes[: self._size] = self._codes[: self._size]
+            if scales is not None:
+                scales[: self._size] = self._scales[: self._size]
+        self._codes, self._scales = codes, scales
+
+    def _encode_rows(self, start: int, vectors: np.ndarray):
+        codes, scales = encode(vectors, self.quantization)
+        end = start + len(vectors)
+        self._codes[start:end] = codes
+        if scales is not None:
+            self._scales[start:end] = scales
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        with self._lock:
+            if self._delete_doc(ref_doc_id):
+                self._pending.append(("delete", ref_doc_id))
+                self._dirty = True
+
+    def _delete_doc(self, ref_doc_id: str) -> bool:
+        node_ids = self._doc_nodes.get(ref_doc_id)
+        if not node_ids:
+            return False
+        self._delete_rows([self._rows[node_id] for node_id in node_ids])
+        return True
+
+    def _delete_rows(self, rows: List[int]):
+        """
+        Move the last row into each deleted one, highest first so the moved row is
+        never one still to delete.
+        """
+        self._reserve(0, self.dim)
+        for row in sorted(rows, reverse=True):
+            node_id, ref_doc_id = self._ids[row], self._ref_doc_ids[row]
+            del self._rows[node_id]
+            doc_nodes = self._doc_nodes[ref_doc_id]
+            doc_nodes.discard(node_id)
+            if not doc_nodes:
+                del self._doc_nodes[ref_doc_id]
+
+            last = self._size - 1
+            if row != last:
+                self._move_row(last, row)
+            self._ids.pop()
+            self._ref_doc_ids.pop()
+            self._records.pop()
+            self._size = last
+
+    def _move_row(self, source: int, target: int):
+        if self.mmap:
+            self._sources[target] = self._sources[source]
+        else:
+            self._matrix[target] = self._matrix[source]
+        if self.quantization is not None:
+            self._codes[target] = self._codes[source]
+            if self._scales is not None:
+                self._scales[target] = self._scales[source]
+        self._ids[target] = self._ids[source]
+        self._ref_doc_ids[target] = self._ref_doc_ids[source]
+        self._records[target] = self._records[source]
+        self._rows[self._ids[target]] = target
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        if query.mode != VectorStoreQueryMode.DEFAULT:
+            raise ValueError(f"NumpyVectorStore does not support {query.mode} queries")
+        if query.query_embedding is None:
+            raise ValueError("NumpyVectorStore needs the query embedding")
+        vector = normalize(query.query_embedding)
+        with self._lock:
+            if self._changed():
+                with file_lock(self.path):
+                    self._catch_up()
+            if not self._size:
+                return VectorStoreQueryResult(nodes=[], similarities=[], ids=[])
+            rows = self._candidate_rows(query, vector)
+            if self.quantization is not None:
+                rows = self._rerank_candidates(rows, vector, query.similarity_top_k)
+            if rows is None:
+                similarities = self._similarities(vector)
+                selected = top_k(similarities, query.similarity_top_k)
+                rows = selected
+            else:
+                similarities = self._vectors(rows) @ vector
+                selected = top_k(similarities, query.similarity_top_k)
+                rows = rows[selected]
+            records = [self._records[row] for row in rows]
+            ids = [self._ids[row] for row in rows]
+        return VectorStoreQueryResult(
+            nodes=[TextNode.parse_raw(record) for record in records],
+            similarities=similarities[selected].tolist(),
+            ids=ids,
+        )
+
+    def _rerank_candidates(
+        self, rows: Optional[np.ndarray], vector: np.ndarray, k: int
+    ) -> np.ndarray:
+        """Best rows on the quantized matrix, sorted to read the mapped one in order"""
+        if rows is None:
+            codes, scales = self._codes[: self._size], self._scales
+        else:
+            codes = self._codes[rows]
+            scales = self._scales[rows] if self._scales is not None else None
+        candidates = top_k(scores(codes, scales, vector), k * self.rerank)
+        return np.sort(candidates if rows is None else rows[candidates])
+
+    def _candidate_rows(
+        self, query: VectorStoreQuery, vector: np.ndarray
+    ) -> Optional[np.ndarray]:
+        """Rows allowed by the doc_ids, node_ids and metadata filters, None for all"""
+        if not (query.doc_ids or query.node_ids or query.filters):
+            return None
+        rows = range(self._size)
+        if query.doc_ids:
+            doc_ids = set(query.doc_ids)
+            rows = [row for row in rows if self._ref_doc_ids[row] in doc_ids]
+        if query.node_ids:
+            rows = [
+                self._rows[node_id]
+                for node_id in query.node_ids
+                if node_id in self._rows
+            ]
+        if query.filters:
+            expected = {f.key: f.value for f in query.filters.filters}
+            rows = [
+                row
+                for row in rows
+                if all(
+                    json.loads(self._records[row])["metadata"].get(key) == value
+                    for key, value in expected.items()
+                )
+            ]
+        return np.asarray(sorted(rows), dtype=np.int64)
+
+    def load(self):
+        """Load the current generation of path, if any, dropping the unsaved changes"""
+        if not os.path.exists(os.path.join(self.path, CURRENT_FILE)):
+            return
+        with self._lock, file_lock(self.path):
+            generation = self._current_generation()
+            if generation is None:
+                return
+            self._read(generation)
+            self._pending = []
+            self._dirty = False
+
+    def _read(self, generation: Optional[str]):
+        """Load a generation and replay its journal, with the file lock held"""
+        self._journal_size = self._journal_entries = 0
+        if generation is None:
+            self._reset()
+        else:
+            directory = os.path.join(self.path, generation)
+            self._read_generation(directory)
+            self._read_journal(directory)
+        self._generation = generation
+
+    def _read_journal(self, directory: str):
+        """Replay the journal entries after the ones already read"""
+        path = os.path.join(directory, JOURNAL_FILE)
+        try:
+            with open(path, "rb") as f:
+                f.seek(self._journal_size)
+                data = f.read()
+        except FileNotFoundError:
+            data = b""
+        size = data.rfind(b"\n") + 1
+        if size < len(data):
+            logger.warning(f"{path}: dropping {len(data) - size} bytes of a cut entry")
+            os.truncate(path, self._journal_size + size)
+        entries = [
+            self._decode_entry(json.loads(line)) for line in data[:size].splitlines()
+        ]
+        self._apply(entries)
+        self._journal_size += size
+        self._journal_entries += len(entries)
+
+    def _changed(self) -> bool:
+        """Whether another process persisted since this one loaded or persisted"""
+        current = self._current_generation()
+        return (current, self._journal_stat(current)) != (
+            self._generation,
+            self._journal_size,
+        )
+
+    def _catch_up(self, entries: Optional[List[tuple]] = None):
+        """
+        Load what other processes persisted and replay the pending changes on it,
+        with the file lock held.
+
+        :param entries: the pending entries, when already built
+        :return:
+        """
+        if not self._changed():
+            return
+        current = self._current_generation()
+        if (
+            current is not None
+            and current == self._generation
+            and not self._pending
+            and self._journal_stat(current) > self._journal_size
+        ):
+            self._read_journal(os.path.join(self.path, current))
+            return
+        if entries is None:
+            entries = self._pending_entries()
+        logger.info(
+            f"{self.path}: {current} changed by another process since "
+            f"{self._generation}, replaying {len(entries)} changes on it"
+        )
+        self._read(current)
+        self._apply(entries)
+
+    def _journal_stat(self, generation: Optional[str]) -> int:
+        if generation is None:
+            return 0
+        try:
+            return os.path.getsize(os.path.join(self.path, generation, JOURNAL_FILE))
+        except FileNotFoundError:
+            return 0
+
+    def _pending_entries(self) -> List[tuple]:
+        """
+        The pending changes with the rows of the added nodes, ("delete", ref_doc_id)
+        and ("add", node_id, ref_doc_id, record, vector). Nodes deleted since they
+        were added are left out, their delete follows.
+        """
+        pending = [
+            (op, value)
+            for op, value in self._pending
+            if op == "delete" or value in self._rows
+        ]
+        rows = [self._rows[value] for op, value in pending if op == "add"]
+        vectors = iter(self._vectors(np.asarray(rows, dtype=np.int64)))
+        entries = []
+        for op, value in pending:
+            if op == "delete":
+                entries.append((op, value))
+            else:
+                row = self._rows[value]
+                entries.append(
+                    (
+                        op,
+                        value,
+                        self._ref_doc_ids[row],
+                        self._records[row],
+                        np.array(next(vectors), dtype=np.float32),
+                    )
+                )
+        return entries
+
+    def _apply(self, entries: List[tuple]):
+        """Replay journal entries, consecutive adds in one insert"""
+        adds: List[tuple] = []
+        for entry in entries + [("delete", None)]:
+            if entry[0] == "add":
+                adds.append(entry)
+                continue
+            if adds:
+                self._insert(
+                    [add[1] for add in adds],
+                    [add[2] for add in adds],
+                    [add[3] for add in adds],
+                    np.stack([add[4] for add in adds]),
+                )
+                adds = []
+            if entry[1] is not None:
+                self._delete_doc(entry[1])
+
+    @staticmethod
+    def _encode_entry(entry: tuple) -> bytes:
+        if entry[0] == "delete":
+            line = dict(op="delete", ref_doc_id=entry[1])
+        else:
+            _, node_id, ref_doc_id, record, vector = entry
+            line = dict(
+                op="add",
+                id=node_id,
+                ref_doc_id=ref_doc_id,
+                node=record,
+                vector=base64.b64encode(vector.astype("<f4").tobytes()).decode(),
+            )
+        return json.dumps(line).encode("utf-8") + b"\n"
+
+    @staticmethod
+    def _decode_entry(line: dict) -> tuple:
+        if line["op"] == "delete":
+            return "delete", line["ref_doc_id"]
+        vector = np.frombuffer(base64.b64decode(line["vector"]), dtype="<f4")
+        return "add", line["id"], line["ref_doc_id"], line["node"], vector
+
+    def _read_generation(self, directory: str):
+        matrix = np.load(
+            os.path.join(directory, VECTORS_FILE),
+            mmap_mode="r" if self.mmap else None,
+        )
+        self._reset()
+        self._matrix = matrix
+        with open(os.path.join(directory, NODES_FILE), "r") as f:
+            for line in f:
+                entry = json.loads(line)
+                self._rows[entry["id"]] = self._size
+                self._ids.append(entry["id"])
+                self._ref_doc_ids.append(entry["ref_doc_id"])
+                self._records.append(entry["node"])
+                self._doc_nodes.setdefault(entry["ref_doc_id"], set()).add(entry["id"])
+                self._size += 1
+        if self._size != len(matrix):
+            raise ValueError(
+                f"{directory} has {len(matrix)} vectors and {self._size} nodes"
+            )
+        if self.quantization is not None:
+            self._read_codes(directory)
+
+    def _read_codes(self, directory: str):
+        """Codes of the generation, built from the matrix when missing or of another type"""
+        codes_path = os.path.join(directory, CODES_FILE)
+        scales_path = os.path.join(directory, SCALES_FILE)
+        if os.path.exists(codes_path):
+            codes = np.load(codes_path)
+            scales = np.load(scales_path) if os.path.exists(scales_path) else None
+            expected_scales = self.quantization == "int8"
+            if (
+                codes.dtype == CODE_DTYPES[self.quantization]
+                and len(codes) == self._size
+                and (scales is not None) == expected_scales
+            ):
+                self._codes, self._scales = codes, scales
+                return
+        logger.info(
+            f"{directory}: quantizing {self._size} vectors to {self.quantization}"
+        )
+        self._grow_codes(len(self._matrix), self._matrix.shape[1])
+        for start in range(0, self._size, ENCODE_BATCH_SIZE):
+            end = min(start + ENCODE_BATCH_SIZE, self._size)
+            self._encode_rows(start, self._matrix[start:end])
+
+    def persist(self, persist_path: Optional[str] = None, fs: Any = None) -> None:
+        """
+        Append the changes to the journal, or compact the store into a new generation,
+        no-op when nothing changed.
+
+        :param persist_path: directory of the store, the path of the store by default,
+            another one gets a copy of the store in a new generation
+        :param fs: unused, only local directories
+        :return:
+        """
+        path = persist_path or self.path
+        with self._lock, file_lock(path):
+            if path != self.path:
+                self._publish(path)
+                return
+            if not self._dirty:
+                return
+            entries = self._pending_entries()
+            self._catch_up(entries)
+            if self._needs_compaction(len(entries)):
+                self._compact_generation()
+            else:
+                self._append_journal(entries)
+            self._pending = []
+            self._dirty = False
+
+    def _needs_compaction(self, new_entries: int) -> bool:
+        if self._generation is None or self._compact or self.journal_ratio <= 0:
+            return True
+        entries = self._journal_entries + new_entries
+        return entries > max(JOURNAL_MIN_ENTRIES, self.journal_ratio * self._size)
+
+    def _compact_generation(self):
+        generation = self._publish(self.path)
+        self._generation = generation
+        self._journal_size = self._journal_entries = 0
+        self._compact = False
+        if self.mmap:
+            # drop the tail and the sources, map what was just written
+            self._matrix = np.load(
+                os.path.join(self.path, generation, VECTORS_FILE), mmap_mode="r"
+            )
+            self._tail = np.empty((0, 0), dtype=np.float32)
+            self._tail_size = 0
+            self._sources = None
+
+    def _append_journal(self, entries: List[tuple]):
+        data = b"".join(self._encode_entry(entry) for entry in entries)
+        path = os.path.join(self.path, self._generation, JOURNAL_FILE)
+        with open(path, "ab") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        self._journal_size += len(data)
+        self._journal_entries += len(entries)
+
+    def _publish(self, path: str) -> str:
+        """Write a new generation under path and point CURRENT to it"""
+        generation = f"g{time_ns()}"
+        directory = os.path.join(path, generation)
+        partial = f"{directory}.partial"
+        os.makedirs(partial)
+        self._write_generation(partial)
+        os.replace(partial, directory)
+        current = os.path.join(path, CURRENT_FILE)
+        write_file(f"{current}.partial", lambda f: f.write(generation.encode()))
+        os.replace(f"{current}.partial", current)
+        self._remove_generations(path, keep=generation)
+        return generation
+
+    def _write_generation(self, directory: str):
+        write_file(os.path.join(directory, VECTORS_FILE), self._save_vectors)
+        if self.quantization is not None:
+            write_file(
+                os.path.join(directory, CODES_FILE),
+                lambda f: np.save(f, self._codes[: self._size]),
+            )
+            if self._scales is not None:
+                write_file(
+                    os.path.join(directory, SCALES_FILE),
+                    lambda f: np.save(f, self._scales[: self._size]),
+                )
+        write_file(
+            os.path.join(directory, NODES_FILE),
+            lambda f: f.writelines(
+                json.dumps(dict(id=node_id, ref_doc_id=ref_doc_id, node=record)).encode(
+                    "utf-8"
+                )
+                + b"\n"
+                for node_id, ref_doc_id, record in zip(
+                    self._ids, self._ref_doc_ids, self._records
+                )
+            ),
+        )
+
+    def _save_vectors(self, f):
+        """np.save of the float32 rows, in batches not to copy the mapped ones at once"""
+        header = dict(
+            descr=np.lib.format.dtype_to_descr(np.dtype(np.float32)),
+            fortran_order=False,
+            shape=(self._size, self.dim),
+        )
+        np.lib.format.write_array_header_1_0(f, header)
+        for start in range(0, self._size, WRITE_BATCH_SIZE):
+            end = min(start + WRITE_BATCH_SIZE, self._size)
+            f.write(np.ascontiguousarray(self._vectors(slice(start, end))).tobytes())
+
+    def _current_generation(self) -> Optional[str]:
+        try:
+            with open(os.path.join(self.path, CURRENT_FILE), "r") as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def _remove_generations(path: str, keep: Optional[str]):
+        """Old and partial generations, a mapped old matrix stays readable until closed"""
+        for name in os.listdir(path):
+            entry = os.path.join(path, name)
+            if name != keep and name.startswith("g") and os.path.isdir(entry):
+                shutil.rmtree(entry, ignore_errors=True)
+
+    def delete_index(self):
+        """Delete every node, in memory and on disk"""
+        with self._lock, file_lock(self.path):
+            self._reset()
+            self._dirty = False
+            self._generation = None
+            self._journal_size = self._journal_entries = 0
+            self._pending = []
+            # the LOCK file stays, other processes may be waiting on it
+            current = os.path.join(self.path, CURRENT_FILE)
+            if os.path.exists(current):
+                os.remove(current)
+            self._remove_generations(self.path, keep=None)
+
+    def _reset(self):
+        self._matrix = np.empty((0, 0), dtype=np.float32)
+        self._size = 0
+        # with mmap, rows added since the matrix was mapped and the source of each
+        # row, a mapped row or len(matrix) + a tail row, None while rows are mapped 1:1
+        self._tail = np.empty((0, 0), dtype=np.float32)
+        self._tail_size = 0
+        self._sources: Optional[np.ndarray] = None
+        # quantized matrix and int8 scales, row aligned with the matrix
+        self._codes: Optional[np.ndarray] = None
+        self._scales: Optional[np.ndarray] = None
+        # row aligned with the matrix
+        self._ids: List[str] = []
+        self._ref_doc_ids: List[str] = []
+        self._records: List[str] = []
+        self._rows: Dict[str, int] = {}
+        self._doc_nodes: Dict[str, Set[str]] = {}
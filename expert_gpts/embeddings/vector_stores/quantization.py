@@ -0,0 +1,48 @@
+"""
+Scalar quantization of the normalized vectors of the numpy stores:
+
+- float16: half precision copy, 2 bytes per dimension
+- int8: int8 codes of each vector divided by its own scale (max abs / 127) and the
+  float32 scale, 1 byte per dimension plus 4 per vector
+
+Scores of the quantized vectors are approximate, the stores re-rank their best
+candidates on the float32 vectors.
+"""
+from typing import Literal, Optional, Tuple
+
+import numpy as np
+
+QUANTIZATION_TYPE = Literal["float16", "int8"]
+CODE_DTYPES = {"float16": np.float16, "int8": np.int8}
+
+# rows converted to float32 at once by the scans, small enough to stay in cache
+SCORE_BATCH_SIZE = 1024
+
+
+def encode(
+    vectors: np.ndarray, quantization: QUANTIZATION_TYPE
+) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """Codes and per-vector scales (None for float16) of float32 vectors"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if quantization == "float16":
+        return vectors.astype(np.float16), None
+    scales = np.abs(vectors).max(axis=1) / 127
+    scales[scales == 0] = 1
+    codes = np.rint(vectors / scales[:, None]).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def scores(
+    codes: np.ndarray,
+    scales: Optional[np.ndarray],
+    vector: np.ndarray,
+    batch_size: int = SCORE_BATCH_SIZE,
+) -> np.ndarray:
+    """Approximate dot products of the query vector with the quantized rows"""
+    result = np.empty(len(codes), dtype=np.float32)
+    for start in range(0, len(codes), batch_size):
+        end = start + batch_size
+        result[start:end] = codes[start:end].astype(np.float32) @ vector
+    if scales is not None:
+        result *= scales[: len(codes)]
+    return result
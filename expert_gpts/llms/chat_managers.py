@@ -10,26 +10,33 @@ from langchain.prompts import ChatPromptTemplate
 from langchain.prompts.chat import SystemMessage
 from langchain.schema import BaseChatMessageHistory
 
-from expert_gpts.chat_history.mysql import MysqlChatMessageHistory
+from expert_gpts.chat_history.mysql import (
+    MysqlChatMessageHistory,
+    get_message_cache,
+    get_write_behind_writer,
+)
 from expert_gpts.database import get_db_session
 from expert_gpts.embeddings.base import EmbeddingsHandlerBase
 from shared.config import ExpertItem
 from shared.llm_manager_base import BaseLLMManager
-from shared.llms.system_prompts import (
-    CHAT_HUMAN_PROMPT_TEMPLATE,
-    CHAT_SYSTEM_PROMPT_STANDALONE_QUESTION,
-)
+from shared.llms import system_prompts
 
 DEFAULT_EXPERT_CONFIG = ExpertItem()
+STANDALONE_QUESTION_HISTORY_SIZE = 5
 
 logger = logging.getLogger(__name__)
 
 
 @lru_cache
-def get_history(session_id, ai_key):
+def get_history(session_id, ai_key, window: Optional[int] = None):
     with get_db_session() as session:
         return MysqlChatMessageHistory(
-            session_id=session_id, session=session, ai_key=ai_key
+            session_id=session_id,
+            session=session,
+            ai_key=ai_key,
+            writer=get_write_behind_writer(),
+            window=window,
+            cache=get_message_cache(),
         )
 
 
@@ -83,7 +90,11 @@ class SingleChatManager:
         self.expert_key = expert_key
         self.llm_manager = llm_manager
         self.session_id = session_id
-        self.history = history if history else get_history(session_id, expert_key)
+        self.history = (
+            history
+            if history
+            else get_history(session_id, expert_key, expert_config.history_window)
+        )
         self.memory = (
             memory
             if memory
@@ -110,7 +121,7 @@ class SingleChatManager:
         if self.create_standalone_question_to_search_context:
             search_context_question = get_standalone_question(
                 question,
-                self.history.messages[:5],
+                self.history.get_last_messages(STANDALONE_QUESTION_HISTORY_SIZE),
                 self.llm_manager,
                 self.expert_config.temperature,
                 self.expert_config.max_tokens,
@@ -120,7 +131,11 @@ class SingleChatManager:
         context = ""
         if self.embeddings and self.query_embeddings_before_ask:
             try:
-                context = self.embeddings.search(search_context_question).response
+                context = self.embeddings.get_context(
+                    search_context_question,
+                    self.expert_config.search_mode,
+                    self.expert_config.retrieval,
+                )
             except Exception as e:
                 logger.error("Could not query embeddings: %s", e)
 
@@ -131,7 +146,7 @@ class SingleChatManager:
                     name=f"{self.expert_key}ChatBot",
                     role="system",
                 ),
-                CHAT_HUMAN_PROMPT_TEMPLATE,
+                system_prompts.CHAT_HUMAN_PROMPT_TEMPLATE,
             ]
         )
 
@@ -271,8 +286,8 @@ def get_standalone_question(
 ):
     template = ChatPromptTemplate.from_messages(
         [
-            CHAT_SYSTEM_PROMPT_STANDALONE_QUESTION,
-            CHAT_HUMAN_PROMPT_TEMPLATE,
+            system_prompts.CHAT_SYSTEM_PROMPT_STANDALONE_QUESTION,
+            system_prompts.CHAT_HUMAN_PROMPT_TEMPLATE,
         ]
     )
     return llm_manager.create_chat_completion(
@@ -15,13 +15,8 @@ from expert_gpts.llms.chat_managers import SingleChatManager
 from expert_gpts.llms.providers.openai import OpenAIApiManager
 from shared.config import ExpertItem
 from shared.llm_manager_base import BaseLLMManager
+from shared.llms import system_prompts
 from shared.llms.openai import GPT_3_5_TURBO
-from shared.llms.system_prompts import (
-    PROMPT_ENGINEER_HUMAN_PROMPT,
-    PROMPT_ENGINEER_SYSTEM_PROMPT,
-    PROMPT_TOOL_ENGINEER_HUMAN_PROMPT,
-    PROMPT_TOOL_ENGINEER_SYSTEM_PROMPT,
-)
 from shared.patterns import Singleton
 
 AGENT_TOOL_GENERATOR_MODEL = GPT_3_5_TURBO
@@ -31,23 +26,27 @@ logger = logging.getLogger(__name__)
 
 
 class ExpertAgentManager(metaclass=Singleton):
-    tool_generator_prompt = ChatPromptTemplate.from_messages(
-        [
-            PROMPT_TOOL_ENGINEER_SYSTEM_PROMPT,
-            PROMPT_TOOL_ENGINEER_HUMAN_PROMPT,
-        ]
-    )
-
-    system_prompt_expert_prompt = ChatPromptTemplate.from_messages(
-        [
-            PROMPT_ENGINEER_SYSTEM_PROMPT,
-            PROMPT_ENGINEER_HUMAN_PROMPT,
-        ]
-    )
-
     def __init__(self, api: Optional[BaseLLMManager] = OpenAIApiManager()):
         self.api = api
 
+    @property
+    def tool_generator_prompt(self) -> ChatPromptTemplate:
+        return ChatPromptTemplate.from_messages(
+            [
+                system_prompts.PROMPT_TOOL_ENGINEER_SYSTEM_PROMPT,
+                system_prompts.PROMPT_TOOL_ENGINEER_HUMAN_PROMPT,
+            ]
+        )
+
+    @property
+    def system_prompt_expert_prompt(self) -> ChatPromptTemplate:
+        return ChatPromptTemplate.from_messages(
+            [
+                system_prompts.PROMPT_ENGINEER_SYSTEM_PROMPT,
+                system_prompts.PROMPT_ENGINEER_HUMAN_PROMPT,
+            ]
+        )
+
     def get_experts_as_agent_tools(
         self,
         experts_config: Dict[str, Optional[ExpertItem]],
@@ -147,7 +146,13 @@ class ExpertAgentManager(metaclass=Singleton):
             expert_config=expert_config,
             session_id=session_id,
             embeddings=embeddings_factory.get_expert_embeddings(
-                llm_manager, expert_key, expert_config.embeddings.__root__
+                llm_manager,
+                expert_key,
+                expert_config.embeddings.__root__,
+                vector_store=expert_config.vector_store,
+                vector_store_options=expert_config.vector_store_options,
+                embeddings_provider=expert_config.embeddings_provider,
+                chunking=expert_config.chunking,
             ),
             query_embeddings_before_ask=expert_config.query_embeddings_before_ask,
             create_standalone_question_to_search_context=expert_config.create_standalone_question_to_search_context,
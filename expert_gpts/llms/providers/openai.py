@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import logging
+import os
 from functools import lru_cache
 from typing import List, Optional
 
@@ -20,13 +21,14 @@ from langchain_experimental.plan_and_execute import (
 
 from expert_gpts.llms.agent import HUMAN_SUFFIX, SYSTEM_PREFIX, ConvoOutputCustomParser
 from shared.llm_manager_base import BaseLLMManager, Cost
+from shared.llms import system_prompts
 from shared.llms.openai import GPT_3_5_TURBO, GPT_4, TEXT_ADA_EMBEDDING
-from shared.llms.system_prompts import PLANNER_SYSTEM_PROMPT
-
-langchain.debug = True
 
 logger = logging.getLogger(__name__)
 
+# verbose langchain tracing, global to the process so only set once a manager is built
+LANGCHAIN_DEBUG = os.getenv("LANGCHAIN_DEBUG", "false").lower() in ("1", "true", "yes")
+
 COSTS = {
     GPT_3_5_TURBO: Cost(prompt=0.0015, completion=0.002),
     GPT_4: Cost(prompt=0.03, completion=0.05),
@@ -39,6 +41,8 @@ class OpenAIApiManager(BaseLLMManager):
 
     def __init__(self):
         super().__init__(COSTS)
+        if LANGCHAIN_DEBUG:
+            langchain.debug = True
 
     def get_agent_executor(
         self,
@@ -113,7 +117,9 @@ class OpenAIApiManager(BaseLLMManager):
     ) -> str:
         llm = self.get_llm(max_tokens, model, temperature)
         if agent_key not in self._agents:
-            planner = load_chat_planner(llm, system_prompt=PLANNER_SYSTEM_PROMPT)
+            planner = load_chat_planner(
+                llm, system_prompt=system_prompts.PLANNER_SYSTEM_PROMPT
+            )
             executor = load_agent_executor(llm, tools, verbose=True)
             agent = PlanAndExecute(planner=planner, executor=executor, verbose=True)
             self._agents[agent_key] = agent
@@ -1,8 +1,14 @@
 import abc
 import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
 from functools import lru_cache
+from typing import Dict, List
+
+from langchain.agents import Tool
 
 from expert_gpts.embeddings.factory import EmbeddingsHandlerFactory
+from expert_gpts.embeddings.ingestion import IngestionPlan
 from expert_gpts.llms.chat_managers import (
     ChainChatManager,
     PlannerManager,
@@ -13,10 +19,12 @@ from expert_gpts.llms.expert_agents import ExpertAgentManager
 from expert_gpts.llms.providers.openai import OpenAIApiManager
 from expert_gpts.toolkit.modules import ModuleLoader
 from shared.config import Config
-from shared.llms.system_prompts import BASE_EXPERTS
+from shared.llms import system_prompts
 
 logger = logging.getLogger(__name__)
 
+INGESTION_INDEX_CONCURRENCY = int(os.getenv("INGESTION_INDEX_CONCURRENCY", 2))
+
 
 class LLMConfigBuilderSingleton(abc.ABCMeta, type):
     """
@@ -50,13 +58,13 @@ class LLMConfigBuilder(metaclass=LLMConfigBuilderSingleton):
         self.default_tools = {}
         if self.config.enabled_default_agent_tools:
             self.default_tools = {
-                x.value: BASE_EXPERTS[x.value]
+                x.value: system_prompts.BASE_EXPERTS[x.value]
                 for x in self.config.enabled_default_agent_tools
             }
         self.default_experts = {}
         if self.config.enabled_default_experts:
             self.default_experts = {
-                x.value: BASE_EXPERTS[x.value]
+                x.value: system_prompts.BASE_EXPERTS[x.value]
                 for x in self.config.enabled_default_experts
             }
         self.experts_map = {**self.default_experts, **self.config.experts.__root__}
@@ -106,6 +114,31 @@ class LLMConfigBuilder(metaclass=LLMConfigBuilderSingleton):
 
         return self._expert_tools[expert_tools_key]
 
+    def get_search_all_experts_tools(self, tool_key: str) -> List[Tool]:
+        """The search all experts tool, if some expert has embeddings"""
+        handlers = {
+            expert_key: self.embeddings_factory.get_expert_embeddings(
+                self.llm_manager,
+                expert_key,
+                expert_config.embeddings.__root__,
+                vector_store=expert_config.vector_store,
+                vector_store_options=expert_config.vector_store_options,
+                embeddings_provider=expert_config.embeddings_provider,
+                chunking=expert_config.chunking,
+            )
+            for expert_key, expert_config in self.config.experts.__root__.items()
+            if expert_config.embeddings
+        }
+        if not handlers:
+            return []
+        retrievals = {
+            expert_key: self.config.experts.__root__[expert_key].retrieval
+            for expert_key in handlers
+        }
+        return [
+            self.embeddings_factory.get_search_all_tool(handlers, tool_key, retrievals)
+        ]
+
     @lru_cache
     def get_planner(
         self, session_id: str = "same-session", memory_key: str = "chat_history"
@@ -118,13 +151,19 @@ class LLMConfigBuilder(metaclass=LLMConfigBuilderSingleton):
             load_docs=False,
             index_name=self.config.planner.chain_key,
             index_prefix=f"{self.config.planner.chain_key}_",
+            vector_store=self.config.planner.vector_store,
+            vector_store_options=self.config.planner.vector_store_options,
+            embeddings_provider=self.config.planner.embeddings_provider,
+            chunking=self.config.planner.chunking,
         )
 
         embeddings_tools = []
         if self.config.chain.get_embeddings_as_tool:
             embeddings_tools.append(
                 embeddings.get_embeddings_tool_get_memory(
-                    tool_key=self.config.planner.chain_key
+                    tool_key=self.config.planner.chain_key,
+                    search_mode=self.config.planner.search_mode,
+                    retrieval=self.config.planner.retrieval,
                 )
             )
         if self.config.chain.save_embeddings_as_tool:
@@ -133,6 +172,10 @@ class LLMConfigBuilder(metaclass=LLMConfigBuilderSingleton):
                     tool_key=self.config.planner.chain_key
                 )
             )
+        if self.config.planner.search_all_experts_as_tool:
+            embeddings_tools.extend(
+                self.get_search_all_experts_tools(self.config.planner.chain_key)
+            )
         return PlannerManager(
             self.llm_manager,
             temperature=self.config.planner.temperature,
@@ -150,7 +193,11 @@ class LLMConfigBuilder(metaclass=LLMConfigBuilderSingleton):
     def get_chain_chat(
         self, session_id: str = "same-session", memory_key: str = "chat_history"
     ):
-        history = get_history(session_id, self.config.chain.chain_key)
+        history = get_history(
+            session_id,
+            self.config.chain.chain_key,
+            self.config.chain.history_window,
+        )
         memory = get_memory(
             self.llm_manager,
             chat_memory=history,
@@ -165,13 +212,19 @@ class LLMConfigBuilder(metaclass=LLMConfigBuilderSingleton):
             load_docs=False,
             index_name=self.config.chain.chain_key,
             index_prefix=f"{self.config.chain.chain_key}_",
+            vector_store=self.config.chain.vector_store,
+            vector_store_options=self.config.chain.vector_store_options,
+            embeddings_provider=self.config.chain.embeddings_provider,
+            chunking=self.config.chain.chunking,
         )
 
         embeddings_tools = []
         if self.config.chain.get_embeddings_as_tool:
             embeddings_tools.append(
                 embeddings.get_embeddings_tool_get_memory(
-                    tool_key=self.config.chain.chain_key
+                    tool_key=self.config.chain.chain_key,
+                    search_mode=self.config.chain.search_mode,
+                    retrieval=self.config.chain.retrieval,
                 )
             )
         if self.config.chain.save_embeddings_as_tool:
@@ -180,6 +233,10 @@ class LLMConfigBuilder(metaclass=LLMConfigBuilderSingleton):
                     tool_key=self.config.chain.chain_key
                 )
             )
+        if self.config.chain.search_all_experts_as_tool:
+            embeddings_tools.extend(
+                self.get_search_all_experts_tools(self.config.chain.chain_key)
+            )
 
         return ChainChatManager(
             self.llm_manager,
@@ -201,22 +258,51 @@ class LLMConfigBuilder(metaclass=LLMConfigBuilderSingleton):
             history=history,
         )
 
-    def load_docs(self):
+    def load_docs(
+        self, dry_run: bool = False, rebuild: bool = False
+    ) -> Dict[str, IngestionPlan]:
+        """
+        Ingest the embeddings sources of the chain and the experts, only the new and
+        changed ones unless rebuild.
+
+        :param dry_run: only plan the work
+        :param rebuild: drop the indexes and ingest everything again
+        :return: ingestion plan per index
+        """
         # main chain embeddings load
-        self.embeddings_factory.get_chain_embeddings(
+        chain_embeddings = self.embeddings_factory.get_chain_embeddings(
             self.llm_manager,
             self.config.chain.embeddings.__root__
             if self.config.chain.embeddings
             else None,
-            load_docs=True,
             index_name=self.config.chain.chain_key,
             index_prefix=f"{self.config.chain.chain_key}_",
+            vector_store=self.config.chain.vector_store,
+            vector_store_options=self.config.chain.vector_store_options,
+            embeddings_provider=self.config.chain.embeddings_provider,
+            chunking=self.config.chain.chunking,
         )
-
+        handlers = {self.config.chain.chain_key: chain_embeddings}
         for dict_expert_key, expert_config in self.config.experts.__root__.items():
-            self.embeddings_factory.get_expert_embeddings(
+            handlers[dict_expert_key] = self.embeddings_factory.get_expert_embeddings(
                 self.llm_manager,
                 dict_expert_key,
                 expert_config.embeddings.__root__,
-                load_docs=True,
+                vector_store=expert_config.vector_store,
+                vector_store_options=expert_config.vector_store_options,
+                embeddings_provider=expert_config.embeddings_provider,
+                chunking=expert_config.chunking,
             )
+
+        # indexes are ingested concurrently, their pipelines share the parse pool
+        with ThreadPoolExecutor(max_workers=INGESTION_INDEX_CONCURRENCY) as executor:
+            futures = {
+                key: executor.submit(
+                    handler.ingest,
+                    handler.embeddings,
+                    dry_run=dry_run,
+                    rebuild=rebuild,
+                )
+                for key, handler in handlers.items()
+            }
+            return {key: future.result() for key, future in futures.items()}
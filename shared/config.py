@@ -20,6 +20,14 @@ class DefaultAgentTools(Enum):
 class EmbeddingItem(BaseModel):
     content: Optional[str] = None
     folder_path: Optional[str] = None
+    # fnmatch patterns on the paths relative to folder_path, e.g. "*.md", "drafts/*"
+    include: Optional[List[str]] = None
+    exclude: Optional[List[str]] = None
+    # bytes, larger files are skipped (INGESTION_MAX_FILE_SIZE by default)
+    max_file_size: Optional[int] = None
+    # tokens per chunk of these sources, the chunking of the index when not set
+    chunk_size: Optional[int] = None
+    chunk_overlap: Optional[int] = None
 
 
 class Prompts(BaseModel):
@@ -29,6 +37,33 @@ class Prompts(BaseModel):
 
 EMBEDDINGS_TYPE = Dict[str, Optional[EmbeddingItem]]
 
+VECTOR_STORE_TYPE = Literal["redis", "numpy", "ivf"]
+
+
+class VectorStoreOptions(BaseModel):
+    """Tuning of the numpy and ivf vector stores, the env defaults when not set"""
+
+    # inverted lists (k-means centroids), changing it trains the index again
+    nlist: Optional[int] = None
+    # lists scanned per query, higher is slower with a better recall
+    nprobe: Optional[int] = None
+    # vectors kept quantized in memory, float32 re-rank of the best candidates
+    quantization: Optional[Literal["float16", "int8"]] = None
+    # candidates re-ranked per result
+    rerank: Optional[int] = None
+
+
+class ChunkingOptions(BaseModel):
+    """Chunking and retrieval of an index, the env defaults when not set"""
+
+    # tokens per node and shared by consecutive nodes
+    chunk_size: Optional[int] = None
+    chunk_overlap: Optional[int] = None
+    # tokens of the LLM prompt of the synthesize search mode
+    context_window: Optional[int] = None
+    # nodes per search
+    similarity_top_k: Optional[int] = None
+
 
 class Embeddings(BaseModel):
     __root__: EMBEDDINGS_TYPE
@@ -51,6 +86,20 @@ class ExpertItem(BaseModel):
     query_embeddings_before_ask: bool = True
     create_standalone_question_to_search_context: bool = True
     memory_type: Literal["default", "summary"] = "default"
+    # messages of the history loaded in memory per turn, None loads the whole session
+    history_window: Optional[int] = 20
+    # context from the embeddings: LLM synthesized answer or the retrieved nodes as is
+    search_mode: Literal["synthesize", "retrieve"] = "synthesize"
+    # nodes of the similarity search, or of the similarity and BM25 searches fused
+    retrieval: Literal["vector", "hybrid"] = "vector"
+    # vector store of the expert index, the VECTOR_STORE env when not set
+    vector_store: Optional[VECTOR_STORE_TYPE] = None
+    vector_store_options: Optional[VectorStoreOptions] = None
+    # embed model of the index: openai, local or package.module:attribute, the
+    # EMBEDDINGS_PROVIDER env when not set
+    embeddings_provider: Optional[str] = None
+    # chunk size, overlap and nodes per search of the index
+    chunking: Optional[ChunkingOptions] = None
 
     def get_chat_messages(self, text) -> List[BaseMessage]:
         template = ChatPromptTemplate.from_messages(
@@ -86,6 +135,14 @@ class Planner(BaseModel):
     )
     get_embeddings_as_tool: bool = True
     save_embeddings_as_tool: bool = True
+    # one tool searching the indexes of every expert, see EmbeddingsHandlerFactory
+    search_all_experts_as_tool: bool = False
+    search_mode: Literal["synthesize", "retrieve"] = "synthesize"
+    retrieval: Literal["vector", "hybrid"] = "vector"
+    vector_store: Optional[VECTOR_STORE_TYPE] = None
+    vector_store_options: Optional[VectorStoreOptions] = None
+    embeddings_provider: Optional[str] = None
+    chunking: Optional[ChunkingOptions] = None
 
 
 class Chain(BaseModel):
@@ -100,7 +157,15 @@ class Chain(BaseModel):
     )
     get_embeddings_as_tool: bool = True
     save_embeddings_as_tool: bool = True
+    search_all_experts_as_tool: bool = False
+    search_mode: Literal["synthesize", "retrieve"] = "synthesize"
+    retrieval: Literal["vector", "hybrid"] = "vector"
+    vector_store: Optional[VECTOR_STORE_TYPE] = None
+    vector_store_options: Optional[VectorStoreOptions] = None
+    embeddings_provider: Optional[str] = None
+    chunking: Optional[ChunkingOptions] = None
     memory_type: Literal["default", "summary"] = "default"
+    history_window: Optional[int] = 20
 
 
 class CustomModule(BaseModel):
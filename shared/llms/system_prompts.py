@@ -1,4 +1,10 @@
+"""
+Prompts of shared/experts_gpt.yaml (PROMPTS_FILE_PATH). The file is read and the
+module attributes below are built on first access, importing this module is free.
+"""
 import os
+from functools import lru_cache
+from typing import Any, Callable, Dict
 
 import yaml
 from langchain.prompts import PromptTemplate
@@ -8,8 +14,11 @@ from shared.config import DefaultAgentTools, ExpertItem, Prompts
 
 PROMPTS_FILE_PATH = os.getenv("PROMPTS_FILE_PATH", "shared/experts_gpt.yaml")
 
-with open(PROMPTS_FILE_PATH) as f:
-    config_prompts = yaml.safe_load(f)
+
+@lru_cache
+def get_config_prompts() -> Dict[str, Any]:
+    with open(PROMPTS_FILE_PATH) as f:
+        return yaml.safe_load(f)
 
 
 open_ai_prompt_template = """
@@ -27,78 +36,74 @@ def get_open_ai_prompt_template() -> PromptTemplate:
     )
 
 
-PROMPT_TOOL_ENGINEER_SYSTEM_PROMPT = SystemMessage(
-    **config_prompts["prompt_tool_engineer"]["system"]
-)
-
-PROMPT_TOOL_ENGINEER_HUMAN_PROMPT = HumanMessagePromptTemplate.from_template(
-    **config_prompts["prompt_tool_engineer"]["user"]
-)
-
-PROMPT_ENGINEER_SYSTEM_PROMPT = SystemMessage(
-    **config_prompts["prompt_engineer"]["system"]
-)
-
-PROMPT_ENGINEER_HUMAN_PROMPT = HumanMessagePromptTemplate.from_template(
-    **config_prompts["prompt_engineer"]["user"]
-)
-
-GENERAL_EXPERT = ExpertItem(
-    **{
-        **config_prompts[DefaultAgentTools.GENERALIST_EXPERT.value],
-        "prompts": Prompts(
-            **config_prompts[DefaultAgentTools.GENERALIST_EXPERT.value]["prompts"]
-        ),
-    },
-)
-NO_CODE_FUNCTIONS = ExpertItem(
-    **{
-        **config_prompts[DefaultAgentTools.NO_CODE_PYTHON_FUNCTIONS_EXPERT.value],
-        "prompts": Prompts(
-            **config_prompts[DefaultAgentTools.NO_CODE_PYTHON_FUNCTIONS_EXPERT.value][
-                "prompts"
-            ]
-        ),
-    },
-)
-THINKER_EXPERT = ExpertItem(
-    **{
-        **config_prompts[DefaultAgentTools.THINKER_EXPERT.value],
-        "prompts": Prompts(
-            **config_prompts[DefaultAgentTools.THINKER_EXPERT.value]["prompts"]
-        ),
-    },
-)
-SUMMARIZER_EXPERT = ExpertItem(
-    **{
-        **config_prompts[DefaultAgentTools.SUMMARIZER_EXPERT.value],
-        "prompts": Prompts(
-            **config_prompts[DefaultAgentTools.SUMMARIZER_EXPERT.value]["prompts"]
-        ),
-    },
-)
-BASE_EXPERTS = {
-    DefaultAgentTools.GENERALIST_EXPERT.value: GENERAL_EXPERT,
-    DefaultAgentTools.NO_CODE_PYTHON_FUNCTIONS_EXPERT.value: NO_CODE_FUNCTIONS,
-    DefaultAgentTools.THINKER_EXPERT.value: THINKER_EXPERT,
-    DefaultAgentTools.SUMMARIZER_EXPERT.value: SUMMARIZER_EXPERT,
+def get_base_expert(tool: DefaultAgentTools) -> ExpertItem:
+    config = get_config_prompts()[tool.value]
+    return ExpertItem(**{**config, "prompts": Prompts(**config["prompts"])})
+
+
+def get_base_experts() -> Dict[str, ExpertItem]:
+    return {
+        tool.value: get_base_expert(tool)
+        for tool in (
+            DefaultAgentTools.GENERALIST_EXPERT,
+            DefaultAgentTools.NO_CODE_PYTHON_FUNCTIONS_EXPERT,
+            DefaultAgentTools.THINKER_EXPERT,
+            DefaultAgentTools.SUMMARIZER_EXPERT,
+        )
+    }
+
+
+PROMPTS: Dict[str, Callable[[Dict[str, Any]], Any]] = {
+    "PROMPT_TOOL_ENGINEER_SYSTEM_PROMPT": lambda config: SystemMessage(
+        **config["prompt_tool_engineer"]["system"]
+    ),
+    "PROMPT_TOOL_ENGINEER_HUMAN_PROMPT": lambda config: (
+        HumanMessagePromptTemplate.from_template(
+            **config["prompt_tool_engineer"]["user"]
+        )
+    ),
+    "PROMPT_ENGINEER_SYSTEM_PROMPT": lambda config: SystemMessage(
+        **config["prompt_engineer"]["system"]
+    ),
+    "PROMPT_ENGINEER_HUMAN_PROMPT": lambda config: (
+        HumanMessagePromptTemplate.from_template(**config["prompt_engineer"]["user"])
+    ),
+    "GENERAL_EXPERT": lambda config: get_base_expert(
+        DefaultAgentTools.GENERALIST_EXPERT
+    ),
+    "NO_CODE_FUNCTIONS": lambda config: get_base_expert(
+        DefaultAgentTools.NO_CODE_PYTHON_FUNCTIONS_EXPERT
+    ),
+    "THINKER_EXPERT": lambda config: get_base_expert(DefaultAgentTools.THINKER_EXPERT),
+    "SUMMARIZER_EXPERT": lambda config: get_base_expert(
+        DefaultAgentTools.SUMMARIZER_EXPERT
+    ),
+    "BASE_EXPERTS": lambda config: get_base_experts(),
+    "CHAT_HUMAN_PROMPT_TEMPLATE": lambda config: (
+        HumanMessagePromptTemplate.from_template(
+            config["chat_human_prompt_template"], role="user"
+        )
+    ),
+    "CHAT_SYSTEM_PROMPT_STANDALONE_QUESTION": lambda config: SystemMessage(
+        **config["standalone_question_prompt_template"]["system"]
+    ),
+    "GET_MEMORIES_TOOL_PROMPT": lambda config: config["embedding_tools"][
+        "get_embedding_tool_description"
+    ],
+    "SAVE_MEMORIES_TOOL_PROMPT": lambda config: config["embedding_tools"][
+        "save_embedding_tool_description"
+    ],
+    "SEARCH_ALL_EXPERTS_TOOL_PROMPT": lambda config: config["embedding_tools"][
+        "search_all_experts_tool_description"
+    ],
+    "PLANNER_SYSTEM_PROMPT": lambda config: config["planner_system_prompt"],
 }
-CHAT_HUMAN_PROMPT_TEMPLATE = HumanMessagePromptTemplate.from_template(
-    config_prompts["chat_human_prompt_template"],
-    role="user",
-)
-
-CHAT_SYSTEM_PROMPT_STANDALONE_QUESTION = SystemMessage(
-    **config_prompts["standalone_question_prompt_template"]["system"]
-)
-
-GET_MEMORIES_TOOL_PROMPT = config_prompts["embedding_tools"][
-    "get_embedding_tool_description"
-]
-
-SAVE_MEMORIES_TOOL_PROMPT = config_prompts["embedding_tools"][
-    "save_embedding_tool_description"
-]
 
 
-PLANNER_SYSTEM_PROMPT = config_prompts["planner_system_prompt"]
+def __getattr__(name: str) -> Any:
+    if name not in PROMPTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = PROMPTS[name](get_config_prompts())
+    # cached as a module attribute, __getattr__ is not called again for it
+    globals()[name] = value
+    return value
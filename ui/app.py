@@ -1,8 +1,8 @@
+import importlib.util
 import logging
 
 import dash
 import dash_bootstrap_components as dbc
-import torch
 from dash import Dash, html
 from dotenv import load_dotenv
 
@@ -65,15 +65,25 @@ app.layout = html.Div(
     ]
 )
 
-if torch.cuda.is_available():
-    logging.warning("GPU is available")
-    logging.warning(f"GPU device number: {torch.cuda.current_device()}")
-    logging.warning(f"Number of GPUs available: {torch.cuda.device_count()}")
-    logging.warning(
-        f"Device name: {torch.cuda.get_device_name(torch.cuda.current_device())}"
-    )
-else:
-    logging.warning("GPU is not available")
+
+def log_gpu_availability():
+    """torch takes seconds to import, so it is only checked when the app is run"""
+    if importlib.util.find_spec("torch") is None:
+        logging.warning("torch is not installed, GPU availability unknown")
+        return
+    import torch
+
+    if torch.cuda.is_available():
+        logging.warning("GPU is available")
+        logging.warning(f"GPU device number: {torch.cuda.current_device()}")
+        logging.warning(f"Number of GPUs available: {torch.cuda.device_count()}")
+        logging.warning(
+            f"Device name: {torch.cuda.get_device_name(torch.cuda.current_device())}"
+        )
+    else:
+        logging.warning("GPU is not available")
+
 
 if __name__ == "__main__":
+    log_gpu_availability()
     app.run(debug=True, host="0.0.0.0", port=8000)
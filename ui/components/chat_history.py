@@ -44,13 +44,26 @@ def get_chat_item(session_id, created_at):
     )
 
 
-def create_chat_list(chats_uuids):
-    return [
+def create_chat_list(chats_uuids, limit=None):
+    session_ids = list(chats_uuids.keys())
+    items = [
         dcc.ConfirmDialog(
             id="btn-chat-session-remove-confirm",
             message="Are you sure you want to remove this chat?",
         )
     ] + [
         get_chat_item(session_id, chats_uuids[session_id])
-        for session_id in chats_uuids.keys()
+        for session_id in session_ids[:limit]
     ]
+    if limit is not None and len(session_ids) > limit:
+        items.append(
+            dbc.ListGroupItem(
+                dbc.Button(
+                    "Older chats",
+                    id="btn-chat-sessions-more",
+                    color="secondary",
+                    style={"width": "100%"},
+                )
+            )
+        )
+    return items
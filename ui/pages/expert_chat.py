@@ -8,6 +8,7 @@ import dash_bootstrap_components as dbc
 from dash import ALL, Input, Output, State, dcc, html
 from langchain.schema.messages import AIMessage, HumanMessage
 
+from expert_gpts.chat_history.mysql import CHAT_SESSIONS_PAGE_SIZE
 from expert_gpts.llms.chat_managers import get_history
 from expert_gpts.main import LLMConfigBuilder
 from ui.components.chat import CHAT_COMPONENT_TEMPLATE
@@ -25,7 +26,9 @@ configurations = get_configs()
 def layout(config_key=None):
     config = configurations[config_key].config
     SESSION_ID = str(uuid.uuid4())
-    chats_uuids = get_chats_list(config.chain.chain_key, SESSION_ID)
+    chats_uuids = get_chats_list(
+        config.chain.chain_key, SESSION_ID, CHAT_SESSIONS_PAGE_SIZE
+    )
     experts_list = list(config.experts.__root__.keys())
     return html.Div(
         children=[
@@ -36,6 +39,7 @@ def layout(config_key=None):
             ),
             dcc.Store(id="session_chat_to_remove", data=None),
             dcc.Store(id="chat_history", data=chats_uuids),
+            dcc.Store(id="chat_sessions_limit", data=CHAT_SESSIONS_PAGE_SIZE),
             dcc.Store(id="config_key", data=config_key),
             dcc.Store(id="web-chat-page-memory"),
             dcc.Store(id="session", data=dict(uid=SESSION_ID)),
@@ -107,7 +111,7 @@ def layout(config_key=None):
                                 "Chats History", className="p-2 mx-auto text-center"
                             ),
                             dbc.ListGroup(
-                                create_chat_list(chats_uuids),
+                                create_chat_list(chats_uuids, CHAT_SESSIONS_PAGE_SIZE),
                                 id="chats-message-history",
                             ),
                         ],
@@ -237,6 +241,7 @@ def get_answer(data, session, config_key, chats_prevs):
     Output("current_expert", "children"),
     Output("chat_title", "children"),
     Output("chats-message-history", "children"),
+    Output("chat_sessions_limit", "data", allow_duplicate=True),
     State("session", "data"),
     Input("config_key", "data"),
     Input({"type": "btn-expert-init", "index": ALL}, "n_clicks_timestamp"),
@@ -249,8 +254,10 @@ def get_expert_chat(session_id, config_key, n_clicks, value):
         (n_click, val) for n_click, val in zip(n_clicks, value) if n_click
     ]
     last_clicked = sorted(valued_n_clicks, key=lambda x: x[0])[-1][1]
+    # another expert starts again from the first page of its sessions
+    limit = CHAT_SESSIONS_PAGE_SIZE
     if last_clicked == "chain":
-        chats_uuids = get_chats_list(config.chain.chain_key, session_id["uid"])
+        chats_uuids = get_chats_list(config.chain.chain_key, session_id["uid"], limit)
         return [
             [
                 get_system_chat_item(
@@ -261,10 +268,11 @@ def get_expert_chat(session_id, config_key, n_clicks, value):
             ],
             last_clicked,
             f"{configurations[config_key].config.chain.chain_key} Chain",
-            create_chat_list(chats_uuids),
+            create_chat_list(chats_uuids, limit),
+            limit,
         ]
     if last_clicked == "planner":
-        chats_uuids = get_chats_list(config.planner.chain_key, session_id["uid"])
+        chats_uuids = get_chats_list(config.planner.chain_key, session_id["uid"], limit)
         return [
             [
                 get_system_chat_item(
@@ -275,14 +283,16 @@ def get_expert_chat(session_id, config_key, n_clicks, value):
             ],
             last_clicked,
             f"{configurations[config_key].config.planner.chain_key} Planner",
-            create_chat_list(chats_uuids),
+            create_chat_list(chats_uuids, limit),
+            limit,
         ]
-    chats_uuids = get_chats_list(last_clicked, session_id["uid"])
+    chats_uuids = get_chats_list(last_clicked, session_id["uid"], limit)
     return [
         [get_system_chat_item(f"Hello I am {last_clicked} assistant!")],
         last_clicked,
         config.experts.__root__[last_clicked].name or last_clicked,
-        create_chat_list(chats_uuids),
+        create_chat_list(chats_uuids, limit),
+        limit,
     ]
 
 
@@ -312,6 +322,7 @@ def download_log(last_download_at, n_clicks, n_clicks_timestamp, log):
     Output("chats-message-history", "children", allow_duplicate=True),
     Output("session_chat_to_remove", "data", allow_duplicate=True),
     State("session", "data"),
+    State("chat_sessions_limit", "data"),
     Input("config_key", "data"),
     Input("current_expert", "children"),
     Input("session_chat_to_remove", "data"),
@@ -319,7 +330,12 @@ def download_log(last_download_at, n_clicks, n_clicks_timestamp, log):
     prevent_initial_call=True,
 )
 def remove_chat_session(
-    session_id, config_key, current_expert, session_chat_to_remove, submit_n_clicks
+    session_id,
+    limit,
+    config_key,
+    current_expert,
+    session_chat_to_remove,
+    submit_n_clicks,
 ):
     if not submit_n_clicks:
         return dash.no_update
@@ -328,8 +344,31 @@ def remove_chat_session(
 
     chat_history = get_history(session_id["uid"], ai_key)
     chat_history.delete_chat_session(session_chat_to_remove)
-    chats_uuids = get_chats_list(ai_key, session_id["uid"])
-    return [create_chat_list(chats_uuids), None]
+    chats_uuids = get_chats_list(ai_key, session_id["uid"], limit)
+    return [create_chat_list(chats_uuids, limit), None]
+
+
+@dash.callback(
+    Output("chats-message-history", "children", allow_duplicate=True),
+    Output("chat_sessions_limit", "data", allow_duplicate=True),
+    State("session", "data"),
+    State("chat_sessions_limit", "data"),
+    State("config_key", "data"),
+    State("current_expert", "children"),
+    Input("btn-chat-sessions-more", "n_clicks"),
+    prevent_initial_call=True,
+)
+def show_older_chat_sessions(session_id, limit, config_key, current_expert, n_clicks):
+    if not n_clicks:
+        return dash.no_update
+    config = configurations[config_key].config
+    ai_key = {
+        "chain": config.chain.chain_key,
+        "planner": config.planner.chain_key,
+    }.get(current_expert, current_expert)
+    limit += CHAT_SESSIONS_PAGE_SIZE
+    chats_uuids = get_chats_list(ai_key, session_id["uid"], limit)
+    return [create_chat_list(chats_uuids, limit), limit]
 
 
 @dash.callback(
@@ -1,6 +1,9 @@
+from typing import Optional
+
 from expert_gpts.llms.chat_managers import get_history
 
 
-def get_chats_list(config_key, session_id):
+def get_chats_list(config_key, session_id, limit: Optional[int] = None):
+    """Sessions of config_key, with limit one more to tell there are older ones"""
     chat_history = get_history(session_id, config_key)
-    return chat_history.get_chats_sessions()
+    return chat_history.get_chats_sessions(None if limit is None else limit + 1)